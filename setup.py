@@ -35,6 +35,7 @@ setup(
                       'ipython==5.3.0', 'lz4', 'mock', 'numpy', 'pandas', 'pefile',
                       'py2neo==1.6.4', 'pymongo', 'pytest', 'rekall==1.0.3', 'requests',
                       'ssdeep==2.9-0.3', 'urllib3', 'yara', 'zerorpc', 'cython'],
+    extras_require={'inotify': ['inotify_simple; sys_platform == "linux"']},
     license='MIT',
     zip_safe=False,
     keywords='workbench security python',
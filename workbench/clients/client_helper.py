@@ -2,7 +2,9 @@
 
 import configparser
 import argparse
+import itertools
 import os
+import zerorpc
 
 def grab_server_args():
     """Grab server info from configuration file"""
@@ -22,3 +24,26 @@ def grab_server_args():
     port = str(args.port)
 
     return {'server':server, 'port':port, 'commands': commands}
+
+def flatten_batches(batches):
+    """Flatten the batches of a stream_sample(md5, {'batch_size': N}) back into a stream of rows"""
+    return itertools.chain.from_iterable(batches)
+
+def resumable_stream(stream_request, kwargs=None, retries=3):
+    """Run a streaming request with cursors, resuming it where it stopped if the connection drops
+
+       Example: rows = resumable_stream(lambda kwargs: workbench.stream_sample(md5, kwargs), {'batch_size': 1000})
+                outputs = resumable_stream(lambda kwargs: workbench.set_work_request('strings', set_md5, None, kwargs))
+    """
+    kwargs = dict(kwargs or {}, cursor=True)
+    while True:
+        try:
+            for item in stream_request(kwargs):
+                kwargs['resume_from'] = item['cursor']
+                yield item['data']
+            return
+        except (zerorpc.LostRemote, zerorpc.TimeoutExpired):
+            if not retries:
+                raise
+            retries -= 1
+            print('Stream interrupted, resuming...')
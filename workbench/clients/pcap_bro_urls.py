@@ -32,7 +32,8 @@ def run():
             # Just grab the http log
             if 'http_log' in results['pcap_bro']:
                 log_md5 = results['pcap_bro']['http_log']
-                http_data = workbench.stream_sample(log_md5)  # None Means all data
+                http_data = workbench.stream_sample(log_md5, {'columns': ['host'], 'batch_size': 1000})
+                http_data = client_helper.flatten_batches(http_data)  # Just the host column, 1000 rows at a time
                 urls = set( row['host'] for row in http_data)
                 print('<<< %s >>>' % filename)
                 pprint.pprint(list(urls))
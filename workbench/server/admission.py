@@ -0,0 +1,236 @@
+"""AdmissionControl class for WorkBench.
+
+   Puts limits on how much work the server takes on at once: the number of
+   requests in flight, the sample bytes those requests pull into memory and
+   the number of concurrent executions of specific workers (bulkheads).
+   Requests over the limits wait in a bounded queue and are then rejected
+   fast with an Overloaded error (which is safe to retry).
+
+   Note: Workers that call back into Workbench (pcap_bro, view_pcap_deep, ...)
+         make nested requests while their parent request holds a slot. The
+         nested requests ride along on the parent admission (the server knows
+         them from request_context.RequestContext), otherwise the parents
+         could hold every slot while their nested requests wait for one.
+"""
+
+import time
+import collections
+import contextlib
+import gevent.event
+import gevent.local
+import gevent.lock
+
+
+class Overloaded(Exception):
+    """Workbench is over its admission limits, the request can be retried later."""
+    pass
+
+
+class AdmissionControl(object):
+    """Admission control and backpressure for Workbench."""
+
+    def __init__(self, max_in_flight=0, max_in_flight_bytes=0, max_queue=0, queue_timeout=30, worker_concurrency=None):
+        """Initialization for the AdmissionControl class.
+
+        Args:
+            max_in_flight: maximum number of requests being worked on (0 for no limit).
+            max_in_flight_bytes: maximum sample bytes of the requests being worked on (0 for no limit).
+            max_queue: maximum number of requests waiting for admission (0 for no limit).
+            queue_timeout: seconds a request waits for admission before it's rejected.
+            worker_concurrency: dictionary of worker_name: maximum concurrent executions.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.worker_semaphores = {name: gevent.lock.BoundedSemaphore(limit)
+                                  for name, limit in (worker_concurrency or {}).items()}
+
+        # Current state
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.waiters = collections.deque()
+        self.rejected = 0
+
+        # Requests made from within an admitted request (same greenlet) are already admitted
+        self.local = gevent.local.local()
+
+    def queue_depth(self):
+        """Number of requests waiting for admission."""
+        return len(self.waiters)
+
+    def _has_room(self, num_bytes):
+        """Internal: Is there room for a request with num_bytes?"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return False
+
+        # A request bigger than the byte limit is let in when nothing else is in flight
+        if self.max_in_flight_bytes and self.in_flight_bytes and \
+           self.in_flight_bytes + num_bytes > self.max_in_flight_bytes:
+            return False
+        return True
+
+    def _reject(self, reason):
+        """Internal: Reject the request."""
+        self.rejected += 1
+        raise Overloaded('Workbench is overloaded (%s), please retry later' % reason)
+
+    @contextlib.contextmanager
+    def admit(self, num_bytes=0, nested=False):
+        """Admit a request, waiting in the queue if the server is at its limits.
+
+        Args:
+            num_bytes: the sample bytes the request will pull into memory.
+            nested: the request is made by a worker of an admitted request (it doesn't take a slot).
+
+        Raises:
+            Overloaded: When the queue is full or the request waited longer than queue_timeout.
+        """
+
+        # Nested requests (worker callbacks or requests on the same greenlet) ride along on the parent admission
+        if nested or getattr(self.local, 'admitted', False):
+            yield
+            return
+
+        # Wait in the queue if there's no room
+        if not self._has_room(num_bytes):
+            if self.max_queue and len(self.waiters) >= self.max_queue:
+                self._reject('%d requests queued' % len(self.waiters))
+            waiter = gevent.event.Event()
+            self.waiters.append(waiter)
+            try:
+                deadline = time.time() + self.queue_timeout
+                while not self._has_room(num_bytes):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._reject('waited %d seconds in the queue' % self.queue_timeout)
+                    waiter.clear()
+                    waiter.wait(remaining)
+            finally:
+                self.waiters.remove(waiter)
+
+        # Admitted
+        self.in_flight += 1
+        self.in_flight_bytes += num_bytes
+        self.local.admitted = True
+        try:
+            yield
+        finally:
+            self.local.admitted = False
+            self.in_flight -= 1
+            self.in_flight_bytes -= num_bytes
+
+            # Wake up the queue so the waiters can check for room
+            for waiter in list(self.waiters):
+                waiter.set()
+
+    @contextlib.contextmanager
+    def bulkhead(self, worker_name):
+        """Limit the concurrent executions of a worker (if it has a limit).
+
+        Args:
+            worker_name: the name of the worker.
+
+        Raises:
+            Overloaded: When the worker stayed at its limit for longer than queue_timeout.
+        """
+        semaphore = self.worker_semaphores.get(worker_name)
+        if not semaphore:
+            yield
+            return
+        if not semaphore.acquire(timeout=self.queue_timeout):
+            self._reject('%s is at its concurrency limit' % worker_name)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+def parse_worker_concurrency(config_value):
+    """Parse a 'worker:limit, worker:limit' config string into a dictionary.
+
+    Args:
+        config_value: the string from the config file (e.g. 'pcap_bro:2, mem_procdump:1').
+
+    Returns:
+        A dictionary of worker_name: limit.
+    """
+    limits = {}
+    for item in config_value.split(','):
+        if item.strip():
+            name, limit = item.split(':')
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+def test():
+    """Test for the AdmissionControl class."""
+    import gevent
+
+    assert parse_worker_concurrency('pcap_bro:2, mem_procdump : 1') == {'pcap_bro': 2, 'mem_procdump': 1}
+    assert parse_worker_concurrency('') == {}
+
+    admission = AdmissionControl(max_in_flight=2, max_in_flight_bytes=100, max_queue=1, queue_timeout=0.5,
+                                 worker_concurrency={'pcap_bro': 1})
+    results = []
+
+    def request(name, num_bytes, duration):
+        try:
+            with admission.admit(num_bytes):
+                # Nested requests don't take another slot
+                with admission.admit(num_bytes):
+                    gevent.sleep(duration)
+            results.append((name, 'ok'))
+        except Overloaded:
+            results.append((name, 'rejected'))
+
+    # Two fit, one queues (and gets in when the first finishes), one is rejected (queue full)
+    jobs = [gevent.spawn(request, 'a', 10, 0.1), gevent.spawn(request, 'b', 10, 0.3)]
+    gevent.sleep(0)
+    assert admission.in_flight == 2
+    jobs += [gevent.spawn(request, 'c', 10, 0.1)]
+    gevent.sleep(0)
+    assert admission.queue_depth() == 1
+    jobs += [gevent.spawn(request, 'd', 10, 0.1)]
+    gevent.joinall(jobs)
+    print(results)
+    assert sorted(results) == [('a', 'ok'), ('b', 'ok'), ('c', 'ok'), ('d', 'rejected')]
+    assert admission.in_flight == 0 and admission.in_flight_bytes == 0
+
+    # Worker callbacks (other greenlets) don't wait for a slot the parents are holding
+    results[:] = []
+    def parent(name):
+        with admission.admit():
+            callback = gevent.spawn(request_nested, name)
+            callback.join()
+        results.append((name, callback.value))
+    def request_nested(name):
+        with admission.admit(nested=True):
+            return 'ok'
+    gevent.joinall([gevent.spawn(parent, 'p1'), gevent.spawn(parent, 'p2')])
+    assert sorted(results) == [('p1', 'ok'), ('p2', 'ok')] and admission.rejected == 1
+
+    # Byte limit: the second big request waits too long and is rejected
+    results[:] = []
+    gevent.joinall([gevent.spawn(request, 'big1', 80, 1.0), gevent.spawn(request, 'big2', 80, 0.1)])
+    print(results)
+    assert sorted(results) == [('big1', 'ok'), ('big2', 'rejected')]
+    assert admission.rejected == 2
+
+    # Bulkhead
+    def bro(name):
+        try:
+            with admission.bulkhead('pcap_bro'):
+                gevent.sleep(1.0)
+            results.append((name, 'ok'))
+        except Overloaded:
+            results.append((name, 'rejected'))
+    results[:] = []
+    gevent.joinall([gevent.spawn(bro, 'bro1'), gevent.spawn(bro, 'bro2')])
+    with admission.bulkhead('meta'):
+        pass
+    print(results)
+    assert sorted(results) == [('bro1', 'ok'), ('bro2', 'rejected')]
+
+if __name__ == '__main__':
+    test()
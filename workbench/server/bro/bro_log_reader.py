@@ -2,11 +2,27 @@
 
    The read_log method is a generator (in the python sense) for rows in a Bro log,
    because of this, it's memory efficient and does not read the entire file into memory.
+
+   Values are converted using the types Bro declares in the #types header line
+   (one converter per column, built once per log) so a 'count' is always an int,
+   a 'string' that happens to look like a number stays a string, sets and vectors
+   come back as lists and unset fields come back as None.
+
+   The read_columns and read_dataframes methods parse a log into typed NumPy
+   columns (or pandas DataFrames) in chunks of rows, converting each column
+   in one go instead of one value at a time: times become datetime64, counts
+   int64 and in the DataFrames the addresses become categoricals.
 """
 
 import datetime
 import optparse
+import os
 import time
+import numpy as np
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
 
 
 class BroLogReader(object):
@@ -15,6 +31,9 @@ class BroLogReader(object):
     def __init__(self, convert_datetimes=True):
         """Init for BroLogReader."""
         self.delimiter = '\t'
+        self.set_separator = ','
+        self.empty_field = '(empty)'
+        self.unset_field = '-'
         self.convert_datetimes = convert_datetimes
 
     def read_log(self, logfile):
@@ -26,40 +45,130 @@ class BroLogReader(object):
                 do something with row
 
         Args:
-            logfile: The Bro Log file.
+            logfile: The Bro Log file (or an iterator of its lines, see sample_stream.lines).
         """
 
-        # Make sure we're at the beginning
-        logfile.seek(0)
+        # Make sure we're at the beginning (of a file, logs can also be streamed in as an iterator of lines)
+        if hasattr(logfile, 'seek'):
+            logfile.seek(0)
 
-        # First parse the header of the bro log
-        field_names, _ = self._parse_bro_header(logfile)
+        # First parse the header of the bro log and build the converter for each column
+        field_names, field_types = self._parse_bro_header(logfile)
 
         # Note: SO stupid to write a csv reader, but csv.DictReader on Bro
         #       files was doing something weird with generator output that
         #       affected zeroRPC and gave 'could not route _zpc_more' error.
         #       So wrote my own, put a sleep at the end, seems to fix it.
-        while 1:
-            _line = next(logfile).strip()
-            if not _line.startswith('#close'):
-                yield self._cast_dict(dict(list(zip(field_names, _line.split(self.delimiter)))))
-            else:
-                time.sleep(.1) # Give time for zeroRPC to finish messages
+        for row in self._rows(field_names, field_types, logfile):
+            yield row
+        time.sleep(.1) # Give time for zeroRPC to finish messages
+
+    def read_tail(self, header_lines, lines):
+        """The read_tail method parses the lines appended to a Bro log that's still being written.
+
+        Usage:
+            rows = my_bro_reader.read_tail(header_lines, new_lines)
+
+        Args:
+            header_lines: The header lines of the log (up to and including the #types line).
+            lines: The new (complete) lines of the log.
+
+        Returns:
+            A generator of rows (just like read_log).
+        """
+        field_names, field_types = self._parse_bro_header(iter(header_lines))
+        return self._rows(field_names, field_types, lines)
+
+    def _rows(self, field_names, field_types, lines):
+        """Internal method that converts the lines after the header into rows (stops at #close,
+           the missing fields of a short row, e.g. a truncated last line, are unset)."""
+        columns = list(zip(field_names, [self._converter(field_type) for field_type in field_types]))
+        num_fields = len(columns)
+        for _line in lines:
+            _line = self._decode(_line).rstrip('\r\n')
+            if _line.startswith('#close'):
                 break
+            if not _line or _line.startswith('#'):
+                continue
+            values = _line.split(self.delimiter)
+            if len(values) < num_fields:
+                values += [self.unset_field] * (num_fields - len(values))
+            yield self._cast_dict({name: convert(value) for (name, convert), value in zip(columns, values)})
+
+    def read_columns(self, logfile, chunk_size=100000):
+        """The read_columns method returns a generator of column chunks of a Bro log.
+
+        Usage:
+            for columns in my_bro_reader.read_columns(logfile):
+                columns['ts'], columns['id.orig_h']...
+
+        Args:
+            logfile: The Bro Log file.
+            chunk_size: the number of rows in each chunk (None for all the rows in one chunk).
+
+        Returns:
+            A generator of {field name: NumPy array} chunks. Times are datetime64[us]
+            (NaT when unset), intervals/doubles float64, counts/ints/ports int64
+            (float64 with NaN when a chunk has unset values), bools bool (object
+            with None when a chunk has unset values) and
+            everything else (including the lists of sets/vectors) object arrays.
+            Note: rows with the same set/vector value share the list, don't modify them in place.
+        """
+        if hasattr(logfile, 'seek'):
+            logfile.seek(0)
+        field_names, field_types = self._parse_bro_header(logfile)
+        column_types = [(name, field_type) for name, field_type in zip(field_names, field_types)
+                        if name != 'resp_body_data']
+        keep = [index for index, name in enumerate(field_names) if name != 'resp_body_data']
+
+        # Split the lines into chunks of rows and convert the columns of each chunk (a short
+        # row, e.g. a truncated last line, is padded with unset values like read_log does)
+        num_fields = len(field_names)
+        rows = []
+        for _line in logfile:
+            if isinstance(_line, bytes):
+                _line = _line.decode('utf-8', 'replace')
+            if _line.startswith('#'):
+                if _line.startswith('#close'):
+                    break
+                continue
+            _line = _line.rstrip('\r\n')
+            if _line:
+                values = _line.split(self.delimiter)
+                if len(values) != num_fields:
+                    values = (values + [self.unset_field] * num_fields)[:num_fields]
+                rows.append(values)
+            if len(rows) == chunk_size:
+                yield self._columns(column_types, keep, rows)
+                rows = []
+        if rows:
+            yield self._columns(column_types, keep, rows)
+
+    def read_dataframes(self, logfile, chunk_size=100000):
+        """The read_dataframes method returns a generator of pandas DataFrame chunks of a Bro log.
+
+        Args:
+            logfile: The Bro Log file.
+            chunk_size: the number of rows in each chunk.
 
+        Returns:
+            A generator of DataFrames (see read_columns), with the addr and enum columns as categoricals.
+        """
+        if not pd:
+            raise RuntimeError('read_dataframes requires pandas: $ pip install pandas')
+        for columns in self.read_columns(logfile, chunk_size):
+            yield pd.DataFrame({name: self._categorical(name, values) for name, values in columns.items()},
+                               columns=list(columns.keys()))
 
     def _parse_bro_header(self, logfile):
-        """This method tries to parse the Bro log header section.
+        """This method parses the Bro log header section.
 
-        Note: My googling is failing me on the documentation on the format,
-        so just making a lot of assumptions and skipping some shit.
-        Assumption 1: The delimeter is a tab.
-        Assumption 2: Types are either time, string, int or float
-        Assumption 3: The header always ends with #fields and #types as
-                      the last two lines.
+        The #separator, #set_separator, #empty_field and #unset_field lines
+        set how the rows are split and which values mean empty/unset, the
+        header ends with the #fields and #types lines.
 
         Format example:
-            #separator \x09
+            #separator \\x09
             #set_separator	,
             #empty_field	(empty)
             #unset_field	-
@@ -74,25 +183,137 @@ class BroLogReader(object):
             A tuple of 2 lists. One for field names and other for field types.
         """
 
-        # Skip until you find the #fields line
-        _line = next(logfile)
+        # Read the header lines until you find the #fields line
+        _line = self._decode(next(logfile)).rstrip('\r\n')
         while (not _line.startswith('#fields')):
-            _line = next(logfile)
+            if _line.startswith('#separator'):
+                self.delimiter = _line.split(None, 1)[1].encode('ascii').decode('unicode_escape')
+            else:
+                key, _, value = _line.partition(self.delimiter)
+                if key == '#set_separator':
+                    self.set_separator = value
+                elif key == '#empty_field':
+                    self.empty_field = value
+                elif key == '#unset_field':
+                    self.unset_field = value
+            _line = self._decode(next(logfile)).rstrip('\r\n')
 
         # Read in the field names
-        _field_names = _line.strip().split(self.delimiter)[1:]
+        _field_names = _line.split(self.delimiter)[1:]
 
         # Read in the types
-        _line = next(logfile)
-        _field_types = _line.strip().split(self.delimiter)[1:]
+        _line = self._decode(next(logfile)).rstrip('\r\n')
+        _field_types = _line.split(self.delimiter)[1:]
 
         # Return the header info
+        self.field_types = dict(zip(_field_names, _field_types))
         return _field_names, _field_types
 
+    def _converter(self, field_type):
+        """Internal method that builds the converter for a Bro type.
+
+        Args:
+            field_type: the Bro type (time, interval, count, int, double, addr,
+                        port, bool, string, enum, set[type], vector[type]...).
+
+        Returns:
+            A function that converts a value of that type (unset values to None).
+        """
+        unset_field = self.unset_field
+
+        # Containers are lists of their element type (empty ones are [])
+        if field_type.endswith(']') and '[' in field_type:
+            element = self._converter(field_type[field_type.index('[')+1:-1])
+            set_separator, empty_field = self.set_separator, self.empty_field
+            def convert(value):
+                if value == unset_field:
+                    return None
+                if value == empty_field:
+                    return []
+                return [element(item) for item in value.split(set_separator)]
+            return convert
+
+        if field_type == 'time':
+            if self.convert_datetimes:
+                cast = lambda value: datetime.datetime.fromtimestamp(float(value))
+            else:
+                cast = float
+        elif field_type in ('interval', 'double'):
+            cast = float
+        elif field_type in ('count', 'int', 'port'):
+            cast = int
+        elif field_type == 'bool':
+            cast = lambda value: value == 'T'
+        elif field_type == 'string':
+            empty_field = self.empty_field
+            cast = lambda value: '' if value == empty_field else value
+        else:
+            cast = str
+        return lambda value: None if value == unset_field else cast(value)
+
+    def _columns(self, column_types, keep, rows):
+        """Internal method that converts a chunk of split rows into typed columns."""
+        values = list(zip(*rows))
+        return {name: self._column(field_type, values[index]) for (name, field_type), index in zip(column_types, keep)}
+
+    def _column(self, field_type, values):
+        """Internal method that converts the string values of a column chunk into a typed NumPy array.
+
+        Args:
+            field_type: the Bro type of the column.
+            values: a sequence of the string values of the column.
+
+        Returns:
+            A NumPy array (see read_columns for the dtypes).
+        """
+        unset_field = self.unset_field
+        has_unset = unset_field in values
+
+        # Numbers (and times) are converted by NumPy in one go, unset values become NaN (or NaT)
+        if field_type in ('time', 'interval', 'double', 'count', 'int', 'port'):
+            if field_type in ('count', 'int', 'port') and not has_unset:
+                return np.array(values, dtype=np.int64)
+            if has_unset:
+                values = ['nan' if value == unset_field else value for value in values]
+            numbers = np.array(values, dtype=np.float64)
+            if field_type != 'time':
+                return numbers
+            missing = np.isnan(numbers)
+            times = np.round(np.where(missing, 0.0, numbers) * 1e6).astype(np.int64).astype('datetime64[us]')
+            times[missing] = np.datetime64('NaT')
+            return times
+        if field_type == 'bool':
+            flags = np.array(values, dtype=object) == 'T'
+            if not has_unset:
+                return flags
+            flags = flags.astype(object)
+            flags[np.array(values, dtype=object) == unset_field] = None
+            return flags
+
+        # Containers are object arrays of lists (converted once per distinct value and shared by the rows)
+        if '[' in field_type:
+            convert = self._converter(field_type)
+            converted = {value: convert(value) for value in set(values)}
+            column = np.empty(len(values), dtype=object)
+            column[:] = [converted[value] for value in values]
+            return column
+
+        # Everything else is an object array of strings
+        strings = np.array(values, dtype=object)
+        if has_unset:
+            strings[strings == unset_field] = None
+        if field_type == 'string' and self.empty_field in values:
+            strings[strings == self.empty_field] = ''
+        return strings
+
+    def _categorical(self, name, values):
+        """Internal method that turns the addr and enum columns into pandas categoricals."""
+        if self.field_types.get(name) in ('addr', 'enum'):
+            return pd.Categorical(values)
+        return values
+
     def _cast_dict(self, data_dict):
-        """Internal method that makes sure any dictionary elements
-        are properly cast into the correct types, instead of
-        just treating everything like a string from the csv file.
+        """Internal method that cleans up a row dictionary.
 
         Args:
             data_dict: dictionary containing bro log data.
@@ -100,8 +321,6 @@ class BroLogReader(object):
         Returns:
             Cleaned Data dict.
         """
-        for key, value in data_dict.items():
-            data_dict[key] = self._cast_value(value)
 
         # Fixme: resp_body_data can be very large so removing it for now
         if 'resp_body_data' in data_dict:
@@ -109,39 +328,156 @@ class BroLogReader(object):
 
         return data_dict
 
-    def _cast_value(self, value):
-        """Internal method that makes sure every value in dictionary
-        is properly cast into the correct types, instead of
-        just treating everything like a string from the csv file.
-
-        Args:
-            value : The value to be casted
-
-        Returns:
-            A casted Value.
-        """
-        # Try to convert to a datetime (if requested)
-        if (self.convert_datetimes):
-            try:
-                date_time = datetime.datetime.fromtimestamp(float(value))
-                if datetime.datetime(1970, 1, 1) > date_time:
-                    raise ValueError
-                else:
-                    return date_time
-
-            # Next try a set of primitive types
-            except ValueError:
-                pass
-
-        # Try conversion to basic types
-        tests = (int, float, str)
-        for test in tests:
-            try:
-                return test(value)
-            except ValueError:
-                continue
-        return value
-
+    @staticmethod
+    def _decode(line):
+        """Internal method that gives back a text line (for logs opened in binary mode)."""
+        return line.decode('utf-8', 'replace') if isinstance(line, bytes) else line
+
+
+def pack_columns(columns, field_types):
+    """Pack a chunk of columns (see read_columns) so it can be shipped with msgpack/zeroRPC.
+
+    Args:
+        columns: a {field name: NumPy array} chunk.
+        field_types: the {field name: Bro type} of the log.
+
+    Returns:
+        {'fields': [field names], 'types': {field: Bro type}, 'columns': {field: {'dtype': dtype, 'data': data}}}
+        where the data is the raw array bytes (or a list for object columns).
+    """
+    packed = {}
+    for name, values in columns.items():
+        if values.dtype == object:
+            packed[name] = {'dtype': 'object', 'data': values.tolist()}
+        else:
+            packed[name] = {'dtype': values.dtype.str, 'data': values.tobytes()}
+    return {'fields': list(columns.keys()), 'types': {name: field_types[name] for name in columns}, 'columns': packed}
+
+
+def unpack_columns(chunk):
+    """Unpack a chunk packed by pack_columns back into a {field name: NumPy array} chunk."""
+    columns = {}
+    for name in chunk['fields']:
+        column = chunk['columns'][name]
+        if column['dtype'] == 'object':
+            columns[name] = np.empty(len(column['data']), dtype=object)
+            columns[name][:] = column['data']
+        else:
+            columns[name] = np.frombuffer(column['data'], dtype=column['dtype'])
+    return columns
+
+
+def concat_columns(chunks):
+    """Concatenate column chunks (see read_columns) into one {field name: NumPy array} dictionary.
+
+    Note: a column that is int64 in one chunk and float64 (unset values) in another ends up float64.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return {}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def rows_from_columns(columns, field_types):
+    """Turn columns (see read_columns) back into the rows read_log(convert_datetimes=False) gives.
+
+    Args:
+        columns: a {field name: NumPy array} dictionary.
+        field_types: the {field name: Bro type} of the log.
+
+    Returns:
+        A generator of row dictionaries (times as float seconds, unset values as None).
+    """
+    names = list(columns.keys())
+    lists = []
+    for name in names:
+        values = columns[name]
+        if values.dtype.kind == 'M':
+            missing = np.isnat(values)
+            items = (values.astype(np.int64) / 1e6).tolist()
+        elif values.dtype.kind == 'f':
+            missing = np.isnan(values)
+            items = values.astype(np.int64).tolist() if field_types[name] in ('count', 'int', 'port') else values.tolist()
+        else:
+            lists.append(values.tolist())
+            continue
+        for index in np.flatnonzero(missing):
+            items[index] = None
+        lists.append(items)
+    for values in zip(*lists):
+        yield dict(zip(names, values))
+
+
+def test():
+    """Test for BroLogReader."""
+    data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../data/bro')
+
+    # Conn log: typed values, unset and empty fields
+    with open(os.path.join(data_path, 'conn.log'), 'rb') as logfile:
+        rows = list(BroLogReader().read_log(logfile))
+    print(rows[0])
+    assert isinstance(rows[0]['ts'], datetime.datetime)
+    assert rows[0]['id.orig_p'] == 1038 and rows[0]['orig_bytes'] == 325
+    assert rows[0]['duration'] == 0.234260
+    assert rows[0]['local_orig'] is None and rows[0]['tunnel_parents'] == []
+    assert rows[0]['id.orig_h'] == '192.168.30.10'
+
+    # Keep the timestamps as floats (for msgpack/zeroRPC)
+    with open(os.path.join(data_path, 'conn.log')) as logfile:
+        rows = list(BroLogReader(convert_datetimes=False).read_log(logfile))
+    assert rows[0]['ts'] == 1337107666.903772
+
+    # Files log: sets come back as lists
+    with open(os.path.join(data_path, 'files.log')) as logfile:
+        for row in BroLogReader(convert_datetimes=False).read_log(logfile):
+            assert row['tx_hosts'] is None or isinstance(row['tx_hosts'], list)
+            assert row['total_bytes'] is None or isinstance(row['total_bytes'], int)
+
+    # Tail of a log that's still being written: the header plus the new lines
+    with open(os.path.join(data_path, 'conn.log')) as logfile:
+        lines = logfile.readlines()
+    header_lines = [line for line in lines if line.startswith('#') and not line.startswith('#close')]
+    tail = list(BroLogReader(convert_datetimes=False).read_tail(header_lines, lines[len(header_lines)+2:]))
+    assert tail == rows[2:]
+
+    # Columnar: the same values as the rows, in chunks
+    with open(os.path.join(data_path, 'conn.log')) as logfile:
+        chunks = list(BroLogReader().read_columns(logfile, chunk_size=3))
+    assert len(chunks[0]['uid']) == 3 and sum(len(chunk['uid']) for chunk in chunks) == len(rows)
+    assert chunks[0]['ts'].dtype == np.dtype('datetime64[us]')
+    assert chunks[0]['ts'][0] == np.datetime64(int(round(1337107666.903772 * 1e6)), 'us')
+    assert chunks[0]['orig_bytes'].dtype == np.int64 and chunks[0]['orig_bytes'][0] == 325
+    assert chunks[0]['local_orig'][0] is None and chunks[0]['tunnel_parents'][0] == []
+
+    # A truncated last line: the missing fields are unset (like read_log)
+    with open(os.path.join(data_path, 'conn.log')) as logfile:
+        lines = [line for line in logfile if not line.startswith('#close')]
+    lines[-1] = lines[-1].split('\t', 3)[0] + '\t' + lines[-1].split('\t', 3)[1] + '\n'
+    truncated = BroLogReader().read_columns(iter(lines), chunk_size=None)
+    columns = next(truncated)
+    short_rows = list(BroLogReader().read_log(iter(lines)))
+    assert len(columns['uid']) == len(short_rows) == len(rows)
+    assert columns['uid'][-1] == short_rows[-1]['uid'] and columns['id.orig_h'][-1] is None
+    assert np.isnan(columns['orig_bytes'][-1]) and short_rows[-1]['orig_bytes'] is None
+
+    # Columns back to rows
+    columns = concat_columns(chunks)
+    columns['orig_bytes'] = columns['orig_bytes'].astype(np.float64)
+    columns['orig_bytes'][1] = np.nan
+    rows[1]['orig_bytes'] = None
+    field_types = BroLogReader()
+    with open(os.path.join(data_path, 'conn.log')) as logfile:
+        field_types._parse_bro_header(logfile)
+    assert list(rows_from_columns(columns, field_types.field_types)) == rows
+
+    # Packed for zeroRPC and back
+    unpacked = unpack_columns(pack_columns(chunks[0], {name: 'any' for name in chunks[0]}))
+    assert all((unpacked[name] == chunks[0][name]).all() for name in ['ts', 'id.orig_h', 'duration'])
+    if pd:
+        with open(os.path.join(data_path, 'http.log')) as logfile:
+            frame = pd.concat(BroLogReader().read_dataframes(logfile))
+        print(frame.dtypes)
+        assert str(frame['id.orig_h'].dtype) == 'category' and 'resp_body_data' not in frame
 
 if __name__ == '__main__':
 
@@ -150,6 +486,9 @@ if __name__ == '__main__':
     PARSER.add_option('--logfile', default=None, help='Logfile to read from.  Default: %default')
     (OPTIONS, ARGUMENTS) = PARSER.parse_args()
     print(OPTIONS, ARGUMENTS)
+    if not OPTIONS.logfile:
+        test()
+        exit(0)
 
     # Create a BRO log file reader and pull from the logfile
     BRO_LOG = BroLogReader()
@@ -0,0 +1,209 @@
+"""Broker and Coordinator classes for a multi-process WorkBench.
+
+   The Broker owns the public port (a ZMQ ROUTER) and forwards client
+   messages to N WorkBench processes (each a zerorpc server on a local ipc
+   endpoint). zerorpc streams and heartbeats are a conversation between a
+   client and one server so every client sticks to the process that got its
+   first message.
+
+   The Coordinator lets the WorkBench processes tell each other about
+   things like clear_db (so every process reloads its plugins and caches).
+"""
+
+import os
+import time
+import itertools
+import gevent
+import zmq.green as zmq
+
+
+class Broker(object):
+    """ROUTER front end that forwards to WorkBench processes with per-client affinity."""
+
+    def __init__(self, frontend, backends, coordination=None, client_ttl=600):
+        """Initialization for the Broker.
+
+        Args:
+            frontend: the public endpoint (e.g. 'tcp://0.0.0.0:4242').
+            backends: list of the WorkBench process endpoints (e.g. 'ipc:///tmp/workbench_0.ipc').
+            coordination: (publish, subscribe) endpoints to forward Coordinator messages on (optional).
+            client_ttl: seconds of silence before a client loses its affinity.
+        """
+        self.context = zmq.Context.instance()
+        self.client_ttl = client_ttl
+
+        # The public socket
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind(frontend)
+
+        # One DEALER per WorkBench process so we pick which process gets each message
+        self.dealers = []
+        for endpoint in backends:
+            dealer = self.context.socket(zmq.DEALER)
+            dealer.connect(endpoint)
+            self.dealers.append(dealer)
+        self.next_dealer = itertools.cycle(range(len(self.dealers)))
+
+        # Client identity: [dealer index, last seen]
+        self.affinity = {}
+
+        # Coordinator messages: processes publish into xsub, xpub fans them back out
+        self.coordination = None
+        if coordination:
+            self.xsub = self.context.socket(zmq.XSUB)
+            self.xsub.bind(coordination[0])
+            self.xpub = self.context.socket(zmq.XPUB)
+            self.xpub.bind(coordination[1])
+            self.coordination = True
+
+    def _forward_clients(self):
+        """Internal: Forward client messages to the WorkBench processes."""
+        while True:
+            frames = self.frontend.recv_multipart()
+            client = frames[0]
+            if client not in self.affinity:
+                self.affinity[client] = [next(self.next_dealer), time.time()]
+            self.affinity[client][1] = time.time()
+            self.dealers[self.affinity[client][0]].send_multipart(frames)
+
+    def _forward_replies(self, dealer):
+        """Internal: Forward replies from a WorkBench process back to its clients."""
+        while True:
+            self.frontend.send_multipart(dealer.recv_multipart())
+
+    def _forward_coordination(self, source, destination):
+        """Internal: Forward Coordinator messages (and subscriptions)."""
+        while True:
+            destination.send_multipart(source.recv_multipart())
+
+    def _expire_clients(self):
+        """Internal: Forget clients we haven't heard from in a while."""
+        while True:
+            gevent.sleep(self.client_ttl)
+            expire_time = time.time() - self.client_ttl
+            for client, (_, last_seen) in list(self.affinity.items()):
+                if last_seen < expire_time:
+                    del self.affinity[client]
+
+    def run(self):
+        """Run the broker (blocks until the broker is killed)."""
+        jobs = [gevent.spawn(self._forward_clients), gevent.spawn(self._expire_clients)]
+        jobs += [gevent.spawn(self._forward_replies, dealer) for dealer in self.dealers]
+        if self.coordination:
+            jobs += [gevent.spawn(self._forward_coordination, self.xsub, self.xpub),
+                     gevent.spawn(self._forward_coordination, self.xpub, self.xsub)]
+        try:
+            gevent.joinall(jobs, raise_error=True)
+        finally:
+            gevent.killall(jobs)
+
+    def close(self):
+        """Close all the broker sockets."""
+        sockets = [self.frontend] + self.dealers
+        if self.coordination:
+            sockets += [self.xsub, self.xpub]
+        for sock in sockets:
+            sock.close(linger=0)
+
+
+class Coordinator(object):
+    """Publish/subscribe messages between WorkBench processes (through the Broker)."""
+
+    def __init__(self, coordination, callback):
+        """Initialization for the Coordinator.
+
+        Args:
+            coordination: (publish, subscribe) endpoints of the Broker.
+            callback: called with each message published by another process.
+        """
+        self.context = zmq.Context.instance()
+        self.callback = callback
+        self.identity = str(os.getpid()).encode('utf-8')
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.connect(coordination[0])
+        self.sub = self.context.socket(zmq.SUB)
+        self.sub.connect(coordination[1])
+        self.sub.setsockopt(zmq.SUBSCRIBE, b'')
+        self.job = gevent.spawn(self._listen)
+
+    def publish(self, message):
+        """Publish a message to the other WorkBench processes.
+
+        Args:
+            message: the message (a string like 'reload').
+        """
+        self.pub.send_multipart([self.identity, message.encode('utf-8')])
+
+    def _listen(self):
+        """Internal: Call the callback for messages from the other processes."""
+        while True:
+            sender, message = self.sub.recv_multipart()
+            if sender != self.identity:
+                self.callback(message.decode('utf-8'))
+
+    def close(self):
+        """Stop listening and close the sockets."""
+        self.job.kill()
+        self.pub.close(linger=0)
+        self.sub.close(linger=0)
+
+
+def test():
+    """Test the Broker affinity and the Coordinator (without zerorpc)."""
+    import tempfile
+    temp_dir = tempfile.mkdtemp()
+    endpoint = lambda name: 'ipc://%s/%s.ipc' % (temp_dir, name)
+    context = zmq.Context.instance()
+
+    # Two fake WorkBench processes that answer with their own name
+    backends = []
+    for name in ['wb0', 'wb1']:
+        backend = context.socket(zmq.ROUTER)
+        backend.bind(endpoint(name))
+        backends.append((name, backend))
+
+    def serve(name, backend):
+        while True:
+            frames = backend.recv_multipart()
+            backend.send_multipart(frames[:-1] + [name.encode('utf-8')])
+    jobs = [gevent.spawn(serve, name, backend) for name, backend in backends]
+
+    coordination = (endpoint('pub'), endpoint('sub'))
+    broker = Broker(endpoint('front'), [endpoint('wb0'), endpoint('wb1')], coordination)
+    jobs.append(gevent.spawn(broker.run))
+
+    # Each client always talks to the same process, clients are spread over the processes
+    answers = []
+    for _ in range(4):
+        client = context.socket(zmq.DEALER)
+        client.connect(endpoint('front'))
+        replies = set()
+        for _ in range(3):
+            client.send_multipart([b'', b'hello'])
+            replies.add(client.recv_multipart()[-1])
+        assert len(replies) == 1
+        answers.append(replies.pop())
+        client.close(linger=0)
+    print(answers)
+    assert set(answers) == set([b'wb0', b'wb1'])
+
+    # Coordinator messages go to everyone but the sender
+    messages = []
+    coordinator1 = Coordinator(coordination, lambda message: messages.append(('one', message)))
+    coordinator2 = Coordinator(coordination, lambda message: messages.append(('two', message)))
+    coordinator2.identity = b'another_process'
+    gevent.sleep(0.5)
+    coordinator1.publish('reload')
+    gevent.sleep(0.5)
+    print(messages)
+    assert messages == [('two', 'reload')]
+
+    coordinator1.close()
+    coordinator2.close()
+    gevent.killall(jobs)
+    broker.close()
+    for _, backend in backends:
+        backend.close(linger=0)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,163 @@
+"""CircuitBreaker class for WorkBench.
+
+   Keeps track of the recent executions of each worker. When the failure
+   rate of a worker spikes (a broken Rekall profile, a bad signature file,
+   a service that's down) its circuit opens and requests for it fail fast
+   with CircuitOpen instead of running the (expensive) failing work again.
+   After reset_timeout the circuit is half-open: a single probe request is
+   let through (the others still fail fast), its success closes the circuit
+   and its failure opens it for another reset_timeout.
+"""
+
+import time
+import collections
+
+
+class CircuitOpen(Exception):
+    """The worker is failing too often, requests for it are short-circuited for a while."""
+    pass
+
+
+class CachedFailure(Exception):
+    """The worker failed on this sample recently, it won't be retried until its backoff expires."""
+    pass
+
+
+class CircuitBreaker(object):
+    """Per-worker circuit breaker."""
+
+    def __init__(self, failure_rate=0.5, min_executions=10, window=60, reset_timeout=30):
+        """Initialization for the CircuitBreaker class.
+
+        Args:
+            failure_rate: fraction of failed executions (within the window) that opens the circuit.
+            min_executions: executions needed (within the window) before the circuit can open.
+            window: seconds of execution history to look at.
+            reset_timeout: seconds the circuit stays open before requests are let through again.
+        """
+        self.failure_rate = failure_rate
+        self.min_executions = min_executions
+        self.window = window
+        self.reset_timeout = reset_timeout
+
+        # Worker: deque of (time, success) and worker: time the circuit opened
+        self.history = collections.defaultdict(collections.deque)
+        self.opened = {}
+
+        # Worker: time the half-open probe request was let through
+        self.probes = {}
+
+    def allow(self, worker_name):
+        """Check that requests for a worker are allowed.
+
+        Args:
+            worker_name: the name of the worker.
+
+        Raises:
+            CircuitOpen: When the worker's circuit is open.
+        """
+        opened = self.opened.get(worker_name)
+        if not opened:
+            return
+        now = time.time()
+        if now - opened < self.reset_timeout:
+            raise CircuitOpen('%s is failing too often, retry in %d seconds' %
+                              (worker_name, self.reset_timeout - (now - opened)))
+
+        # Half-open: one probe at a time (a probe that never gets to execute expires after reset_timeout)
+        probe = self.probes.get(worker_name)
+        if probe and now - probe < self.reset_timeout:
+            raise CircuitOpen('%s is failing too often, a probe request is checking if it recovered' % worker_name)
+        self.probes[worker_name] = now
+
+    def record(self, worker_name, success):
+        """Record the outcome of a worker execution.
+
+        Args:
+            worker_name: the name of the worker.
+            success: True if the execution succeeded.
+        """
+        now = time.time()
+
+        # The probe decides an open circuit (executions that started before the circuit opened don't)
+        if worker_name in self.opened:
+            if self.probes.pop(worker_name, None) is None:
+                return
+            if success:
+                del self.opened[worker_name]
+                self.history[worker_name].clear()
+            else:
+                self.opened[worker_name] = now
+            return
+
+        # Keep the history within the window and open the circuit if the failure rate spikes
+        history = self.history[worker_name]
+        history.append((now, success))
+        while history and history[0][0] < now - self.window:
+            history.popleft()
+        failures = len([outcome for _, outcome in history if not outcome])
+        if len(history) >= self.min_executions and failures >= self.failure_rate * len(history):
+            print('Warning: %s failed %d of its last %d executions, opening its circuit' %
+                  (worker_name, failures, len(history)))
+            self.opened[worker_name] = now
+
+    def open_circuits(self):
+        """The workers whose circuits are open (or waiting for a request to decide them)."""
+        return sorted(self.opened.keys())
+
+
+def test():
+    """Test for the CircuitBreaker class."""
+    breaker = CircuitBreaker(failure_rate=0.5, min_executions=4, window=60, reset_timeout=0.2)
+
+    # Not enough failures to open the circuit
+    for success in [True, False, True, True, False]:
+        breaker.allow('rekall')
+        breaker.record('rekall', success)
+    assert breaker.open_circuits() == []
+
+    # A failure spike opens it
+    for _ in range(3):
+        breaker.record('rekall', False)
+    assert breaker.open_circuits() == ['rekall']
+    try:
+        breaker.allow('rekall')
+        assert False, 'circuit should be open'
+    except CircuitOpen as error:
+        print(error)
+    breaker.allow('meta')
+
+    # After the reset timeout a single probe goes through, its failure opens it again
+    time.sleep(0.25)
+    breaker.allow('rekall')
+    try:
+        breaker.allow('rekall')
+        assert False, 'only one probe at a time'
+    except CircuitOpen as error:
+        print(error)
+    breaker.record('rekall', False)
+    try:
+        breaker.allow('rekall')
+        assert False, 'circuit should be open'
+    except CircuitOpen:
+        pass
+    time.sleep(0.25)
+    breaker.allow('rekall')
+    breaker.record('rekall', True)
+    assert breaker.open_circuits() == []
+
+    # A probe that never reports back expires, executions that aren't the probe don't decide the circuit
+    for _ in range(4):
+        breaker.record('rekall', False)
+    breaker.record('rekall', True)
+    assert breaker.open_circuits() == ['rekall']
+    time.sleep(0.25)
+    breaker.allow('rekall')
+    time.sleep(0.25)
+    breaker.allow('rekall')
+    breaker.record('rekall', True)
+    assert breaker.open_circuits() == []
+    breaker.allow('rekall')
+
+if __name__ == '__main__':
+    test()
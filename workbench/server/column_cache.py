@@ -0,0 +1,402 @@
+"""ColumnCache class for WorkBench.
+
+   The first time a Bro log is streamed its parsed columns (see
+   BroLogReader.read_columns) are saved to a local .npz file keyed by the
+   log md5, later streams of the same log are served from that file instead
+   of pulling the log out of GridFS and parsing every line again. Samples
+   are keyed by their md5 so an entry never goes stale, the least recently
+   used entries are dropped when the cache grows past max_bytes.
+
+   The columns are written and read a chunk at a time (the cache fills as
+   the log streams, the whole log is never in memory, and a stream that
+   stops early is finished in the background) and nothing in the
+   cache is pickled: string columns are stored as utf-8 text and the other
+   object columns (sets/vectors, bools with unset values) as JSON, so the
+   files are loaded with allow_pickle=False. The cache directory has to
+   belong to the server user and is made private (mode 0700).
+"""
+
+import os
+import json
+import shutil
+import stat
+import tempfile
+import zipfile
+import gevent
+import numpy as np
+
+# Bump when the parsed columns change (older cache files are then ignored)
+FORMAT = 2
+
+
+class ColumnCache(object):
+    """Local on-disk cache of parsed log columns, keyed by the log md5."""
+
+    def __init__(self, cache_dir=None, max_bytes=0):
+        """Initialization for the ColumnCache class.
+
+        Args:
+            cache_dir: the directory for the cache files (default: workbench_columns_<uid> in the temp directory).
+            max_bytes: the size the cache is trimmed to, least recently used first (0 for no limit).
+        """
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'workbench_columns_%d' % os.getuid())
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.filling = set()
+        _private_dir(self.cache_dir)
+
+    def get(self, md5):
+        """Get the cached columns of a log.
+
+        Args:
+            md5: the md5 of the log.
+
+        Returns:
+            A CachedLog (read its chunks or close it) or None if the log isn't cached.
+        """
+        path = self._path(md5)
+        try:
+            handle = open(path, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            with np.load(handle, allow_pickle=False) as cached:
+                if int(cached['format']) != FORMAT:
+                    raise ValueError('old cache format')
+                fields, types = cached['fields'].tolist(), cached['types'].tolist()
+                chunk_rows = cached['chunk_rows'].tolist()
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+            handle.close()
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path, None)
+        self.hits += 1
+        return CachedLog(handle, fields, dict(zip(fields, types)), chunk_rows)
+
+    def fill(self, md5, chunks):
+        """Cache the columns of a log as they're read.
+
+        Args:
+            md5: the md5 of the log.
+            chunks: a generator of ({field name: NumPy array}, {field name: type}) chunks (in field order).
+
+        Returns:
+            A generator that gives back the chunks as they're written, the log is cached once the last
+            chunk is written. When the generator is closed early (a page of rows, the client went away)
+            the rest of the chunks are written by a background greenlet. While a log is being cached
+            other fills of the same log just pass their chunks through.
+        """
+        chunks = iter(chunks)
+        if md5 in self.filling:
+            for chunk in chunks:
+                yield chunk
+            return
+        self.filling.add(md5)
+        writer = _CacheWriter(self.cache_dir, md5)
+        try:
+            for columns, field_types in chunks:
+                writer.write(columns, field_types)
+                yield columns, field_types
+        except GeneratorExit:
+            gevent.spawn(self._drain, md5, writer, chunks)
+            raise
+        except BaseException:
+            writer.abort()
+            self.filling.discard(md5)
+            raise
+        self._finish(md5, writer)
+
+    def _drain(self, md5, writer, chunks):
+        """Internal: Write the rest of the chunks of a fill that was closed early."""
+        try:
+            for columns, field_types in chunks:
+                writer.write(columns, field_types)
+                gevent.sleep(0)
+            self._finish(md5, writer)
+        except Exception as error:
+            print('Warning: Could not cache the columns of %s (%s)' % (md5, error))
+            writer.abort()
+            self.filling.discard(md5)
+
+    def _finish(self, md5, writer):
+        """Internal: Move a finished cache file in place."""
+        try:
+            writer.finish(self._path(md5))
+        finally:
+            self.filling.discard(md5)
+        self._trim()
+
+    def put(self, md5, columns, field_types):
+        """Cache the columns of a log.
+
+        Args:
+            md5: the md5 of the log.
+            columns: a {field name: NumPy array} dictionary (in field order).
+            field_types: the {field name: type} of the log.
+        """
+        for _ in self.fill(md5, [(columns, field_types)]):
+            pass
+
+    def remove(self, md5):
+        """Drop the cached columns of a log (if any)."""
+        try:
+            os.remove(self._path(md5))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Drop all the cached columns."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        _private_dir(self.cache_dir)
+
+    def size(self):
+        """The total size of the cache files in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _path(self, md5):
+        """Internal: The cache file of a log."""
+        return os.path.join(self.cache_dir, md5 + '.npz')
+
+    def _entries(self):
+        """Internal: (last used, size, path) of each cache file (not the ones still being written)."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((file_stat.st_mtime, file_stat.st_size, path))
+        return entries
+
+    def _trim(self):
+        """Internal: Drop the least recently used cache files until the cache fits in max_bytes."""
+        if not self.max_bytes:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class CachedLog(object):
+    """The cached columns of a log, read a chunk at a time."""
+
+    def __init__(self, handle, fields, field_types, chunk_rows):
+        """Initialization for the CachedLog class.
+
+        Args:
+            handle: the open cache file (still readable if the entry is dropped from the cache meanwhile).
+            fields: the field names in order.
+            field_types: the {field name: type} of the log.
+            chunk_rows: the number of rows in each chunk.
+        """
+        self.handle = handle
+        self.fields = fields
+        self.field_types = field_types
+        self.chunk_rows = chunk_rows
+        self.num_rows = sum(chunk_rows)
+
+    def chunks(self):
+        """A generator of ({field name: NumPy array}, {field name: type}) chunks (closes the file at the end)."""
+        try:
+            self.handle.seek(0)
+            with np.load(self.handle, allow_pickle=False) as cached:
+                for chunk in range(len(self.chunk_rows)):
+                    columns = {name: _unpack(cached, 'c%d_%d' % (chunk, index)) for index, name in enumerate(self.fields)}
+                    yield columns, self.field_types
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the cache file."""
+        self.handle.close()
+
+
+class _CacheWriter(object):
+    """Internal: Writes the chunks of a log to a temporary cache file (moved in place once it's finished)."""
+
+    def __init__(self, cache_dir, md5):
+        fd, self.tmp_path = tempfile.mkstemp(prefix=md5 + '.', suffix='.tmp', dir=cache_dir)
+        self.handle = os.fdopen(fd, 'wb')
+        self.archive = zipfile.ZipFile(self.handle, 'w', allowZip64=True)
+        self.fields = []
+        self.field_types = {}
+        self.chunk_rows = []
+
+    def write(self, columns, field_types):
+        """Write a chunk of columns."""
+        self.fields = self.fields or list(columns.keys())
+        self.field_types = field_types
+        for index, name in enumerate(self.fields):
+            for suffix, array in _pack(columns[name]).items():
+                _write_array(self.archive, 'c%d_%d%s' % (len(self.chunk_rows), index, suffix), array)
+        self.chunk_rows.append(len(columns[self.fields[0]]) if self.fields else 0)
+
+    def finish(self, path):
+        """Write the field names, types and chunk sizes and move the file to path."""
+        try:
+            _write_array(self.archive, 'fields', np.array(self.fields, dtype=str))
+            _write_array(self.archive, 'types', np.array([self.field_types[name] for name in self.fields], dtype=str))
+            _write_array(self.archive, 'chunk_rows', np.array(self.chunk_rows, dtype=np.int64))
+            _write_array(self.archive, 'format', np.array(FORMAT))
+            self.archive.close()
+            self.handle.close()
+            os.rename(self.tmp_path, path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Drop the temporary file."""
+        try:
+            self.archive.close()
+        except Exception:
+            pass
+        self.handle.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _private_dir(path):
+    """Internal: Make the cache directory (mode 0700), an existing one has to be a directory of this user."""
+    try:
+        os.makedirs(path, 0o700)
+    except OSError:
+        pass
+    dir_stat = os.lstat(path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid():
+        raise RuntimeError('Column cache directory %s is not a directory owned by this user' % path)
+    if dir_stat.st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+
+def _pack(values):
+    """Internal: A column as {key suffix: array} of arrays that are saved without pickling."""
+    if values.dtype != object:
+        return {'': values}
+
+    # Strings as one utf-8 text (a value never has a newline, it comes from a log line), the rest as JSON
+    items = values.tolist()
+    missing = np.array([item is None for item in items], dtype=bool)
+    strings = ['' if item is None else item for item in items]
+    if all(isinstance(item, str) for item in strings):
+        text = '\n'.join(strings)
+        if text.count('\n') == max(len(strings) - 1, 0):
+            return {'_text': _utf8(text), '_none': missing}
+    return {'_json': _utf8('\n'.join(json.dumps(item) for item in items))}
+
+
+def _unpack(cached, key):
+    """Internal: Load a column saved by _pack."""
+    if key in cached.files:
+        return cached[key]
+    if key + '_text' in cached.files:
+        missing = cached[key + '_none']
+        column = np.empty(len(missing), dtype=object)
+        if len(missing):
+            column[:] = cached[key + '_text'].tobytes().decode('utf-8').split('\n')
+        column[missing] = None
+        return column
+
+    # JSON values are converted once per distinct value and shared by the rows (like read_columns does)
+    text = cached[key + '_json'].tobytes().decode('utf-8')
+    lines = text.split('\n') if text else []
+    converted = {line: json.loads(line) for line in set(lines)}
+    column = np.empty(len(lines), dtype=object)
+    column[:] = [converted[line] for line in lines]
+    return column
+
+
+def _utf8(text):
+    """Internal: Text as a uint8 array of its utf-8 bytes."""
+    return np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+
+
+def _write_array(archive, key, array):
+    """Internal: Write an array to an .npz archive (the way np.savez does, without pickling)."""
+    with archive.open(key + '.npy', 'w', force_zip64=True) as member:
+        np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+
+
+def test():
+    """Test for the ColumnCache class."""
+    import time
+    cache_dir = tempfile.mkdtemp(prefix='workbench_columns_test_')
+    try:
+        os.chmod(cache_dir, 0o755)
+        cache = ColumnCache(cache_dir)
+        assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+        columns = {'ts': np.array(['2012-05-15T18:47:46.903772', 'NaT'], dtype='datetime64[us]'),
+                   'id.orig_h': np.array(['192.168.30.10', None], dtype=object),
+                   'orig_bytes': np.array([325, 12], dtype=np.int64),
+                   'local_orig': np.array([True, None], dtype=object)}
+        columns['tags'] = np.empty(2, dtype=object)
+        columns['tags'][:] = [['a', 'b'], ['a', 'b']]
+        field_types = {'ts': 'time', 'id.orig_h': 'addr', 'orig_bytes': 'count', 'local_orig': 'bool',
+                       'tags': 'set[string]'}
+
+        # Miss, then a round trip through the cache (keeping the field order)
+        assert cache.get('aaa') is None
+        cache.put('aaa', columns, field_types)
+        cached = cache.get('aaa')
+        [(chunk, chunk_types)] = list(cached.chunks())
+        assert list(chunk.keys()) == list(columns.keys()) and chunk_types == field_types and cached.num_rows == 2
+        assert all(chunk[name].tolist() == columns[name].tolist() for name in columns)
+        assert chunk['tags'][0] is chunk['tags'][1]
+        assert cache.hits == 1 and cache.misses == 1
+
+        # Filled a chunk at a time as the chunks stream by, a fill that's stopped early
+        # is finished in the background (and a second fill of the log meanwhile passes through)
+        chunks = [({name: values[index:index+1] for name, values in columns.items()}, field_types) for index in range(2)]
+        assert [chunk for chunk, _ in cache.fill('eee', iter(chunks))] == [chunk for chunk, _ in chunks]
+        stream = cache.fill('ddd', iter(chunks))
+        next(stream)
+        stream.close()
+        assert [chunk for chunk, _ in cache.fill('ddd', iter(chunks))] == [chunk for chunk, _ in chunks]
+        gevent.sleep(0.1)
+        assert not cache.filling and not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
+        cached = cache.get('ddd')
+        assert cached.chunk_rows == [1, 1] and [chunk['id.orig_h'][0] for chunk, _ in cached.chunks()] == ['192.168.30.10', None]
+        cache.remove('eee')
+
+        # A log that fails to parse isn't cached
+        def bad_chunks():
+            yield chunks[0]
+            raise ValueError('bad log')
+        try:
+            list(cache.fill('fff', bad_chunks()))
+            assert False, 'should have raised'
+        except ValueError:
+            pass
+        assert cache.get('fff') is None and not cache.filling
+
+        # The least recently used entries go first when the cache is over its limit
+        cache.put('bbb', columns, field_types)
+        time.sleep(0.05)
+        cache.get('aaa').close()
+        cache.max_bytes = cache.size() - os.path.getsize(cache._path('ddd'))
+        cache.put('ccc', columns, field_types)
+        assert cache.get('bbb') is None and cache.get('aaa') and cache.get('ccc')
+
+        cache.remove('aaa')
+        assert cache.get('aaa') is None
+        cache.clear()
+        assert cache.size() == 0
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,187 @@
+"""CostModel class for WorkBench.
+
+   Learns what each worker costs: execution seconds as a linear function of
+   the input size (the sample length) and whether the worker is CPU heavy
+   (burns the server's CPU) or I/O heavy (mostly waits on subprocesses, the
+   network, the database). The scheduler (see job_queue.py) uses the
+   estimates to run cheap work first and to pack CPU and I/O work into
+   their own slots.
+
+   Requests run concurrently on greenlets, so the process CPU time isn't
+   the CPU time of an execution: GreenletClock charges the CPU time between
+   greenlet switches to the greenlet that was running.
+"""
+
+import time
+import weakref
+import greenlet
+
+
+class GreenletClock(object):
+    """CPU time per greenlet."""
+
+    def __init__(self):
+        """Initialization for the GreenletClock class (starts tracing greenlet switches)."""
+        self.cpu = weakref.WeakKeyDictionary()
+        self.last = time.process_time()
+        self.previous_trace = greenlet.settrace(self._trace)
+
+    def _trace(self, event, args):
+        """Internal: Charge the CPU time since the last switch to the greenlet switched away from."""
+        if event in ('switch', 'throw'):
+            now = time.process_time()
+            origin = args[0]
+            self.cpu[origin] = self.cpu.get(origin, 0.0) + now - self.last
+            self.last = now
+        if self.previous_trace:
+            self.previous_trace(event, args)
+
+    def cpu_time(self):
+        """The CPU seconds the current greenlet has used so far."""
+        current = greenlet.getcurrent()
+        return self.cpu.get(current, 0.0) + time.process_time() - self.last
+
+
+class CostProfile(object):
+    """Execution cost profile of one worker (least squares fit of seconds vs bytes)."""
+
+    def __init__(self, count=0, sum_bytes=0.0, sum_seconds=0.0, sum_bytes_squared=0.0, sum_bytes_seconds=0.0,
+                 sum_cpu_seconds=0.0):
+        """Initialization for the CostProfile class (the arguments are the running sums, see to_dict)."""
+        self.count = count
+        self.sum_bytes = sum_bytes
+        self.sum_seconds = sum_seconds
+        self.sum_bytes_squared = sum_bytes_squared
+        self.sum_bytes_seconds = sum_bytes_seconds
+        self.sum_cpu_seconds = sum_cpu_seconds
+
+    def record(self, num_bytes, seconds, cpu_seconds):
+        """Record an execution.
+
+        Args:
+            num_bytes: the input size.
+            seconds: the execution (wall clock) time.
+            cpu_seconds: the CPU time the server spent on the execution.
+        """
+        self.count += 1
+        self.sum_bytes += num_bytes
+        self.sum_seconds += seconds
+        self.sum_bytes_squared += num_bytes * num_bytes
+        self.sum_bytes_seconds += num_bytes * seconds
+        self.sum_cpu_seconds += cpu_seconds
+
+    def estimate(self, num_bytes):
+        """Estimated execution seconds for an input of num_bytes."""
+        mean_seconds = self.sum_seconds / self.count
+        variance = self.count * self.sum_bytes_squared - self.sum_bytes * self.sum_bytes
+        if self.count < 2 or variance <= 0:
+            return mean_seconds
+        slope = (self.count * self.sum_bytes_seconds - self.sum_bytes * self.sum_seconds) / variance
+        intercept = (self.sum_seconds - slope * self.sum_bytes) / self.count
+        return max(intercept + slope * num_bytes, 0.0)
+
+    def cpu_ratio(self):
+        """Fraction of the execution time spent on the server's CPU."""
+        return self.sum_cpu_seconds / self.sum_seconds if self.sum_seconds else 0.0
+
+    def to_dict(self):
+        """The profile as a dictionary (for storage)."""
+        return {'count': self.count, 'sum_bytes': self.sum_bytes, 'sum_seconds': self.sum_seconds,
+                'sum_bytes_squared': self.sum_bytes_squared, 'sum_bytes_seconds': self.sum_bytes_seconds,
+                'sum_cpu_seconds': self.sum_cpu_seconds}
+
+
+class CostModel(object):
+    """Execution cost profiles for all the workers."""
+
+    def __init__(self, default_seconds=1.0, cpu_ratio=0.5):
+        """Initialization for the CostModel class.
+
+        Args:
+            default_seconds: the estimate for a worker we haven't seen execute yet.
+            cpu_ratio: workers spending more than this fraction of their time on the CPU are CPU heavy.
+        """
+        self.default_seconds = default_seconds
+        self.cpu_ratio = cpu_ratio
+        self.profiles = {}
+
+    def load(self, worker_name, profile_dict):
+        """Load a stored profile (see CostProfile.to_dict)."""
+        self.profiles[worker_name] = CostProfile(**profile_dict)
+
+    def record(self, worker_name, num_bytes, seconds, cpu_seconds):
+        """Record an execution of a worker.
+
+        Returns:
+            The updated CostProfile of the worker.
+        """
+        profile = self.profiles.setdefault(worker_name, CostProfile())
+        profile.record(num_bytes, seconds, cpu_seconds)
+        return profile
+
+    def estimate(self, worker_name, num_bytes=0):
+        """Estimated execution seconds of a worker for an input of num_bytes."""
+        profile = self.profiles.get(worker_name)
+        return profile.estimate(num_bytes) if profile else self.default_seconds
+
+    def kind(self, worker_name, isolated=False):
+        """Is the worker 'cpu' or 'io' heavy?
+
+        Args:
+            worker_name: the name of the worker.
+            isolated: isolated workers burn CPU in their own process (so they're always CPU heavy).
+        """
+        profile = self.profiles.get(worker_name)
+        if isolated or not profile:
+            return 'cpu'
+        return 'cpu' if profile.cpu_ratio() > self.cpu_ratio else 'io'
+
+    def summary(self):
+        """Cost summary of each worker (for get_stats)."""
+        return {name: {'executions': profile.count, 'mean_seconds': profile.sum_seconds / profile.count,
+                       'cpu_ratio': profile.cpu_ratio(), 'kind': self.kind(name)}
+                for name, profile in self.profiles.items()}
+
+
+def test():
+    """Test for the CostModel class."""
+    model = CostModel(default_seconds=2.0)
+    assert model.estimate('strings', 1000) == 2.0
+    assert model.kind('strings') == 'cpu'
+
+    # Seconds = 0.1 + 1e-6 * bytes, all on the CPU
+    for num_bytes in [1000, 10000, 100000, 1000000]:
+        seconds = 0.1 + 1e-6 * num_bytes
+        model.record('strings', num_bytes, seconds, seconds)
+    assert abs(model.estimate('strings', 500000) - 0.6) < 1e-6
+    assert model.kind('strings') == 'cpu'
+
+    # Mostly waiting on a subprocess
+    model.record('pcap_bro', 1000, 10.0, 0.5)
+    assert model.estimate('pcap_bro', 123456) == 10.0
+    assert model.kind('pcap_bro') == 'io'
+    assert model.kind('pcap_bro', isolated=True) == 'cpu'
+
+    # Round trip through storage
+    copy = CostModel()
+    copy.load('strings', model.profiles['strings'].to_dict())
+    assert abs(copy.estimate('strings', 500000) - 0.6) < 1e-6
+    print(model.summary())
+
+    # Per greenlet CPU: a greenlet waiting on another (busy) one isn't charged for its CPU
+    import gevent
+    clock = GreenletClock()
+    def busy():
+        start, cpu_start = time.process_time(), clock.cpu_time()
+        while time.process_time() - start < 0.2:
+            pass
+        return clock.cpu_time() - cpu_start
+    def waiting():
+        start = clock.cpu_time()
+        gevent.spawn(busy).join()
+        return clock.cpu_time() - start
+    assert gevent.spawn(waiting).get() < 0.1 and gevent.spawn(busy).get() >= 0.19
+    greenlet.settrace(clock.previous_trace)
+
+if __name__ == '__main__':
+    test()
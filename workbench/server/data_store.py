@@ -15,7 +15,8 @@ class DataStore(object):
 
     """
 
-    def __init__(self, uri='mongodb://localhost/workbench', database='workbench', worker_cap=0, samples_cap=0):
+    def __init__(self, uri='mongodb://localhost/workbench', database='workbench', worker_cap=0, samples_cap=0,
+                 dataset_cap=0):
         """ Initialization for the Workbench data store class.
 
         Args:
@@ -23,11 +24,15 @@ class DataStore(object):
             database: Name of database.
             worker_cap: MBs in the capped collection.
             samples_cap: MBs of sample to be stored.
+            dataset_cap: Rows kept in each (rolling) dataset, 0 for no limit.
         """
         
         self.sample_collection = 'samples'
+        self.dataset_collection = 'datasets'
+        self.dataset_rows_collection = 'dataset_rows'
         self.worker_cap = worker_cap
         self.samples_cap = samples_cap
+        self.dataset_cap = dataset_cap
 
         # Get connection to mongo
         self.database_name = database
@@ -38,6 +43,10 @@ class DataStore(object):
         # Get the gridfs handle
         self.gridfs_handle = gridfs.GridFS(self.database)
 
+        # Read statistics (pulled by the server metrics)
+        self.samples_read = 0
+        self.gridfs_bytes_read = 0
+
         # Run the periodic operations
         self.last_ops_run = time.time()
         self.periodic_ops()
@@ -133,6 +142,8 @@ class DataStore(object):
         print('Deleting sample: %s (%.2f MB)...' % (record['md5'], record['length']/1024.0/1024.0))
         self.database[self.sample_collection].remove({'md5': record['md5']})
         self.gridfs_handle.delete(record['__grid_fs'])
+        if '__line_index' in record:
+            self.gridfs_handle.delete(record['__line_index'])
 
         # Print info
         print('Sample Storage: %.2f out of %.2f MB' % (self.sample_storage_size(), self.samples_cap))
@@ -227,12 +238,230 @@ class DataStore(object):
             grid_fs_id = sample_info['__grid_fs']
             sample_info = self.clean_for_serialization(sample_info)
             sample_info.update({'raw_bytes':self.gridfs_handle.get(grid_fs_id).read()})
+            self.samples_read += 1
+            self.gridfs_bytes_read += len(sample_info['raw_bytes'])
             return sample_info
         except gridfs.errors.CorruptGridFile:
             # If we don't have the gridfs files, delete the entry from samples
             self.database[self.sample_collection].update({'md5': md5}, {'md5': None})
             return None
 
+    def open_sample(self, md5, chunk_size=256*1024, start=0, end=None):
+        """Open the bytes of a sample for streaming (instead of pulling them all into memory).
+
+        Args:
+            md5: The md5 digest of the sample.
+            chunk_size: The number of bytes read from GridFS at a time.
+            start: The byte offset to start reading from.
+            end: The byte offset to stop reading at (None for the end of the sample).
+
+        Returns:
+            A generator of the sample bytes (chunk_size at a time) or None if the sample isn't in the data store.
+        """
+
+        # Support 'short' md5s but don't waste performance if the full md5 is provided
+        if len(md5) < 32:
+            md5 = self.get_full_md5(md5, self.sample_collection)
+        sample_info = self.database[self.sample_collection].find_one({'md5': md5}, {'_id': 0, '__grid_fs': 1})
+        if not sample_info:
+            return None
+        try:
+            grid_out = self.gridfs_handle.get(sample_info['__grid_fs'])
+        except gridfs.errors.NoFile:
+            return None
+        if start:
+            grid_out.seek(start)
+        self.samples_read += 1
+        return self._read_chunks(grid_out, chunk_size, None if end is None else end - start)
+
+    def _read_chunks(self, grid_out, chunk_size, num_bytes=None):
+        """Internal: Read a GridFS file chunk_size bytes at a time (up to num_bytes, None for all of it)."""
+        try:
+            while num_bytes is None or num_bytes > 0:
+                chunk = grid_out.read(chunk_size if num_bytes is None else min(chunk_size, num_bytes))
+                if not chunk:
+                    break
+                self.gridfs_bytes_read += len(chunk)
+                if num_bytes is not None:
+                    num_bytes -= len(chunk)
+                yield chunk
+        finally:
+            grid_out.close()
+
+    def store_line_index(self, md5, index_bytes, num_rows):
+        """Store the line-offset index of a sample (see line_index.LineIndex).
+
+        Only the first index stored for a sample is kept (when requests build the
+        index concurrently the others drop theirs instead of orphaning it in GridFS).
+
+        Args:
+            md5: The md5 digest of the sample.
+            index_bytes: The index as bytes.
+            num_rows: The number of rows in the sample (saved with the sample, see sample_num_rows).
+
+        Returns:
+            True if the index was stored, False if the sample already had one (or is gone).
+        """
+        index_id = self.gridfs_handle.put(index_bytes)
+        stored = self.database[self.sample_collection].find_and_modify(
+            {'md5': md5, '__line_index': {'$exists': False}},
+            {'$set': {'__line_index': index_id, '__num_rows': num_rows}}, fields={'_id': 1})
+        if not stored:
+            self.gridfs_handle.delete(index_id)
+        return bool(stored)
+
+    def open_line_index(self, md5):
+        """Open the line-offset index of a sample (for ranged reads, it isn't pulled into memory).
+
+        Args:
+            md5: The md5 digest of the sample.
+
+        Returns:
+            A (seekable) GridFS file of the index, None if the sample doesn't have an index yet.
+        """
+        sample_info = self.database[self.sample_collection].find_one({'md5': md5}, {'_id': 0, '__line_index': 1})
+        if not sample_info or '__line_index' not in sample_info:
+            return None
+        try:
+            return self.gridfs_handle.get(sample_info['__line_index'])
+        except gridfs.errors.NoFile:
+            return None
+
+    def sample_num_rows(self, md5):
+        """Get the number of rows of a sample without reading it (or its index).
+
+        Args:
+            md5: The md5 digest of the sample.
+
+        Returns:
+            The number of rows (None if the sample doesn't have a line index yet).
+        """
+        sample_info = self.database[self.sample_collection].find_one({'md5': md5}, {'_id': 0, '__num_rows': 1})
+        return sample_info.get('__num_rows') if sample_info else None
+
+    def sample_length(self, md5):
+        """Get the length of a sample without pulling its bytes.
+
+        Args:
+            md5: The md5 digest of the sample.
+
+        Returns:
+            The length of the sample in bytes (0 if it's not in the data store).
+        """
+        sample_info = self.database[self.sample_collection].find_one({'md5': md5}, {'_id': 0, 'length': 1})
+        return sample_info['length'] if sample_info else 0
+
+    def sample_type_tag(self, md5):
+        """Get the type_tag of a sample without pulling its bytes.
+
+        Args:
+            md5: The md5 digest of the sample.
+
+        Returns:
+            The type_tag of the sample ('dataset' for a dataset, None if it's not in the data store).
+        """
+        sample_info = self.database[self.sample_collection].find_one({'md5': md5}, {'_id': 0, 'type_tag': 1})
+        if sample_info:
+            return sample_info['type_tag']
+        return 'dataset' if self.get_dataset_info(md5) else None
+
+    def dataset_md5(self, name):
+        """The md5 of a dataset (datasets are named, their rows keep changing)."""
+        return hashlib.md5(('dataset:' + name).encode('utf-8')).hexdigest()
+
+    def append_dataset_rows(self, name, header, fields, rows, source=None):
+        """Append a batch of rows to a (rolling) dataset, creating it if it's new.
+
+        Rows are stored in batches (one document per append) numbered by row. The
+        rows of an append are reserved atomically (concurrent appends to a dataset
+        get row ranges that don't overlap) and the batch is saved with its source,
+        so an append that's repeated (e.g. the writer restarted before it saw the
+        source saved) is recognized and skipped instead of adding the rows twice.
+        Once a dataset has more than dataset_cap rows its oldest batches are dropped.
+
+        Args:
+            name: The name of the dataset.
+            header: The header lines of the log the rows come from.
+            fields: The field names of the rows.
+            rows: The rows (lists of values in field order).
+            source: Where the rows were read up to (e.g. {'path','inode','offset'}), saved with the rows.
+
+        Returns:
+            The md5 of the dataset.
+        """
+        md5 = self.dataset_md5(name)
+        rows_collection = self.database[self.dataset_rows_collection]
+        if rows and source and rows_collection.find_one({'md5': md5, 'source': source}, {'_id': 1}):
+            return md5
+
+        # Reserve the rows (the dataset is created with the first append)
+        dataset = self.database[self.dataset_collection].find_and_modify({'md5': md5},
+            {'$inc': {'num_rows': len(rows)}, '$setOnInsert': {'first_row': 0, 'source': None},
+             '$set': {'name': name, 'header': header, 'fields': fields, 'update_time': datetime.datetime.utcnow()}},
+            upsert=True, new=True)
+        num_rows = dataset['num_rows']
+        first_row = num_rows - len(rows)
+        if rows:
+            batch = {'md5': md5, 'first_row': first_row, 'end_row': num_rows, 'fields': fields, 'rows': rows,
+                     'source': source}
+            rows_collection.update({'md5': md5, 'first_row': first_row}, batch, upsert=True)
+
+        # The source only moves forward (a slower concurrent append doesn't set it back)
+        self.database[self.dataset_collection].update(
+            {'md5': md5, '$or': [{'source_row': {'$exists': False}}, {'source_row': {'$lte': num_rows}}]},
+            {'$set': {'source': source, 'source_row': num_rows}})
+
+        # Drop the oldest batches of a rolling dataset
+        if self.dataset_cap and num_rows - dataset['first_row'] > self.dataset_cap:
+            rows_collection.remove({'md5': md5, 'end_row': {'$lte': num_rows - self.dataset_cap}})
+            oldest = rows_collection.find_one({'md5': md5}, {'first_row': 1}, sort=[('first_row', pymongo.ASCENDING)])
+            dataset_first_row = oldest['first_row'] if oldest else num_rows
+            self.database[self.dataset_collection].update({'md5': md5, 'first_row': {'$lt': dataset_first_row}},
+                                                          {'$set': {'first_row': dataset_first_row}})
+        return md5
+
+    def get_dataset_info(self, md5):
+        """Get the info of a dataset (name, header, fields, num_rows, first_row, source).
+
+        Args:
+            md5: The md5 of the dataset.
+
+        Returns:
+            The dataset info (None if there's no such dataset). The rows still kept
+            are rows first_row up to num_rows (rows are numbered from the start of the dataset).
+        """
+        return self.database[self.dataset_collection].find_one({'md5': md5}, {'_id': 0})
+
+    def dataset_batches(self, md5, first_row=0):
+        """Get the batches of rows of a dataset in order.
+
+        Args:
+            md5: The md5 of the dataset.
+            first_row: Skip the batches that end before this row.
+
+        Returns:
+            A cursor of the batches ({'first_row', 'end_row', 'fields', 'rows'}).
+        """
+        return self.database[self.dataset_rows_collection].find({'md5': md5, 'end_row': {'$gt': first_row}},
+                                                                {'_id': 0}).sort('first_row', pymongo.ASCENDING)
+
+    def remove_dataset(self, md5):
+        """Delete a dataset and all its rows"""
+        self.database[self.dataset_rows_collection].remove({'md5': md5})
+        self.database[self.dataset_collection].remove({'md5': md5})
+
+    def sample_lengths(self, md5_list):
+        """Get the lengths of a list of samples without pulling their bytes.
+
+        Args:
+            md5_list: a list of md5s.
+
+        Returns:
+            A dictionary of md5: length (samples that aren't in the data store are left out).
+        """
+        cursor = self.database[self.sample_collection].find({'md5': {'$in': md5_list}}, {'_id': 0, 'md5': 1, 'length': 1})
+        return {item['md5']: item['length'] for item in cursor}
+
     def get_sample_window(self, type_tag, size=10):
         """Get a window of samples not to exceed size (in MB).
 
@@ -327,19 +556,22 @@ class DataStore(object):
         cursor = self.database['tags'].find({}, {'_id':0, 'md5':1, 'tags':1})
         return [item for item in cursor]
 
-    def store_work_results(self, results, collection, md5):
+    def store_work_results(self, results, collection, md5, version_hash=None):
         """Store the output results of the worker.
 
         Args:
             results: a dictionary.
             collection: the database collection to store the results in.
             md5: the md5 of sample data to be updated.
+            version_hash: the version hash of the work chain that produced the results (optional).
 
         """
 
         # Make sure the md5 and time stamp is on the data before storing
         results['md5'] = md5
         results['__time_stamp'] = datetime.datetime.utcnow()
+        if version_hash:
+            results['__version_hash'] = version_hash
 
         # If the data doesn't have a 'mod_time' field add one now
         if 'mod_time' not in results:
@@ -367,6 +599,91 @@ class DataStore(object):
         """
         return self.database[collection].find_one({'md5':md5})
 
+    def result_versions(self, collection, md5_list):
+        """Get the version hashes of the worker results for a list of md5s (without pulling the results).
+
+        Args:
+            collection: the database collection storing the results.
+            md5_list: a list of md5s.
+
+        Returns:
+            A dictionary of md5: {'__version_hash': version hash} (md5s without results are left out).
+        """
+        cursor = self.database[collection].find({'md5': {'$in': md5_list}}, {'_id': 0, 'md5': 1, '__version_hash': 1})
+        return {item.pop('md5'): item for item in cursor}
+
+    def stale_md5s(self, collection, version_hash):
+        """Find the worker results that were not produced by the given version hash.
+
+        Args:
+            collection: the database collection storing the results.
+            version_hash: the current version hash of the work chain.
+
+        Returns:
+            A generator of md5s whose results are stale.
+        """
+        cursor = self.database[collection].find({'__version_hash': {'$ne': version_hash}}, {'_id': 0, 'md5': 1})
+        return (item['md5'] for item in cursor)
+
+    def store_failure(self, collection, md5, version_hash, error, retry_after, count=1):
+        """Store a worker failure (so the work isn't retried on every request).
+
+        Args:
+            collection: the worker (output collection) that failed.
+            md5: the md5 of the sample the worker failed on.
+            version_hash: the version hash of the work chain that failed.
+            error: the error message.
+            retry_after: seconds before the work may be retried.
+            count: the number of times in a row the work has failed.
+        """
+        now = datetime.datetime.utcnow()
+        failure = {'worker': collection, 'md5': md5, '__version_hash': version_hash, 'error': error, 'count': count,
+                   'time_stamp': now, 'retry_after': now + datetime.timedelta(seconds=retry_after)}
+        self.database['failures'].update({'worker': collection, 'md5': md5}, failure, True)
+
+    def get_failure(self, collection, md5, version_hash, expired=False):
+        """Get a worker failure.
+
+        Args:
+            collection: the worker (output collection).
+            md5: the md5 of the sample.
+            version_hash: the current version hash of the work chain.
+            expired: also return a failure whose retry_after has passed.
+
+        Returns:
+            The failure dictionary (None if there isn't one).
+        """
+        query = {'worker': collection, 'md5': md5, '__version_hash': version_hash}
+        if not expired:
+            query['retry_after'] = {'$gt': datetime.datetime.utcnow()}
+        return self.database['failures'].find_one(query, {'_id': 0})
+
+    def clear_failure(self, collection, md5):
+        """Remove a worker failure (the work succeeded).
+
+        Args:
+            collection: the worker (output collection).
+            md5: the md5 of the sample.
+        """
+        self.database['failures'].remove({'worker': collection, 'md5': md5})
+
+    def store_cost_profile(self, worker_name, profile):
+        """Store the execution cost profile of a worker (see cost_model.CostProfile).
+
+        Args:
+            worker_name: the name of the worker.
+            profile: the profile dictionary.
+        """
+        self.database['worker_costs'].update({'worker': worker_name}, {'worker': worker_name, 'profile': profile}, True)
+
+    def get_cost_profiles(self):
+        """Get the execution cost profiles of all the workers.
+
+        Returns:
+            A dictionary of worker_name: profile dictionary.
+        """
+        return {item['worker']: item['profile'] for item in self.database['worker_costs'].find({}, {'_id': 0})}
+
     def all_sample_md5s(self, type_tag=None):
         """Return a list of all md5 matching the type_tag ('exe','pdf', etc).
 
@@ -401,6 +718,11 @@ class DataStore(object):
         except ValueError:
             print('Catching a benign exception thats expected...')
 
+        # Keep the worker cost profiles (they're about the workers not the samples) and the datasets
+        for collection in ['worker_costs', self.dataset_collection, self.dataset_rows_collection]:
+            if collection in all_c:
+                all_c.remove(collection)
+
         for collection in all_c:
             self.database.drop_collection(collection)
 
@@ -440,6 +762,20 @@ class DataStore(object):
             except ValueError:
                 print('Catching a benign exception thats expected...')
 
+            # Worker failures aren't worker output (and are updated in place)
+            if 'failures' in all_c:
+                all_c.remove('failures')
+                self.database['failures'].create_index([('worker', 1), ('md5', 1)])
+            if 'worker_costs' in all_c:
+                all_c.remove('worker_costs')
+
+            # Datasets are never capped (they roll over on their own, see append_dataset_rows)
+            for collection in [self.dataset_collection, self.dataset_rows_collection]:
+                if collection in all_c:
+                    all_c.remove(collection)
+            self.database[self.dataset_rows_collection].create_index([('md5', 1), ('first_row', 1)])
+            self.database[self.dataset_rows_collection].create_index([('md5', 1), ('source', 1)])
+
             # Convert collections to capped if desired
             if self.worker_cap:
                 size = self.worker_cap * pow(1024, 2)  # MegaBytes per collection
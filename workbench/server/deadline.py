@@ -0,0 +1,143 @@
+"""Worker execution deadlines for WorkBench.
+
+   Workers can declare a deadline (seconds) for their execute method:
+
+       class PEFileWorker(object):
+           dependencies = ['sample']
+           deadline = 60
+           isolated = True
+
+   Cooperative workers (ones that do I/O or call gevent.sleep, e.g. the
+   subprocess based pcap_bro) are stopped with a gevent Timeout. A CPU bound
+   parse never yields to gevent, so workers can also ask to be isolated: their
+   execute runs in a forked process that is killed when the deadline passes.
+
+   Note: Isolated workers must not call back into Workbench (the forked
+         process can't use the server's ZeroMQ context).
+"""
+
+import traceback
+import multiprocessing
+import gevent
+from gevent import socket as gsocket
+
+
+class WorkerTimeout(Exception):
+    """A worker ran past its deadline."""
+    pass
+
+
+def execute(worker_class, input_data, deadline=None, isolated=False):
+    """Execute a worker with a deadline.
+
+    Args:
+        worker_class: the worker class.
+        input_data: the input data for the worker execute method.
+        deadline: seconds the worker gets to execute (None or 0 for no deadline).
+        isolated: execute the worker in a forked process (killed at the deadline).
+
+    Returns:
+        The worker output.
+
+    Raises:
+        WorkerTimeout: When the worker ran past its deadline.
+    """
+    if isolated:
+        return _execute_isolated(worker_class, input_data, deadline)
+
+    # Workers see a gevent.Timeout (so they can clean up, e.g. kill a subprocess)
+    timeout = gevent.Timeout(deadline or None)
+    try:
+        with timeout:
+            return worker_class().execute(input_data)
+    except gevent.Timeout as error:
+        if error is not timeout:
+            raise
+        raise WorkerTimeout('%s ran past its %s second deadline' % (worker_class.__name__, deadline))
+
+
+def _isolated_process(worker_class, input_data, connection):
+    """Internal: Runs in the forked process, sends back ('ok', output) or ('error', traceback)."""
+    try:
+        output = worker_class().execute(input_data)
+        connection.send(('ok', output))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def _execute_isolated(worker_class, input_data, deadline):
+    """Internal: Execute a worker in a forked process, kill it if it runs past the deadline."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(target=_isolated_process,
+                                                          args=(worker_class, input_data, sender))
+    process.start()
+    sender.close()
+    try:
+        try:
+            gsocket.wait_read(receiver.fileno(), timeout=deadline or None)
+        except gsocket.timeout:
+            raise WorkerTimeout('%s ran past its %s second deadline (killed)' % (worker_class.__name__, deadline))
+        try:
+            status, output = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError('%s exited with code %s' % (worker_class.__name__, process.exitcode))
+        if status == 'error':
+            raise RuntimeError('%s failed in its isolated process:\n%s' % (worker_class.__name__, output))
+        return output
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+
+
+def test():
+    """Test the deadlines (cooperative and isolated)."""
+    import time
+
+    class Sleepy(object):
+        dependencies = []
+        def execute(self, input_data):
+            gevent.sleep(input_data['seconds'])
+            return {'slept': input_data['seconds']}
+
+    class Spinner(object):
+        dependencies = []
+        def execute(self, input_data):
+            end = time.time() + input_data['seconds']
+            while time.time() < end:
+                pass
+            return {'spun': input_data['seconds']}
+
+    class Broken(object):
+        dependencies = []
+        def execute(self, input_data):
+            raise ValueError('bad sample')
+
+    # Within the deadline
+    assert execute(Sleepy, {'seconds': 0.1}, deadline=1) == {'slept': 0.1}
+    assert execute(Spinner, {'seconds': 0.1}, deadline=1, isolated=True) == {'spun': 0.1}
+    assert execute(Sleepy, {'seconds': 0.1}) == {'slept': 0.1}
+
+    # Past the deadline
+    for worker_class, isolated in [(Sleepy, False), (Spinner, True)]:
+        start = time.time()
+        try:
+            execute(worker_class, {'seconds': 5}, deadline=0.5, isolated=isolated)
+            assert False, 'should have timed out'
+        except WorkerTimeout as error:
+            print(error)
+        assert time.time() - start < 2
+
+    # Errors in the isolated process come back as errors
+    try:
+        execute(Broken, {}, deadline=1, isolated=True)
+        assert False, 'should have raised'
+    except RuntimeError as error:
+        assert 'bad sample' in str(error)
+
+if __name__ == '__main__':
+    test()
@@ -1,18 +1,42 @@
-""" A simple directory watcher 
+""" A simple directory watcher
+
+    Uses inotify (via inotify_simple) when it's available so an idle watcher
+    costs nothing, otherwise falls back to polling the directory. Bursts of
+    changes (editors often write/rename/touch a file several times on save)
+    are debounced into a single set of callbacks, a directory that never
+    goes quiet (a log that's written all the time) still gets its callbacks
+    every max_wait seconds.
+
     Credit: ronedg @ http://stackoverflow.com/questions/182197/how-do-i-watch-a-file-for-changes-using-python
 """
-import os, time
+import os
+import time
 import gevent
+from gevent import socket as gsocket
+
+# Optional: inotify support (Linux only)
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
 
 class DirWatcher(object):
     """ A simple directory watcher """
-    
-    def __init__(self, path):
+
+    def __init__(self, path, debounce=0.5, poll_interval=1.0, suffix='.py', max_wait=None):
         """ Initialize the Directory Watcher
         Args:
             path: path of the directory to watch
+            debounce: seconds the directory has to be quiet before the callbacks fire
+            max_wait: the longest the callbacks wait for the directory to go quiet (default: 10 x debounce)
+            poll_interval: seconds between polls (only used when inotify isn't available)
+            suffix: only the files with this suffix are watched (the plugins by default)
         """
         self.path = path
+        self.suffix = suffix
+        self.debounce = debounce
+        self.max_wait = max_wait if max_wait is not None else 10 * debounce
+        self.poll_interval = poll_interval
         self.on_create = None
         self.on_modify = None
         self.on_delete = None
@@ -26,41 +50,154 @@ class DirWatcher(object):
 
     def start_monitoring(self):
         """ Monitor the path given """
+        if inotify_simple:
+            try:
+                self.jobs = [gevent.spawn(self._inotify_monitoring, inotify_simple.INotify())]
+                return
+            except OSError as error:
+                print('Warning: inotify not available (%s), polling %s instead' % (error, self.path))
         self.jobs = [gevent.spawn(self._start_monitoring)]
 
+    def _inotify_monitoring(self, inotify):
+        """ Internal method that waits on inotify events for the directory """
+        flags = inotify_simple.flags
+        inotify.add_watch(self.path, flags.CREATE | flags.CLOSE_WRITE | flags.MODIFY |
+                          flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE)
+        before = self._file_timestamp_info(self.path)
+
+        while True:
+
+            # Block (cooperatively) until something happens in the directory
+            gsocket.wait_read(inotify.fileno())
+            inotify.read(timeout=0)
+
+            # Debounce: keep reading events until the directory has been quiet for a bit (or max_wait is up)
+            deadline = time.time() + self.max_wait
+            while time.time() < deadline:
+                try:
+                    gsocket.wait_read(inotify.fileno(), timeout=max(min(self.debounce, deadline - time.time()), 0))
+                    inotify.read(timeout=0)
+                except gsocket.timeout:
+                    break
+
+            after = self._file_timestamp_info(self.path)
+            self._dispatch(before, after)
+            before = after
+
     def _start_monitoring(self):
-        """ Internal method that monitors the directory for changes """
-        
+        """ Internal method that polls the directory for changes """
+
         # Grab all the timestamp info
         before = self._file_timestamp_info(self.path)
 
         while True:
-            gevent.sleep(1)
+            gevent.sleep(self.poll_interval)
             after = self._file_timestamp_info(self.path)
+            if after == before:
+                continue
+
+            # Debounce: wait until the directory stops changing (or max_wait is up)
+            deadline = time.time() + self.max_wait
+            while time.time() < deadline:
+                gevent.sleep(max(min(self.debounce, deadline - time.time()), 0))
+                settled = self._file_timestamp_info(self.path)
+                if settled == after:
+                    break
+                after = settled
 
-            added = [fname for fname in list(after.keys()) if fname not in list(before.keys())]
-            removed = [fname for fname in list(before.keys()) if fname not in list(after.keys())]
-            modified = []
-
-            for fname in list(before.keys()):
-                if fname not in removed:
-                    if os.path.getmtime(fname) != before.get(fname):
-                        modified.append(fname)
-
-            if added: 
-                self.on_create(added)
-            if removed: 
-                self.on_delete(removed)
-            if modified: 
-                self.on_modify(modified)
-    
+            self._dispatch(before, after)
             before = after
 
+    def _dispatch(self, before, after):
+        """ Compare two sets of timestamp info and call the callbacks """
+        added = [fname for fname in after if fname not in before]
+        removed = [fname for fname in before if fname not in after]
+        modified = [fname for fname in after if fname in before and after[fname] != before[fname]]
+
+        if added:
+            self.on_create(added)
+        if removed:
+            self.on_delete(removed)
+        if modified:
+            self.on_modify(modified)
+
     def _file_timestamp_info(self, path):
-        """ Grab all the timestamps for the files in the directory """
-        files = [os.path.join(path, fname) for fname in os.listdir(path) if '.py' in fname]
-        return dict ([(fname, os.path.getmtime(fname)) for fname in files])
+        """ Grab all the timestamps for the watched (python by default) files in the directory """
+        info = {}
+        for fname in os.listdir(path):
+            if fname.endswith(self.suffix):
+                fname = os.path.join(path, fname)
+                try:
+                    info[fname] = os.path.getmtime(fname)
+                except OSError:
+                    pass # Deleted between the listdir and the getmtime
+        return info
 
     def __del__(self):
         """ Cleanup the DirWatcher instance """
         gevent.joinall(self.jobs)
+
+
+def _keep_writing(path, seconds):
+    """ Test helper: append to a file every 50ms for a while """
+    end = time.time() + seconds
+    while time.time() < end:
+        with open(path, 'a') as busy_file:
+            busy_file.write('# Busy\n')
+        gevent.sleep(0.05)
+
+
+def test():
+    """ Test the directory watcher (inotify if available and polling) """
+    import tempfile
+    import shutil
+
+    for use_inotify in [True, False]:
+        temp_dir = tempfile.mkdtemp()
+        events = []
+        try:
+            watcher = DirWatcher(temp_dir, debounce=0.2, poll_interval=0.1)
+            watcher.register_callbacks(lambda files: events.append(('create', files)),
+                                       lambda files: events.append(('modify', files)),
+                                       lambda files: events.append(('delete', files)))
+            if use_inotify:
+                watcher.start_monitoring()
+            else:
+                watcher.jobs = [gevent.spawn(watcher._start_monitoring)]
+            gevent.sleep(0.2)
+
+            # A burst of writes should be a single create
+            plugin = os.path.join(temp_dir, 'my_worker.py')
+            for _ in range(5):
+                with open(plugin, 'w') as plugin_file:
+                    plugin_file.write('# Hi\n')
+                gevent.sleep(0.05)
+            with open(os.path.join(temp_dir, 'notes.txt'), 'w') as other_file:
+                other_file.write('not a plugin')
+            gevent.sleep(1.0)
+            print(events)
+            assert events == [('create', [plugin])]
+
+            # Modify then delete
+            with open(plugin, 'a') as plugin_file:
+                plugin_file.write('# There\n')
+            gevent.sleep(1.0)
+            os.remove(plugin)
+            gevent.sleep(1.0)
+            print(events)
+            assert events[1:] == [('modify', [plugin]), ('delete', [plugin])]
+
+            # A file that's written all the time (never quiet) still gets callbacks every max_wait (10 x debounce)
+            del events[:]
+            writer = gevent.spawn(_keep_writing, plugin, 3.5)
+            gevent.sleep(3.0)
+            print(events)
+            assert events and events[0] == ('create', [plugin])
+            writer.join()
+        finally:
+            gevent.killall(watcher.jobs)
+            watcher.jobs = []
+            shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    test()
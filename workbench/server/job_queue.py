@@ -0,0 +1,201 @@
+"""JobQueue class for WorkBench.
+
+   Background (worker_name, md5) jobs, for instance the ingest pipelines
+   that warm the cache for new samples or queued work requests. Jobs run in
+   priority order (lower number first) and within a priority the cheapest
+   job runs first (shortest job first, using the estimates of the cost
+   model). CPU heavy and I/O heavy jobs each get their own slots so a few
+   long Bro runs don't hold up the quick CPU work (and vice versa).
+
+   A job that is already queued (or running) isn't queued again and the
+   starts of background (LOW and PREFETCH priority) jobs can be rate limited
+   so they don't crowd out the interactive requests.
+"""
+
+import time
+import heapq
+import itertools
+import gevent
+import gevent.event
+
+# Job priorities (lower runs first)
+HIGH = 0
+NORMAL = 10
+LOW = 20
+PREFETCH = 30
+
+
+class JobQueue(object):
+    """Cost aware priority queue of background (worker_name, md5) jobs."""
+
+    def __init__(self, work_func, estimate_func=None, slots=None, rate_limit=0):
+        """Initialization for the JobQueue class.
+
+        Args:
+            work_func: called as work_func(worker_name, md5) for each job.
+            estimate_func: called as estimate_func(worker_name, md5) for each new job, returns
+                           (kind, estimated seconds) where kind is one of the slots keys.
+            slots: dictionary of kind: number of jobs of that kind running at once (default {'cpu': 1}).
+            rate_limit: maximum starts per second of LOW (or lower) priority jobs (0 for no limit).
+        """
+        self.work_func = work_func
+        self.estimate_func = estimate_func or (lambda worker_name, md5: ('cpu', 0.0))
+        self.slots = slots or {'cpu': 1}
+        self.rate_limit = rate_limit
+        self.heaps = {kind: [] for kind in self.slots}
+        self.ready = {kind: gevent.event.Event() for kind in self.slots}
+        self.counter = itertools.count()
+
+        # Job: heap entry for the queued jobs and job: (kind, start time, estimate) for the running ones
+        self.queued = {}
+        self.running = {}
+        self.completed = 0
+        self.failed = 0
+        self.next_start = 0
+        self.greenlets = [gevent.spawn(self._run, kind) for kind, count in self.slots.items() for _ in range(count)]
+
+    def put(self, worker_name, md5, priority=LOW):
+        """Queue a job.
+
+        Args:
+            worker_name: the worker to run.
+            md5: the md5 of the sample (or sample_set).
+            priority: the job priority (HIGH, NORMAL, LOW, PREFETCH or any number, lower runs first).
+
+        Returns:
+            True if the job was queued, False if it's already queued or running.
+        """
+        job = (worker_name, md5)
+        if job in self.queued or job in self.running:
+            return False
+        kind, estimate = self.estimate_func(worker_name, md5)
+        if kind not in self.heaps:
+            kind = sorted(self.heaps.keys())[0]
+        entry = (priority, estimate, next(self.counter), job, kind)
+        self.queued[job] = entry
+        heapq.heappush(self.heaps[kind], entry)
+        self.ready[kind].set()
+        return True
+
+    def eta(self, worker_name, md5):
+        """Estimated seconds until a job is done.
+
+        Args:
+            worker_name: the worker.
+            md5: the md5 of the sample (or sample_set).
+
+        Returns:
+            The estimated seconds (None if the job isn't queued or running).
+        """
+        job = (worker_name, md5)
+        now = time.time()
+        if job in self.running:
+            _, start, estimate = self.running[job]
+            return max(estimate - (now - start), 0.0)
+        if job not in self.queued:
+            return None
+
+        # The work ahead of the job (queued before it plus what's left of the running jobs) shared by the slots
+        entry = self.queued[job]
+        kind = entry[4]
+        ahead = sum(other[1] for other in self.heaps[kind] if other < entry)
+        ahead += sum(max(estimate - (now - start), 0.0) for other_kind, start, estimate in self.running.values()
+                     if other_kind == kind)
+        return ahead / self.slots[kind] + entry[1]
+
+    def depth(self):
+        """Number of jobs waiting to run."""
+        return len(self.queued)
+
+    def clear(self):
+        """Drop all the waiting jobs."""
+        self.queued = {}
+        for kind in self.heaps:
+            self.heaps[kind] = []
+
+    def stop(self):
+        """Stop the background greenlets."""
+        gevent.killall(self.greenlets)
+
+    def _wait_for_rate_limit(self):
+        """Internal: Space the job starts out to the rate limit."""
+        if not self.rate_limit:
+            return
+        now = time.time()
+        if self.next_start > now:
+            gevent.sleep(self.next_start - now)
+        self.next_start = max(now, self.next_start) + 1.0 / self.rate_limit
+
+    def _run(self, kind):
+        """Internal: Background greenlet that runs the jobs of one kind."""
+        heap = lambda: self.heaps[kind]
+        while True:
+            if not heap():
+                self.ready[kind].clear()
+                self.ready[kind].wait()
+                continue
+            if heap()[0][0] >= LOW:
+                self._wait_for_rate_limit()
+                if not heap():
+                    continue
+            _, estimate, _, job, _ = heapq.heappop(heap())
+            del self.queued[job]
+            self.running[job] = (kind, time.time(), estimate)
+            try:
+                self.work_func(*job)
+                self.completed += 1
+            except Exception as error:
+                self.failed += 1
+                print('Warning: Background job %s(%s) failed: %s' % (job[0], job[1], error))
+            finally:
+                del self.running[job]
+
+            # Give the interactive requests a chance to run
+            gevent.sleep(0)
+
+
+def test():
+    """Test for the JobQueue class."""
+    done = []
+    costs = {'view': ('cpu', 0.01), 'strings': ('cpu', 0.03), 'meta': ('cpu', 0.02), 'pcap_bro': ('io', 0.2)}
+
+    def work(worker_name, md5):
+        gevent.sleep(costs[worker_name][1])
+        if md5 == 'bad':
+            raise RuntimeError('bad sample')
+        done.append((worker_name, md5))
+
+    queue = JobQueue(work, lambda worker_name, md5: costs[worker_name], slots={'cpu': 1, 'io': 1}, rate_limit=50)
+
+    # Priority first then cheapest first, dedup, the io job runs in its own slot
+    assert queue.put('strings', 'aaa', LOW)
+    assert queue.put('meta', 'aaa', LOW)
+    assert queue.put('view', 'aaa', NORMAL)
+    assert not queue.put('meta', 'aaa', LOW)
+    assert queue.put('pcap_bro', 'aaa', LOW)
+    assert queue.put('meta', 'bad', LOW)
+    assert queue.depth() == 5
+
+    # ETA: view (0.01) + meta (0.02) + meta (0.02) are ahead of strings
+    assert abs(queue.eta('strings', 'aaa') - 0.08) < 1e-6
+    assert abs(queue.eta('pcap_bro', 'aaa') - 0.2) < 1e-6
+    assert queue.eta('strings', 'bbb') is None
+
+    start = time.time()
+    while queue.depth() or queue.running:
+        gevent.sleep(0.01)
+    print(done)
+    assert done == [('view', 'aaa'), ('meta', 'aaa'), ('strings', 'aaa'), ('pcap_bro', 'aaa')]
+    assert queue.failed == 1 and queue.completed == 4
+
+    # The cpu and io slots ran side by side
+    assert time.time() - start < 0.35
+
+    # A finished job can be queued again, clear drops the waiting jobs
+    assert queue.put('meta', 'aaa')
+    queue.clear()
+    assert queue.depth() == 0 and queue.put('meta', 'aaa')
+    queue.stop()
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,151 @@
+"""LineIndex class for WorkBench.
+
+   A line-offset index for log samples: the byte offset where each row (line)
+   starts, built in one streaming pass over the sample and stored next to it
+   in the DataStore. With the index a page of rows anywhere in a huge log
+   (the first rows, rows N to N+M, the tail) is a single ranged read and the
+   row count is free. A stored index isn't loaded, the two offsets a page
+   needs are read straight out of the index file (see LineIndex.from_file).
+"""
+
+import numpy as np
+
+
+class LineIndex(object):
+    """Byte offsets of the rows of a log."""
+
+    def __init__(self, starts, size):
+        """Initialization for the LineIndex class.
+
+        Args:
+            starts: NumPy int64 array of the byte offset where each row starts
+                    (or anything with len() and integer indexing, see from_file).
+            size: the size of the log in bytes.
+        """
+        self.starts = starts
+        self.size = size
+
+    @classmethod
+    def build(cls, chunks):
+        """Build the index of a log in one pass over its chunks.
+
+        Args:
+            chunks: an iterable of the byte chunks of the log.
+
+        Returns:
+            The LineIndex of the log (a trailing newline doesn't start an empty row).
+        """
+        newlines = []
+        size = 0
+        for chunk in chunks:
+            newlines.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n')) + size)
+            size += len(chunk)
+        starts = np.concatenate([np.zeros(1, dtype=np.int64)] + [positions + 1 for positions in newlines])
+        starts = starts[starts < size] if size else starts[:0]
+        return cls(starts.astype(np.int64), size)
+
+    def num_rows(self):
+        """The number of rows in the log."""
+        return len(self.starts)
+
+    def byte_range(self, offset=0, max_rows=None):
+        """The byte range of a page of rows.
+
+        Args:
+            offset: the first row (negative counts back from the end, e.g. -20 for the last 20 rows).
+            max_rows: the maximum number of rows (None for the rest of the log).
+
+        Returns:
+            A tuple of (start byte, end byte, number of rows) for the page.
+        """
+        num_rows = self.num_rows()
+        first = max(num_rows + offset, 0) if offset < 0 else min(offset, num_rows)
+        last = num_rows if max_rows is None else min(first + max_rows, num_rows)
+        if first >= last:
+            return self.size, self.size, 0
+        end = self.starts[last] if last < num_rows else self.size
+        return int(self.starts[first]), int(end), last - first
+
+    def to_bytes(self):
+        """The index as bytes (for storage)."""
+        return np.array([self.size], dtype='<i8').tobytes() + self.starts.astype('<i8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, index_bytes):
+        """Load an index stored with to_bytes."""
+        values = np.frombuffer(index_bytes, dtype='<i8')
+        return cls(values[1:].astype(np.int64), int(values[0]))
+
+    @classmethod
+    def from_file(cls, index_file):
+        """Open an index stored with to_bytes without loading it (offsets are read as they're needed).
+
+        Args:
+            index_file: a seekable file object of the stored index (e.g. a GridFS file).
+        """
+        index_file.seek(0)
+        size = _read_int64(index_file)
+        index_file.seek(0, 2)
+        return cls(_StoredStarts(index_file, (index_file.tell() - 8) // 8), size)
+
+
+class _StoredStarts(object):
+    """Internal: The row offsets of a stored index, read out of the index file one at a time."""
+
+    def __init__(self, index_file, num_rows):
+        self.index_file = index_file
+        self.num_rows = num_rows
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, row):
+        self.index_file.seek(8 + 8*row)
+        return _read_int64(self.index_file)
+
+
+def _read_int64(index_file):
+    """Internal: Read a stored (little endian) int64."""
+    return int(np.frombuffer(index_file.read(8), dtype='<i8')[0])
+
+
+def test():
+    """Test for the LineIndex class."""
+    import io
+    log = b''.join(b'row %d\n' % index for index in range(1000))
+    chunks = [log[start:start+777] for start in range(0, len(log), 777)]
+    index = LineIndex.build(chunks)
+    rows = log.split(b'\n')[:-1]
+    assert index.num_rows() == 1000 == log.count(b'\n')
+
+    # Pages, the tail and past the end
+    start, end, count = index.byte_range(10, 5)
+    assert log[start:end].split(b'\n')[:-1] == rows[10:15] and count == 5
+    start, end, count = index.byte_range(-3)
+    assert log[start:end].split(b'\n')[:-1] == rows[-3:] and count == 3
+    assert index.byte_range(0)[:2] == (0, len(log))
+    assert index.byte_range(2000, 10)[2] == 0
+
+    # No trailing newline, empty log, storage round trip
+    assert LineIndex.build([b'a\nb']).num_rows() == 2 and LineIndex.build([b'a\nb']).byte_range(-1)[:2] == (2, 3)
+    assert LineIndex.build([]).num_rows() == 0 and LineIndex.build([b'']).byte_range(0, 10)[2] == 0
+    copy = LineIndex.from_bytes(index.to_bytes())
+    assert copy.size == index.size and (copy.starts == index.starts).all()
+
+    # A stored index opened as a file gives the same pages and only reads the offsets they need
+    class CountingFile(io.BytesIO):
+        bytes_read = 0
+        def read(self, size=-1):
+            data = io.BytesIO.read(self, size)
+            self.bytes_read += len(data)
+            return data
+    index_file = CountingFile(index.to_bytes())
+    stored = LineIndex.from_file(index_file)
+    assert stored.num_rows() == 1000 and stored.size == index.size
+    for offset, max_rows in [(10, 5), (-3, None), (0, None), (2000, 10), (999, 1)]:
+        assert stored.byte_range(offset, max_rows) == index.byte_range(offset, max_rows)
+    assert index_file.bytes_read <= 8 * 11
+    assert LineIndex.from_file(io.BytesIO(LineIndex.build([]).to_bytes())).byte_range(-5)[2] == 0
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,215 @@
+"""Metrics class for WorkBench.
+
+   Keeps per-worker counters, latency histograms, cache statistics and
+   gauges in memory. The metrics can be pulled as a dictionary (get_stats)
+   or as Prometheus style text (prometheus_text/wsgi_app).
+"""
+
+import time
+import bisect
+import collections
+import contextlib
+
+
+class Histogram(object):
+    """A cumulative histogram with fixed (Prometheus style) buckets."""
+
+    # Bucket upper bounds in seconds (the last implicit bucket is +Inf)
+    buckets = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        """Initialization for the Histogram."""
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add an observation to the histogram.
+
+        Args:
+            value: the observed value (seconds).
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile (the upper bound of the bucket the quantile falls in).
+
+        Args:
+            q: the quantile (0.5 for the median).
+
+        Returns:
+            The estimated quantile or None if there are no observations.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        """Summary of the histogram as a dictionary."""
+        return {'count': self.count, 'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(.5), 'p95': self.quantile(.95), 'p99': self.quantile(.99)}
+
+
+class Metrics(object):
+    """Metrics for Workbench."""
+
+    def __init__(self):
+        """Initialization for the Metrics class."""
+        self.start_time = time.time()
+        self.counters = collections.defaultdict(int)
+        self.histograms = collections.defaultdict(Histogram)
+        self.caches = collections.defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.gauges = {}
+
+    def incr(self, name, worker=None, amount=1):
+        """Increment a counter.
+
+        Args:
+            name: the name of the counter (e.g. 'executions').
+            worker: the worker the counter is for (None for a server wide counter).
+            amount: the amount to increment by.
+        """
+        self.counters[(name, worker)] += amount
+
+    def observe(self, name, value, worker=None):
+        """Observe a value (typically a latency in seconds) into a histogram.
+
+        Args:
+            name: the name of the histogram (e.g. 'latency').
+            value: the observed value.
+            worker: the worker the observation is for (None for a server wide histogram).
+        """
+        self.histograms[(name, worker)].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, worker=None):
+        """Context manager that observes the elapsed time of the block."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, worker)
+
+    def cache_hit(self, cache, hit=True):
+        """Record a cache hit (or miss) for the named cache.
+
+        Args:
+            cache: the name of the cache (e.g. 'results').
+            hit: True for a hit, False for a miss.
+        """
+        self.caches[cache]['hits' if hit else 'misses'] += 1
+
+    def register_gauge(self, name, func):
+        """Register a gauge, the func is called whenever the metrics are pulled.
+
+        Args:
+            name: the name of the gauge (e.g. 'queue_depth').
+            func: a callable returning the current value of the gauge.
+        """
+        self.gauges[name] = func
+
+    def get_stats(self):
+        """Get all of the metrics as a dictionary.
+
+        Returns:
+            A dictionary with uptime, server wide counters, per-worker stats, caches and gauges.
+        """
+        stats = {'uptime': time.time() - self.start_time, 'counters': {}, 'workers': {},
+                 'caches': {}, 'gauges': {}}
+
+        # Counters and histograms (per-worker stats go into the workers dictionary)
+        for (name, worker), value in self.counters.items():
+            if worker:
+                stats['workers'].setdefault(worker, {})[name] = value
+            else:
+                stats['counters'][name] = value
+        for (name, worker), histogram in self.histograms.items():
+            if worker:
+                stats['workers'].setdefault(worker, {})[name] = histogram.to_dict()
+            else:
+                stats['counters'][name] = histogram.to_dict()
+
+        # Caches with hit ratios
+        for cache, counts in self.caches.items():
+            total = counts['hits'] + counts['misses']
+            stats['caches'][cache] = dict(counts, hit_ratio=float(counts['hits'])/total if total else None)
+
+        # Gauges
+        for name, func in self.gauges.items():
+            stats['gauges'][name] = func()
+
+        return stats
+
+    def prometheus_text(self):
+        """Get all of the metrics in the Prometheus text exposition format."""
+        lines = []
+        def _labels(worker, extra=''):
+            labels = ['worker="%s"' % worker] if worker else []
+            if extra:
+                labels.append(extra)
+            return '{%s}' % ','.join(labels) if labels else ''
+
+        for (name, worker), value in sorted(self.counters.items(), key=lambda item: item[0][0]):
+            lines.append('workbench_%s_total%s %s' % (name, _labels(worker), value))
+        for (name, worker), histogram in sorted(self.histograms.items(), key=lambda item: item[0][0]):
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                lines.append('workbench_%s_seconds_bucket%s %d' % (name, _labels(worker, 'le="%s"' % bound), total))
+            lines.append('workbench_%s_seconds_bucket%s %d' % (name, _labels(worker, 'le="+Inf"'), histogram.count))
+            lines.append('workbench_%s_seconds_sum%s %f' % (name, _labels(worker), histogram.sum))
+            lines.append('workbench_%s_seconds_count%s %d' % (name, _labels(worker), histogram.count))
+        for cache, counts in sorted(self.caches.items()):
+            lines.append('workbench_cache_hits_total{cache="%s"} %d' % (cache, counts['hits']))
+            lines.append('workbench_cache_misses_total{cache="%s"} %d' % (cache, counts['misses']))
+        for name, func in sorted(self.gauges.items()):
+            lines.append('workbench_%s %s' % (name, func()))
+        lines.append('workbench_uptime_seconds %f' % (time.time() - self.start_time))
+        return '\n'.join(lines) + '\n'
+
+    def wsgi_app(self, environ, start_response):
+        """A tiny WSGI app that serves the Prometheus text on any path."""
+        body = self.prometheus_text().encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def test():
+    """Test for the Metrics class."""
+    metrics = Metrics()
+    for value in [.002, .02, .2, 2.0]:
+        metrics.observe('latency', value, worker='meta')
+    metrics.incr('executions', worker='meta', amount=4)
+    metrics.incr('errors', worker='meta')
+    metrics.cache_hit('results')
+    metrics.cache_hit('results', hit=False)
+    metrics.register_gauge('in_flight', lambda: 3)
+    with metrics.timer('latency', worker='strings'):
+        pass
+
+    stats = metrics.get_stats()
+    print(stats)
+    assert stats['workers']['meta']['executions'] == 4
+    assert stats['workers']['meta']['latency']['count'] == 4
+    assert stats['workers']['meta']['latency']['p50'] == .025
+    assert stats['workers']['strings']['latency']['count'] == 1
+    assert stats['caches']['results']['hit_ratio'] == .5
+    assert stats['gauges']['in_flight'] == 3
+
+    text = metrics.prometheus_text()
+    print(text)
+    assert 'workbench_executions_total{worker="meta"} 4' in text
+    assert 'workbench_latency_seconds_count{worker="meta"} 4' in text
+
+if __name__ == '__main__':
+    test()
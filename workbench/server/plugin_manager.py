@@ -5,6 +5,8 @@
 """
 
 import os, sys
+import json
+import hashlib
 from datetime import datetime
 from . import dir_watcher
 import inspect
@@ -15,17 +17,24 @@ import importlib
 class PluginManager(object):
     """Plugin Manager for Workbench."""
 
-    def __init__(self, plugin_callback, plugin_dir = 'workers'):
+    # Plugin meta-data kept in the manifest (everything except the class and test method)
+    manifest_keys = ['name', 'dependencies', 'optional_dependencies', 'docstring', 'sample_set_input',
+                     'deadline', 'isolated', 'version', 'source_hash', 'file_hash']
+
+    def __init__(self, plugin_callback, plugin_dir = 'workers', manifest_path=None):
         """Initialize the Plugin Manager for Workbench.
 
         Args:
             plugin_callback: The callback for plugin. This is called when plugin is added.
             plugin_dir: The dir where plugin resides.
+            manifest_path: The plugin manifest file (defaults to .plugin_manifest.json in the plugin dir).
         """
 
-        # Set the callback, the plugin directory and load the plugins
+        # Set the callback, the plugin directory, read the manifest and load the plugins
         self.plugin_callback = plugin_callback
         self.plugin_dir = plugin_dir
+        self.manifest_path = manifest_path or os.path.join(plugin_dir, '.plugin_manifest.json')
+        self.manifest = self.read_manifest()
         self.load_all_plugins()
 
         # Now setup dynamic monitoring of the plugins directory
@@ -34,11 +43,16 @@ class PluginManager(object):
         self.watcher.start_monitoring()
 
     def load_all_plugins(self):
-        """Load all the plugins in the plugin directory"""
+        """Load all the plugins in the plugin directory.
+
+        Plugins that haven't changed since they were put into the manifest are
+        not imported here, their import happens on first use (see load_plugin).
+        """
 
         # Go through the existing python files in the plugin directory
         self.plugin_path = os.path.realpath(self.plugin_dir)
-        sys.path.append(self.plugin_dir)
+        if self.plugin_dir not in sys.path:
+            sys.path.append(self.plugin_dir)
         print('<<< Plugin Manager >>>')
         for f in [os.path.join(self.plugin_dir, child) for child in os.listdir(self.plugin_dir)]:
 
@@ -47,7 +61,45 @@ class PluginManager(object):
                 continue
 
             # Add the plugin
-            self.add_plugin(f)
+            self.add_plugin(f, lazy=True)
+
+        # Save any manifest changes
+        self.write_manifest()
+
+    def read_manifest(self):
+        """Read the plugin manifest from disk (an empty manifest if there isn't one)"""
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write_manifest(self):
+        """Write the plugin manifest to disk"""
+        try:
+            tmp_path = '%s.tmp.%d' % (self.manifest_path, os.getpid()) # Multi-process servers share the manifest
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump(self.manifest, manifest_file, indent=4, sort_keys=True)
+            os.rename(tmp_path, self.manifest_path)
+        except (IOError, OSError) as error:
+            print('Warning: Could not write plugin manifest %s (%s)' % (self.manifest_path, error))
+
+    def load_plugin(self, plugin):
+        """Import a lazily added plugin, filling in its class and test method.
+
+        Args:
+            plugin: the plugin dictionary (as passed to the plugin callback).
+
+        Raises:
+            RuntimeError: When the plugin fails to import or validate.
+        """
+        # The module may already be imported (e.g. plugins re-added after a clear_db)
+        handler = sys.modules.get(plugin['name']) or self.import_plugin(plugin['name'])
+        validated = self.validate(handler) if handler else None
+        if not validated:
+            raise RuntimeError('Failed to load plugin: %s' % plugin['name'])
+        plugin.update(validated)
+        print('\t- %s %sLOADED%s' % (plugin['name'], color.Green, color.Normal))
 
     def on_created(self, file_list):
         """Watcher callback
@@ -57,6 +109,7 @@ class PluginManager(object):
         """
         for plugin in file_list:
             self.add_plugin(plugin)
+        self.write_manifest()
 
     def on_modified(self, file_list):
         """Watcher callback.
@@ -66,6 +119,7 @@ class PluginManager(object):
         """
         for plugin in file_list:
             self.add_plugin(plugin)
+        self.write_manifest()
 
     def on_deleted(self, file_list):
         """Watcher callback.
@@ -88,32 +142,61 @@ class PluginManager(object):
             print('\t%sNote: still in memory, restart Workbench to remove...%s' % \
                   (color.Yellow, color.Normal))
 
-    def add_plugin(self, f):
+    def import_plugin(self, plugin_name):
+        """Import (or reload) the plugin module.
+
+        Args:
+            plugin_name: the name of the plugin (the module name).
+
+        Returns:
+            The plugin module or None if the import failed.
+        """
+
+        # It's possible the plugin has been modified and needs to be reloaded
+        if plugin_name in sys.modules:
+            try:
+                handler = importlib.reload(sys.modules[plugin_name])
+                print('\t- %s %sRELOAD%s' % (plugin_name, color.Yellow, color.Normal))
+            except ImportError as error:
+                print('Failed to import plugin: %s (%s)' % (plugin_name, error))
+                return None
+        else:
+            # Not already loaded so try to import it
+            try:
+                handler = __import__(plugin_name, globals(), locals(), [], -1)
+            except ImportError as error:
+                print('Failed to import plugin: %s (%s)' % (plugin_name, error))
+                return None
+        return handler
+
+    def add_plugin(self, f, lazy=False):
         """Adding and verifying plugin.
 
         Args:
             f: the filepath for the plugin.
+            lazy: use the manifest entry (if the file hasn't changed) instead of importing the plugin.
         """
         if f.endswith('.py'):
 
             # Just the basename without extension
             plugin_name = os.path.splitext(os.path.basename(f))[0]
 
-            # It's possible the plugin has been modified and needs to be reloaded
-            if plugin_name in sys.modules:
-                try:
-                    handler = importlib.reload(sys.modules[plugin_name])
-                    print('\t- %s %sRELOAD%s' % (plugin_name, color.Yellow, color.Normal))
-                except ImportError as error:
-                    print('Failed to import plugin: %s (%s)' % (plugin_name, error))
-                    return
-            else:
-                # Not already loaded so try to import it
-                try:
-                    handler = __import__(plugin_name, globals(), locals(), [], -1)
-                except ImportError as error:
-                    print('Failed to import plugin: %s (%s)' % (plugin_name, error))
-                    return
+            # If the plugin file hasn't changed we can skip the import and use the manifest
+            file_hash = self.file_hash(f)
+            entry = self.manifest.get(plugin_name)
+            if lazy and entry and entry['file_hash'] == file_hash and all(key in entry for key in self.manifest_keys):
+                plugin = dict(entry)
+                plugin['class'] = None
+                plugin['test'] = None
+                plugin['mod_time'] = datetime.utcfromtimestamp(os.path.getmtime(f))
+                print('\t- %s %sOK (lazy)%s' % (plugin_name, color.Green, color.Normal))
+                self.plugin_callback(plugin)
+                return
+
+            # Import the plugin
+            handler = self.import_plugin(plugin_name)
+            if not handler:
+                return
 
             # Run the handler through plugin validation
             plugin = self.validate(handler)
@@ -124,18 +207,61 @@ class PluginManager(object):
                 # modification time and register the plugin through the callback
                 plugin['name'] = plugin_name
                 plugin['dependencies'] = plugin['class'].dependencies
+                plugin['optional_dependencies'] = getattr(plugin['class'], 'optional_dependencies', [])
                 plugin['docstring'] = plugin['class'].__doc__
                 plugin['mod_time'] = datetime.utcfromtimestamp(os.path.getmtime(f))
 
+                # Plugin may declare a version, which goes into its source hash
+                # so that a version bump invalidates results even when the code didn't change
+                plugin['version'] = getattr(plugin['class'], 'version', None)
+                plugin['source_hash'] = self.source_hash(f, plugin['version'])
+                plugin['file_hash'] = file_hash
+
                 # Plugin may accept sample_sets as input
                 try:
                     plugin['sample_set_input'] = getattr(plugin['class'], 'sample_set_input')
                 except AttributeError:
                     plugin['sample_set_input'] = False
 
+                # Plugin may declare an execution deadline and ask to be run in its own process
+                plugin['deadline'] = getattr(plugin['class'], 'deadline', None)
+                plugin['isolated'] = getattr(plugin['class'], 'isolated', False)
+
+                # Remember the plugin meta-data so the next start up can skip the import
+                self.manifest[plugin_name] = {key: plugin[key] for key in self.manifest_keys}
+
                 # Now pass the plugin back to workbench
                 self.plugin_callback(plugin)
 
+    @staticmethod
+    def file_hash(f):
+        """Compute the md5 of the plugin file.
+
+        Args:
+            f: the filepath for the plugin.
+
+        Returns:
+            The md5 hexdigest of the plugin file.
+        """
+        with open(f, 'rb') as plugin_file:
+            return hashlib.md5(plugin_file.read()).hexdigest()
+
+    @staticmethod
+    def source_hash(f, plugin_version=None):
+        """Compute a content hash for a plugin.
+
+        Args:
+            f: the filepath for the plugin.
+            plugin_version: the version declared by the plugin class (None if not declared).
+
+        Returns:
+            The md5 hexdigest of the plugin source plus its declared version.
+        """
+        with open(f, 'rb') as plugin_file:
+            md5 = hashlib.md5(plugin_file.read())
+        md5.update(str(plugin_version).encode('utf-8'))
+        return md5.hexdigest()
+
     def validate(self, handler):
         """Validate the plugin, each plugin must have the following:
             1) The worker class must have an execute method: execute(self, input_data).
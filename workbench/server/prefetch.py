@@ -0,0 +1,104 @@
+"""Prefetcher class for WorkBench.
+
+   Analysts follow predictable paths: after a 'view' on an exe they ask for
+   pe_indicators, yara_sigs, strings... The Prefetcher learns how often each
+   worker follows another (per type_tag) from the work requests on each
+   sample and predicts the likely next workers, the server then runs them
+   at the lowest priority when it has idle capacity so the next request in
+   the session comes from the cache.
+"""
+
+import time
+import collections
+
+
+class Prefetcher(object):
+    """Learns worker transitions per type_tag and predicts the likely next workers."""
+
+    def __init__(self, min_probability=0.3, min_observations=5, session_timeout=1800, max_sessions=10000):
+        """Initialization for the Prefetcher class.
+
+        Args:
+            min_probability: how often a worker has to follow another to be predicted.
+            min_observations: transitions seen from a worker before we predict anything.
+            session_timeout: seconds between two requests on a sample for them to count as a transition.
+            max_sessions: number of recently requested samples we remember.
+        """
+        self.min_probability = min_probability
+        self.min_observations = min_observations
+        self.session_timeout = session_timeout
+        self.max_sessions = max_sessions
+
+        # (type_tag, worker): Counter of next workers and md5: (type_tag, last worker, time)
+        self.transitions = collections.defaultdict(collections.Counter)
+        self.sessions = collections.OrderedDict()
+
+    def type_tag(self, md5):
+        """The type_tag of a recently requested sample (None if we don't remember it)."""
+        session = self.sessions.get(md5)
+        return session[0] if session else None
+
+    def record(self, type_tag, md5, worker_name):
+        """Record a work request and predict the workers likely to be requested next.
+
+        Args:
+            type_tag: the type_tag of the sample.
+            md5: the md5 of the sample.
+            worker_name: the worker requested.
+
+        Returns:
+            A list of the likely next workers (most likely first).
+        """
+        now = time.time()
+
+        # A transition from the previous request on this sample
+        session = self.sessions.pop(md5, None)
+        if session:
+            _, last_worker, last_time = session
+            if last_worker != worker_name and now - last_time < self.session_timeout:
+                self.transitions[(type_tag, last_worker)][worker_name] += 1
+
+        # Remember this request (dropping the oldest sample if we're full)
+        self.sessions[md5] = (type_tag, worker_name, now)
+        if len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return self.predict(type_tag, worker_name)
+
+    def predict(self, type_tag, worker_name):
+        """The workers likely to be requested after worker_name on a sample of type_tag (most likely first)."""
+        counts = self.transitions.get((type_tag, worker_name))
+        if not counts:
+            return []
+        total = sum(counts.values())
+        if total < self.min_observations:
+            return []
+        return [name for name, count in counts.most_common() if count >= self.min_probability * total]
+
+    def summary(self):
+        """The learned transitions: {type_tag: {worker: {next worker: count}}} (for get_stats)."""
+        summary = collections.defaultdict(dict)
+        for (type_tag, worker_name), counts in self.transitions.items():
+            summary[type_tag][worker_name] = dict(counts)
+        return dict(summary)
+
+
+def test():
+    """Test for the Prefetcher class."""
+    prefetcher = Prefetcher(min_probability=0.3, min_observations=4, max_sessions=3)
+
+    # Analysts look at the view then the indicators, mostly the strings and sometimes the yara sigs
+    for index in range(5):
+        md5 = 'exe_%d' % index
+        assert prefetcher.record('exe', md5, 'view') == ([] if index < 4 else ['pe_indicators'])
+        prefetcher.record('exe', md5, 'pe_indicators')
+        prefetcher.record('exe', md5, 'yara_sigs' if index == 2 else 'strings')
+    print(prefetcher.summary())
+    assert prefetcher.predict('exe', 'pe_indicators') == ['strings']
+    assert prefetcher.predict('pdf', 'view') == []
+
+    # Only the most recent samples are remembered
+    assert list(prefetcher.sessions.keys()) == ['exe_2', 'exe_3', 'exe_4']
+    assert prefetcher.type_tag('exe_4') == 'exe' and prefetcher.type_tag('exe_0') is None
+
+if __name__ == '__main__':
+    test()
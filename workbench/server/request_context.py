@@ -0,0 +1,94 @@
+"""RequestContext class for WorkBench.
+
+   Workers that call back into Workbench (pcap_bro, view_pcap_deep, ...)
+   make their nested requests as separate RPCs that the server handles on
+   other greenlets, so the server can't tell them from client requests by
+   looking at the greenlet. RequestContext is zerorpc middleware (hooks on
+   the zerorpc Context of the server process): every request sent from
+   the server process, i.e. a worker callback, carries the context of the
+   request it's made from (that it's nested, the trace and span it belongs
+   to) in its header, and the server loads that context on the greenlet
+   that handles the nested request.
+
+   Clients can send any header they like, so the context carries a secret
+   shared by the processes of this server and the context of a request
+   without it is ignored (a client can't pass itself off as a worker
+   callback to get around admission control).
+"""
+
+import binascii
+import hmac
+import os
+import gevent.local
+
+HEADER = 'workbench_context'
+
+
+class RequestContext(object):
+    """zerorpc middleware that passes the request context along on worker callbacks."""
+
+    def __init__(self, trace_context=None, secret=None):
+        """Initialization for the RequestContext class.
+
+        Args:
+            trace_context: function giving the {'trace_id', 'span_id'} of the active span
+                           of the current greenlet (None when it isn't traced), see Tracer.context.
+            secret: the secret shared by the server processes (default: a random one for this process).
+        """
+        self.trace_context = trace_context or (lambda: None)
+        self.secret = secret or binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.local = gevent.local.local()
+
+    def get_task_context(self):
+        """zerorpc hook: the header for a request sent from this process (a nested request)."""
+        return {HEADER: {'nested': True, 'trace': self.trace_context(), 'secret': self.secret}}
+
+    def load_task_context(self, event_header):
+        """zerorpc hook: load the context of an incoming request (on the greenlet that handles it),
+           the context is only trusted when it carries the secret of this server."""
+        context = event_header.get(HEADER) if event_header else None
+        secret = context.get('secret') if isinstance(context, dict) else None
+        if isinstance(secret, bytes):
+            secret = secret.decode('ascii', 'replace')
+        if not isinstance(secret, str) or not hmac.compare_digest(secret, self.secret):
+            context = None
+        self.local.context = context
+
+    def is_nested(self):
+        """Is the current request a nested request (made by a worker) rather than a client request?"""
+        context = getattr(self.local, 'context', None)
+        return bool(context and context.get('nested'))
+
+    def parent_trace(self):
+        """The {'trace_id', 'span_id'} of the span that made the current (nested) request, None if it isn't traced."""
+        context = getattr(self.local, 'context', None)
+        return context.get('trace') if context else None
+
+
+def test():
+    """Test for the RequestContext class."""
+    import gevent
+    sent = RequestContext(trace_context=lambda: {'trace_id': 'abc', 'span_id': 'def'})
+    header = sent.get_task_context()
+
+    # The greenlet handling the nested request sees the context, others don't
+    received = RequestContext(secret=sent.secret)
+    results = {}
+
+    def handle(name, event_header):
+        received.load_task_context(event_header)
+        gevent.sleep(0)
+        results[name] = (received.is_nested(), received.parent_trace())
+    forged = {HEADER: {'nested': True, 'trace': None}}
+    wrong_secret = RequestContext().get_task_context()
+    gevent.joinall([gevent.spawn(handle, 'nested', header), gevent.spawn(handle, 'client', {'v': 3}),
+                    gevent.spawn(handle, 'forged', forged), gevent.spawn(handle, 'other_server', wrong_secret)])
+    assert results['nested'] == (True, {'trace_id': 'abc', 'span_id': 'def'})
+    assert results['client'] == (False, None)
+
+    # A client can't pass itself off as a worker callback (no secret, or another server's)
+    assert results['forged'] == (False, None) and results['other_server'] == (False, None)
+    assert not received.is_nested() and received.parent_trace() is None
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,187 @@
+"""RowFilter class for WorkBench.
+
+   Projection and predicate pushdown for stream_sample: clients ask for the
+   columns they need and the rows they want, the server drops everything
+   else before it goes over the wire.
+
+       stream_sample(http_log_md5, {'columns': ['ts', 'host', 'uri'],
+                                    'where': {'method': 'POST',
+                                              'status_code': [200, 302],
+                                              'ts': {'min': 1337107666, 'max': 1337107700},
+                                              'uri': {'contains': '.exe'}}})
+
+   A condition is a value (equals), a list of values (in) or a dictionary of
+   operators: 'eq', 'in', 'min'/'max' (an inclusive range, unset values never
+   match) and 'contains' (substring of a string or element of a set/vector).
+   All the conditions have to match. Rows are dictionaries, column chunks
+   (see BroLogReader.read_columns) are filtered with vectorized NumPy masks.
+"""
+
+import datetime
+import numpy as np
+
+OPERATORS = ('eq', 'in', 'min', 'max', 'contains')
+
+
+class RowFilter(object):
+    """Filters rows (or column chunks) on the where conditions and keeps the requested columns."""
+
+    def __init__(self, columns=None, where=None):
+        """Initialization for the RowFilter class.
+
+        Args:
+            columns: the list of columns to keep (None for all of them).
+            where: dictionary of column: condition (None for all the rows).
+
+        Raises:
+            RuntimeError: When a condition uses an unknown operator.
+        """
+        self.columns = list(columns) if columns else None
+        self.conditions = []
+        for name, condition in (where or {}).items():
+            if isinstance(condition, dict):
+                unknown = [key for key in condition if key not in OPERATORS]
+                if unknown:
+                    raise RuntimeError('Unknown where operator(s) %s for %s (use %s)' %
+                                       (unknown, name, ', '.join(OPERATORS)))
+            elif isinstance(condition, (list, tuple)):
+                condition = {'in': list(condition)}
+            else:
+                condition = {'eq': condition}
+            self.conditions.append((name, condition))
+
+    def __bool__(self):
+        """Does the filter do anything?"""
+        return bool(self.columns or self.conditions)
+    __nonzero__ = __bool__
+
+    def rows(self, rows):
+        """Filter and project a stream of row dictionaries.
+
+        Args:
+            rows: an iterable of row dictionaries.
+
+        Returns:
+            A generator of the matching rows (with just the requested columns).
+        """
+        for row in rows:
+            if all(self._match(row.get(name), condition) for name, condition in self.conditions):
+                yield {name: row.get(name) for name in self.columns} if self.columns else row
+
+    def filter_columns(self, columns):
+        """Filter and project a column chunk.
+
+        Args:
+            columns: a {column name: NumPy array} dictionary.
+
+        Returns:
+            The {column name: NumPy array} dictionary of the matching rows (with just the requested columns).
+        """
+        num_rows = len(next(iter(columns.values()))) if columns else 0
+        mask = np.ones(num_rows, dtype=bool)
+        for name, condition in self.conditions:
+            values = columns.get(name)
+            if values is None:
+                values = np.empty(num_rows, dtype=object)
+            mask &= self._mask(values, condition)
+        names = self.columns or list(columns.keys())
+        if mask.all():
+            return {name: self._column(columns, name, num_rows) for name in names}
+        return {name: self._column(columns, name, num_rows)[mask] for name in names}
+
+    @staticmethod
+    def _match(value, condition):
+        """Internal: Does a value match a condition?"""
+        if 'eq' in condition and value != condition['eq']:
+            return False
+        if 'in' in condition and value not in condition['in']:
+            return False
+        if 'min' in condition and (value is None or value < condition['min']):
+            return False
+        if 'max' in condition and (value is None or value > condition['max']):
+            return False
+        if 'contains' in condition:
+            if not isinstance(value, (str, list)) or condition['contains'] not in value:
+                return False
+        return True
+
+    @staticmethod
+    def _mask(values, condition):
+        """Internal: The vectorized match of a column against a condition."""
+        mask = np.ones(len(values), dtype=bool)
+        bound = lambda value: _to_datetime64(value) if values.dtype.kind == 'M' else value
+        if 'eq' in condition:
+            mask &= values == bound(condition['eq'])
+        if 'in' in condition:
+            if values.dtype == object:
+                mask &= np.array([value in condition['in'] for value in values], dtype=bool)
+            else:
+                mask &= np.isin(values, [bound(value) for value in condition['in']])
+        if values.dtype == object and ('min' in condition or 'max' in condition):
+            bounds = {key: condition[key] for key in ('min', 'max') if key in condition}
+            mask &= np.array([RowFilter._match(value, bounds) for value in values], dtype=bool)
+        else:
+            if 'min' in condition:
+                mask &= values >= bound(condition['min'])
+            if 'max' in condition:
+                mask &= values <= bound(condition['max'])
+        if 'contains' in condition:
+            mask &= np.array([isinstance(value, (str, list)) and condition['contains'] in value for value in values],
+                             dtype=bool)
+        return mask
+
+    @staticmethod
+    def _column(columns, name, num_rows):
+        """Internal: A column of the chunk (all None if the chunk doesn't have it)."""
+        if name in columns:
+            return columns[name]
+        return np.empty(num_rows, dtype=object)
+
+
+def _to_datetime64(value):
+    """Internal: Bro time bounds come in as float seconds (like the rows), or as datetimes."""
+    if isinstance(value, datetime.datetime):
+        return np.datetime64(value, 'us')
+    return np.datetime64(int(round(value * 1e6)), 'us')
+
+
+def test():
+    """Test for the RowFilter class."""
+    rows = [{'ts': 1.5, 'host': 'www.evil.com', 'status_code': 200, 'tags': ['a'], 'uri': '/x.exe'},
+            {'ts': 2.5, 'host': 'www.good.com', 'status_code': 404, 'tags': [], 'uri': '/index.html'},
+            {'ts': 3.5, 'host': None, 'status_code': None, 'tags': None, 'uri': '/y.exe'}]
+
+    # Rows: projection, equals, in, range and contains
+    assert list(RowFilter(columns=['host']).rows(rows)) == [{'host': 'www.evil.com'}, {'host': 'www.good.com'},
+                                                           {'host': None}]
+    assert [row['ts'] for row in RowFilter(where={'status_code': 200}).rows(rows)] == [1.5]
+    assert [row['ts'] for row in RowFilter(where={'status_code': [200, 404]}).rows(rows)] == [1.5, 2.5]
+    assert [row['ts'] for row in RowFilter(where={'ts': {'min': 2, 'max': 4}}).rows(rows)] == [2.5, 3.5]
+    assert [row['ts'] for row in RowFilter(where={'status_code': {'min': 0}}).rows(rows)] == [1.5, 2.5]
+    assert [row['ts'] for row in RowFilter(where={'uri': {'contains': '.exe'}}).rows(rows)] == [1.5, 3.5]
+    assert [row['ts'] for row in RowFilter(where={'tags': {'contains': 'a'}}).rows(rows)] == [1.5]
+    assert not RowFilter() and RowFilter(columns=['host'])
+    try:
+        RowFilter(where={'ts': {'after': 2}})
+        assert False, 'should have raised'
+    except RuntimeError as error:
+        print(error)
+
+    # Columns: the same conditions with NumPy masks
+    tags = np.empty(3, dtype=object)
+    tags[:] = [['a'], [], None]
+    columns = {'ts': (np.array([1.5, 2.5, 3.5]) * 1e6).astype(np.int64).astype('datetime64[us]'),
+               'host': np.array(['www.evil.com', 'www.good.com', None], dtype=object),
+               'status_code': np.array([200, 404, np.nan]), 'tags': tags,
+               'uri': np.array(['/x.exe', '/index.html', '/y.exe'], dtype=object)}
+    chunk = RowFilter(columns=['host'], where={'ts': {'min': 2, 'max': 4}}).filter_columns(columns)
+    assert list(chunk.keys()) == ['host'] and chunk['host'].tolist() == ['www.good.com', None]
+    assert RowFilter(where={'status_code': [200, 404]}).filter_columns(columns)['host'].tolist() == \
+        ['www.evil.com', 'www.good.com']
+    assert RowFilter(where={'host': 'www.evil.com'}).filter_columns(columns)['status_code'].tolist() == [200]
+    assert RowFilter(where={'uri': {'contains': '.exe'}, 'tags': {'contains': 'a'}}).filter_columns(columns)[
+        'uri'].tolist() == ['/x.exe']
+    assert len(RowFilter(where={'nope': 1}).filter_columns(columns)['host']) == 0
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,222 @@
+"""Streaming helpers for WorkBench samples.
+
+   Big logs (a day of conn.log can be several GB) are streamed out of the
+   DataStore a chunk at a time (see DataStore.open_sample), these helpers
+   turn the chunks into lines without ever holding more than a chunk (plus
+   a partial line) in memory. Gzip compressed samples are decompressed on
+   the fly, a chunk of output at a time.
+
+   JSON samples are decoded incrementally too: json_rows yields the items of
+   a JSON array (or of the JSON lines) as they're decoded, so the first row
+   goes out before the whole document is read and memory is bounded by the
+   biggest row instead of the document size.
+"""
+
+import codecs
+import json
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def decompress(chunks, chunk_size=256*1024):
+    """Decompress a stream of chunks if it's gzip compressed (passed through as is otherwise).
+
+    Args:
+        chunks: an iterable of byte chunks.
+        chunk_size: the most decompressed bytes yielded at a time.
+
+    Returns:
+        A generator of (decompressed) byte chunks.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    if first[:2] != GZIP_MAGIC:
+        if first:
+            yield first
+        for chunk in chunks:
+            yield chunk
+        return
+
+    # Gzip (possibly several concatenated members), decompressed at most chunk_size bytes at a time
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = first
+    while True:
+        while pending:
+            output = decompressor.decompress(pending, chunk_size)
+            if output:
+                yield output
+            pending = decompressor.unconsumed_tail
+            if decompressor.eof:
+                pending = decompressor.unused_data + pending
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if not pending.strip(b'\x00'):
+                    pending = b''
+        pending = next(chunks, None)
+        if pending is None:
+            break
+    output = decompressor.flush()
+    if output:
+        yield output
+
+
+def lines(chunks, encoding='utf-8'):
+    """Split a stream of byte chunks into text lines.
+
+    Args:
+        chunks: an iterable of byte chunks.
+        encoding: the text encoding (undecodable bytes are replaced).
+
+    Returns:
+        A generator of lines (with their line endings, like iterating over a file).
+    """
+    partial = b''
+    for chunk in chunks:
+        split = (partial + chunk).split(b'\n')
+        partial = split.pop()
+        for line in split:
+            yield line.decode(encoding, 'replace') + '\n'
+    if partial:
+        yield partial.decode(encoding, 'replace')
+
+
+def json_rows(chunks, path=None, encoding='utf-8'):
+    """Decode the rows of a JSON document as its chunks stream in.
+
+    Args:
+        chunks: an iterable of byte chunks.
+        path: the keys down to the array of rows when the document is an object
+              (e.g. ['hits', 'hits'] for ELS query results), None for a top level array.
+        encoding: the text encoding.
+
+    Returns:
+        A generator of the items of the array, or of each value of a JSON lines
+        (or concatenated JSON) document.
+
+    Raises:
+        ValueError: When the document isn't valid JSON (or the path isn't there).
+    """
+    text = _JSONText(chunks, encoding)
+    if path:
+        for key in path:
+            text.expect('{')
+            while True:
+                name = text.value()
+                text.expect(':')
+                if name == key:
+                    break
+                text.value()
+                if text.peek() == '}':
+                    raise ValueError('%s not found in the JSON document' % key)
+                text.expect(',')
+        for row in text.array():
+            yield row
+    elif text.peek() == '[':
+        for row in text.array():
+            yield row
+    else:
+        while text.peek():
+            yield text.value()
+
+
+class _JSONText(object):
+    """Internal: Incremental JSON decoding over a stream of byte chunks."""
+
+    def __init__(self, chunks, encoding):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self.json_decoder = json.JSONDecoder()
+        self.text = ''
+        self.pos = 0
+        self.done = False
+
+    def _more(self):
+        """Read the next chunk (dropping the text we're done with), False at the end of the stream."""
+        if self.done:
+            return False
+        chunk = next(self.chunks, None)
+        self.text = self.text[self.pos:] + self.decoder.decode(chunk or b'', chunk is None)
+        self.pos = 0
+        self.done = chunk is None
+        return True
+
+    def peek(self):
+        """The next non-whitespace character ('' at the end of the stream)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.text) or not self._more():
+                return self.text[self.pos:self.pos+1]
+
+    def expect(self, char):
+        """Skip past the next non-whitespace character (which has to be char)."""
+        if self.peek() != char:
+            raise ValueError('Expected %r in the JSON document, got %r' % (char, self.peek()))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value (reading more chunks until it's complete)."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.text, self.pos)
+                # A number (or literal) at the end of the text might continue in the next chunk
+                if end < len(self.text) or not self._more():
+                    self.pos = end
+                    return value
+            except ValueError:
+                if not self._more():
+                    raise
+
+    def array(self):
+        """Decode the items of the array that starts at the next character."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+
+def test():
+    """Test the streaming helpers."""
+    import gzip
+    text = ''.join('%d\tline %d\n' % (index, index) for index in range(10000))
+    raw = text.encode('utf-8')
+    as_chunks = lambda data, size: [data[start:start+size] for start in range(0, len(data), size)]
+
+    # Plain and gzipped (chunk boundaries anywhere, output at most chunk_size at a time)
+    assert ''.join(lines(decompress(as_chunks(raw, 1000)))) == text
+    compressed = gzip.compress(raw)
+    output = list(decompress(as_chunks(compressed, 333), chunk_size=4096))
+    assert b''.join(output) == raw and max(len(chunk) for chunk in output) <= 4096
+    assert list(lines(decompress(as_chunks(compressed, 100))))[:2] == ['0\tline 0\n', '1\tline 1\n']
+
+    # Concatenated gzip members, no trailing newline, empty input
+    assert b''.join(decompress([gzip.compress(b'a\nb'), gzip.compress(b'\nc')])) == b'a\nb\nc'
+    assert list(lines([b'a\nb', b'\nc'])) == ['a\n', 'b\n', 'c']
+    assert list(decompress([])) == [] and list(lines([])) == []
+
+    # JSON: arrays, JSON lines and the rows of an ELS result (split anywhere, even in a number or a multibyte char)
+    rows = [{'id': index, 'name': u'r\u00e9sum\u00e9 %d' % index, 'tags': ['a', None, True]} for index in range(500)]
+    document = json.dumps(rows).encode('utf-8')
+    for size in [1, 7, 4096]:
+        assert list(json_rows(as_chunks(document, size))) == rows
+    json_lines = '\n'.join(json.dumps(row) for row in rows).encode('utf-8')
+    assert list(json_rows(as_chunks(json_lines, 13))) == rows
+    assert list(json_rows([b'1', b'2 3'])) == [12, 3] and list(json_rows([b' [ ] '])) == []
+    els = json.dumps({'took': 3, 'timed_out': False, 'hits': {'total': 500, 'hits': rows}}).encode('utf-8')
+    assert list(json_rows(as_chunks(els, 11), path=['hits', 'hits'])) == rows
+    for bad, path in [(b'[1, 2', None), (b'{"took": 3}', ['hits'])]:
+        try:
+            list(json_rows([bad], path))
+            assert False, 'should have raised'
+        except ValueError as error:
+            print(error)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,82 @@
+"""Resumable cursors for the WorkBench streaming RPCs.
+
+   Ask stream_sample or set_work_request for cursors and every item comes
+   back wrapped with a cursor token:
+
+       {'cursor': 'eyJwIjogMTAwMCwgLi4u', 'data': <row, batch of rows or worker output>}
+
+   If the stream is interrupted (heartbeat loss, client restart) make the
+   same request again with {'resume_from': <the last token received>} and
+   the stream picks up right after that item (nothing is sent twice). A
+   token is the position in the stream plus a digest of the request, so it
+   can't be used to resume a different request.
+"""
+
+import base64
+import hashlib
+import json
+
+
+def make_token(stream_name, request, position):
+    """Make the cursor token for a position in a stream.
+
+    Args:
+        stream_name: the name of the streaming RPC (e.g. 'stream_sample').
+        request: the arguments that define the stream (anything JSON serializable).
+        position: the number of items (rows, samples) streamed so far.
+
+    Returns:
+        The token (an opaque string).
+    """
+    token = {'stream': stream_name, 'request': _digest(request), 'position': position}
+    return base64.urlsafe_b64encode(json.dumps(token, sort_keys=True).encode('utf-8')).decode('ascii')
+
+
+def token_position(token, stream_name, request):
+    """The position to resume a stream from.
+
+    Args:
+        token: a token made by make_token.
+        stream_name: the name of the streaming RPC.
+        request: the arguments that define the stream.
+
+    Returns:
+        The number of items streamed before the token was made.
+
+    Raises:
+        RuntimeError: When the token is invalid or was made for another stream or request.
+    """
+    try:
+        info = json.loads(base64.urlsafe_b64decode(str(token).encode('ascii')).decode('utf-8'))
+        stream, digest, position = info['stream'], info['request'], int(info['position'])
+    except (ValueError, TypeError, KeyError):
+        raise RuntimeError('Invalid resume_from cursor: %s' % token)
+    if stream != stream_name or digest != _digest(request):
+        raise RuntimeError('The resume_from cursor is for a different %s request' % stream_name)
+    return position
+
+
+def _digest(request):
+    """Internal: A digest of the request arguments."""
+    return hashlib.md5(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def test():
+    """Test for the stream cursors."""
+    request = ['d41d8cd98f00b204e9800998ecf8427e', {'max_rows': 100, 'where': {'ts': {'min': 1.5}}}]
+    token = make_token('stream_sample', request, 42)
+    assert token_position(token, 'stream_sample', request) == 42
+
+    # Same request with the keys in a different order is fine, anything else isn't
+    assert token_position(token, 'stream_sample', [request[0], {'where': {'ts': {'min': 1.5}}, 'max_rows': 100}]) == 42
+    for bad_token, stream_name, bad_request in [(token, 'stream_sample', [request[0], {'max_rows': 10}]),
+                                                (token, 'set_work_request', request),
+                                                ('garbage!', 'stream_sample', request), (None, 'stream_sample', request)]:
+        try:
+            token_position(bad_token, stream_name, bad_request)
+            assert False, 'should have raised'
+        except RuntimeError as error:
+            print(error)
+
+if __name__ == '__main__':
+    test()
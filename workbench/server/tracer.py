@@ -0,0 +1,241 @@
+"""Tracer class for WorkBench.
+
+   A trace is a tree of spans (name, start, duration and tags like cache
+   hit/miss or bytes moved) for a single request. Spans are tracked per
+   greenlet so concurrent requests don't step on each other. Finished
+   traces are kept in a ring buffer so they can be queried afterwards.
+
+   Nested requests (a worker calling back into Workbench) are handled on
+   another greenlet, they come in with the trace and span id of the span
+   that made them (see request_context.RequestContext) and their spans are
+   attached under that span, so the trace shows the whole request tree.
+"""
+
+import time
+import random
+import collections
+import contextlib
+from gevent import local
+
+
+class Span(object):
+    """A single timed operation within a trace."""
+
+    def __init__(self, name, tags, trace_id=None):
+        """Initialization for the Span.
+
+        Args:
+            name: the name of the span (e.g. 'worker:meta').
+            tags: dictionary of tags for the span.
+            trace_id: the id of the trace the span belongs to (None for the root span of a new trace).
+        """
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.trace_id = trace_id or self.span_id
+        self.name = name
+        self.tags = tags
+        self.start = time.time()
+        self.duration = None
+        self.children = []
+
+    def finish(self):
+        """Mark the span as finished."""
+        self.duration = time.time() - self.start
+
+    def to_dict(self):
+        """The span (and all of its children) as a dictionary."""
+        span = {'name': self.name, 'span_id': self.span_id, 'start': self.start, 'duration': self.duration}
+        span.update(self.tags)
+        span['children'] = [child.to_dict() for child in self.children]
+        return span
+
+
+class Tracer(object):
+    """Tracer for Workbench."""
+
+    def __init__(self, buffer_size=100, sample_rate=0.0):
+        """Initialization for the Tracer.
+
+        Args:
+            buffer_size: number of finished traces kept in the ring buffer.
+            sample_rate: fraction of requests that get traced even when not asked to (0.0-1.0).
+        """
+        self.sample_rate = sample_rate
+        self.traces = collections.deque(maxlen=buffer_size)
+        self.local = local.local()
+
+        # The unfinished spans (of all greenlets) by id, nested requests attach their spans to them
+        self.active = {}
+
+    def _stack(self):
+        """Internal: The span stack for the current greenlet."""
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _push(self, span):
+        """Internal: Make the span the current span of this greenlet."""
+        self._stack().append(span)
+        self.active[span.span_id] = span
+
+    def _pop(self):
+        """Internal: Finish the current span of this greenlet."""
+        span = self._stack().pop()
+        span.finish()
+        self.active.pop(span.span_id, None)
+        return span
+
+    def is_tracing(self):
+        """Is there an active trace in the current greenlet?"""
+        return bool(self._stack())
+
+    def context(self):
+        """The {'trace_id', 'span_id'} of the current span (None if this greenlet isn't tracing)."""
+        stack = self._stack()
+        if not stack:
+            return None
+        return {'trace_id': stack[-1].trace_id, 'span_id': stack[-1].span_id}
+
+    @contextlib.contextmanager
+    def trace(self, name, force=False, parent=None, **tags):
+        """Start a trace (or a child span if a trace is already active).
+
+        Args:
+            name: the name of the root span.
+            force: always trace (otherwise the request is sampled with sample_rate).
+            parent: the {'trace_id', 'span_id'} of the span that made this (nested) request, if it's traced.
+            tags: tags for the root span.
+
+        Yields:
+            The root Span or None if this request isn't being traced.
+        """
+
+        # Already tracing so this is just a child span
+        if self._stack():
+            with self.span(name, **tags) as span:
+                yield span
+            return
+
+        # A nested request from a traced span in this process is a child span of it (on this greenlet)
+        parent_span = self.active.get(parent['span_id']) if parent else None
+        if parent_span:
+            span = Span(name, tags, parent_span.trace_id)
+            parent_span.children.append(span)
+            self._push(span)
+            try:
+                yield span
+            finally:
+                self._pop()
+            return
+
+        # Should we trace this request? (a nested request from another process is traced like its parent)
+        if parent:
+            tags = dict(tags, parent_trace_id=parent['trace_id'], parent_span_id=parent['span_id'])
+        elif not force and (not self.sample_rate or random.random() >= self.sample_rate):
+            yield None
+            return
+
+        root = Span(name, tags)
+        self._push(root)
+        try:
+            yield root
+        finally:
+            self._pop()
+            self.traces.append(root.to_dict())
+
+    @contextlib.contextmanager
+    def span(self, name, **tags):
+        """Time a child span of the active trace (does nothing if there isn't one).
+
+        Args:
+            name: the name of the span.
+            tags: tags for the span.
+
+        Yields:
+            The Span or None if there isn't an active trace.
+        """
+        stack = self._stack()
+        if not stack:
+            yield None
+            return
+
+        span = Span(name, tags, stack[-1].trace_id)
+        stack[-1].children.append(span)
+        self._push(span)
+        try:
+            yield span
+        finally:
+            self._pop()
+
+    def tag(self, **tags):
+        """Add tags to the current span (does nothing if there isn't an active trace)."""
+        stack = self._stack()
+        if stack:
+            stack[-1].tags.update(tags)
+
+    def get_traces(self, limit=None):
+        """Get the most recent traces from the ring buffer.
+
+        Args:
+            limit: maximum number of traces to return (None for all).
+
+        Returns:
+            A list of trace dictionaries, newest first.
+        """
+        traces = list(reversed(self.traces))
+        return traces[:limit] if limit else traces
+
+
+def test():
+    """Test for the Tracer class."""
+    tracer = Tracer(buffer_size=2)
+
+    # Untraced requests don't create anything
+    with tracer.trace('work_request') as root:
+        assert root is None
+        with tracer.span('worker:meta') as span:
+            assert span is None
+    assert not tracer.get_traces()
+
+    # Traced request with nested spans
+    with tracer.trace('work_request', force=True, worker='view') as root:
+        with tracer.span('worker:meta', cache='miss'):
+            with tracer.span('get_sample'):
+                tracer.tag(bytes=1024)
+        with tracer.trace('work_request', worker='meta'):
+            pass
+    trace = root.to_dict()
+    print(trace)
+    assert trace['worker'] == 'view'
+    assert trace['children'][0]['cache'] == 'miss'
+    assert trace['children'][0]['children'][0]['bytes'] == 1024
+    assert len(trace['children']) == 2
+    assert not tracer.is_tracing()
+
+    # Nested requests (on another greenlet) become child spans of the span that made them
+    import gevent
+    def nested_request(parent):
+        with tracer.trace('work_request', parent=parent, worker='pcap_bro'):
+            with tracer.span('execute:pcap_bro'):
+                pass
+    with tracer.trace('work_request', force=True, worker='view_pcap_deep') as root:
+        with tracer.span('execute:view_pcap_deep'):
+            assert tracer.context()['trace_id'] == root.span_id
+            gevent.spawn(nested_request, tracer.context()).join()
+    trace = tracer.get_traces(limit=1)[0]
+    nested = trace['children'][0]['children'][0]
+    assert nested['worker'] == 'pcap_bro' and nested['children'][0]['name'] == 'execute:pcap_bro'
+    assert not tracer.active
+
+    # A nested request whose parent span is in another process starts a trace linked to it
+    gevent.spawn(nested_request, {'trace_id': 'aaa', 'span_id': 'bbb'}).join()
+    assert tracer.get_traces(limit=1)[0]['parent_span_id'] == 'bbb'
+
+    # Ring buffer
+    for _ in range(3):
+        with tracer.trace('work_request', force=True):
+            pass
+    assert len(tracer.get_traces()) == 2
+    assert len(tracer.get_traces(limit=1)) == 1
+
+if __name__ == '__main__':
+    test()
@@ -6,43 +6,79 @@
 #       for MongoDB, if you know a better way please do PR :)
 from gevent import monkey; monkey.patch_all(thread=False) # Monkey!
 from gevent import signal as gevent_signal
+from gevent import pywsgi
+import gevent
+import gevent.event
 import signal
 import sys, os
+import multiprocessing
+import tempfile
+import shutil
 import zerorpc
 import zmq
 import logging
 logging.basicConfig()
+import binascii
 import json
 import hashlib
 import inspect
+import itertools
+import collections
 import funcsigs
 import configparser
 import magic
 import datetime
+import time
 import lz4
 from IPython.utils.coloransi import TermColors as color
 #pylint: disable=no-member
-try:
-    from io import StringIO
-except ImportError:
-    from io import StringIO
 
 # Workbench server imports
 try:
+    from . import admission
+    from . import circuit_breaker
+    from . import column_cache
+    from . import cost_model
+    from . import broker
     from . import data_store
+    from . import deadline
     from . import els_indexer
+    from . import job_queue
+    from . import line_index
+    from . import metrics
+    from . import tracer
     from . import neo_db
     from . import plugin_manager
+    from . import prefetch
+    from . import request_context
+    from . import row_filter
+    from . import sample_stream
+    from . import stream_cursor
     from .bro import bro_log_reader
     from . import version
 
 # Okay this happens when you're running workbench in a debugger so having
 # this is super handy and we'll keep it even though it hurts coverage score.
 except ValueError:
+    from . import admission
+    from . import circuit_breaker
+    from . import column_cache
+    from . import cost_model
+    from . import broker
     from . import data_store
+    from . import deadline
     from . import els_indexer
+    from . import job_queue
+    from . import line_index
+    from . import metrics
+    from . import tracer
     from . import neo_db
     from . import plugin_manager
+    from . import prefetch
+    from . import request_context
+    from . import row_filter
+    from . import sample_stream
+    from . import stream_cursor
     from .bro import bro_log_reader
     from . import version
 
@@ -56,13 +92,39 @@ class WorkBench(object):
         def message():
             return "Obi-Wan waves his hand... this isn't the data you're looking for..."
 
-    def __init__(self, store_args=None, els_hosts=None, neo_uri=None):
+    def __init__(self, store_args=None, els_hosts=None, neo_uri=None, refresh_interval=0, metrics_port=0,
+                 trace_sample_rate=0.0, trace_buffer_size=100, admission_args=None, coordination=None,
+                 default_deadline=0, failure_retry_after=60, failure_max_retry_after=86400,
+                 ingest_pipelines=None, job_args=None, breaker_args=None, prefetch_args=None, prefetch_max_queue=0,
+                 column_cache_args=None, request_secret=None):
         """Initialize the Framework.
 
         Args:
-            store_args: Dictionary with keys uri,database,samples_cap, worker_cap.
+            store_args: Dictionary with keys uri,database,samples_cap, worker_cap, dataset_cap.
             els_hosts: The address where Elastic Search Indexer is running.
             neo_uri: The address where Neo4j is running.
+            refresh_interval: Seconds between background passes that recompute stale results (0 to disable).
+            metrics_port: Port for the Prometheus style metrics endpoint (0 to disable).
+            trace_sample_rate: Fraction of work requests traced into the trace buffer (0.0-1.0).
+            trace_buffer_size: Number of recent traces kept (see get_traces).
+            admission_args: Dictionary with keys max_in_flight, max_in_flight_bytes, max_queue,
+                            queue_timeout, worker_concurrency (see admission.AdmissionControl).
+            coordination: (publish, subscribe) endpoints of the Broker when running multi-process.
+            default_deadline: Seconds a worker gets to execute unless it declares a deadline (0 for no deadline).
+            failure_retry_after: Seconds before a worker that failed is retried on the same sample
+                                 (doubles with each failure in a row).
+            failure_max_retry_after: The longest a worker that keeps failing on a sample waits for a retry.
+            ingest_pipelines: Dictionary of type_tag: list of workers to run in the background on new samples.
+            job_args: Dictionary with keys slots, rate_limit (see job_queue.JobQueue).
+            breaker_args: Dictionary with keys failure_rate, min_executions, window, reset_timeout
+                          (see circuit_breaker.CircuitBreaker).
+            prefetch_args: Dictionary with keys min_probability, min_observations, session_timeout,
+                           max_sessions (see prefetch.Prefetcher).
+            prefetch_max_queue: Only prefetch when the job queue is shorter than this (0 to disable prefetch).
+            column_cache_args: Dictionary with keys cache_dir, max_bytes (see column_cache.ColumnCache),
+                               None to parse Bro logs on every stream.
+            request_secret: Secret shared by the processes of a multi-process server so their worker
+                            callbacks are recognized (see request_context.RequestContext).
         """
 
         # Needs to be replaced by logger
@@ -72,8 +134,39 @@ class WorkBench(object):
         self.version = version.__version__
         print('<<< Workbench Server Version %s >>>' % self.version)
 
+        # Metrics (see get_stats)
+        self.metrics = metrics.Metrics()
+        self.in_flight = 0
+
+        # Tracer (see work_request(..., trace=True) and get_traces)
+        self.tracer = tracer.Tracer(buffer_size=trace_buffer_size, sample_rate=trace_sample_rate)
+
+        # Worker callbacks (requests sent from this process) tell the server they're nested requests
+        # and which span made them (see request_context.RequestContext)
+        self.request_context = request_context.RequestContext(self.tracer.context, request_secret)
+        zerorpc.Context.get_instance().register_middleware(self.request_context)
+
+        # Worker deadlines (workers may declare their own, see deadline.py)
+        self.default_deadline = default_deadline
+
+        # Worker failures are cached (with backoff) and failing workers are short-circuited
+        self.failure_retry_after = failure_retry_after
+        self.failure_max_retry_after = failure_max_retry_after
+        self.circuit_breaker = circuit_breaker.CircuitBreaker(**(breaker_args or {}))
+        self.metrics.register_gauge('circuits_open', lambda: len(self.circuit_breaker.open_circuits()))
+
+        # Admission control (limits on in-flight requests, sample bytes and worker concurrency)
+        self.admission = admission.AdmissionControl(**(admission_args or {}))
+        self.metrics.register_gauge('admission_in_flight', lambda: self.admission.in_flight)
+        self.metrics.register_gauge('admission_in_flight_bytes', lambda: self.admission.in_flight_bytes)
+        self.metrics.register_gauge('admission_queue_depth', self.admission.queue_depth)
+        self.metrics.register_gauge('admission_rejected', lambda: self.admission.rejected)
+
         # Open DataStore
         self.data_store = data_store.DataStore(**store_args)
+        self.metrics.register_gauge('samples_read', lambda: self.data_store.samples_read)
+        self.metrics.register_gauge('gridfs_bytes_read', lambda: self.data_store.gridfs_bytes_read)
+        self.metrics.register_gauge('work_requests_in_flight', lambda: self.in_flight)
 
         # ELS Indexer
         try:
@@ -91,12 +184,52 @@ class WorkBench(object):
 
         # Create Plugin Manager
         self.plugin_meta = {}
+        self.chain_hashes = {}
+        self.help_cache = {}
         plugin_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),'../workers')
         self.plugin_manager = plugin_manager.PluginManager(self._new_plugin, plugin_dir=plugin_dir)
 
         # Store information about commands and workbench
         self._store_information()
 
+        # Worker cost profiles (learned from the executions, used to schedule the job queue)
+        self.cost_model = cost_model.CostModel()
+        for worker_name, profile in self.data_store.get_cost_profiles().items():
+            self.cost_model.load(worker_name, profile)
+        self.cpu_clock = cost_model.GreenletClock()
+        self.costs_changed = set()
+        self.costs_stored = time.time()
+
+        # Job queue (ingest pipelines that warm the cache for new samples and queued work requests)
+        self.ingest_pipelines = ingest_pipelines or {}
+        self.resolving = {}
+        self.indexing = {}
+        self.job_queue = job_queue.JobQueue(self._background_work, self._estimate_job, **(job_args or {}))
+        self.metrics.register_gauge('job_queue_depth', self.job_queue.depth)
+        self.metrics.register_gauge('job_queue_running', lambda: len(self.job_queue.running))
+
+        # Parsed Bro log columns are cached on local disk (keyed by the log md5)
+        self.column_cache = column_cache.ColumnCache(**column_cache_args) if column_cache_args is not None else None
+        if self.column_cache:
+            self.metrics.register_gauge('column_cache_filling', lambda: len(self.column_cache.filling))
+
+        # Speculative prefetch of the workers likely to be requested next
+        self.prefetcher = prefetch.Prefetcher(**(prefetch_args or {}))
+        self.prefetch_max_queue = prefetch_max_queue
+
+        # Multi-process: hear about reloads in the other Workbench processes
+        self.coordinator = broker.Coordinator(coordination, self._coordinator_message) if coordination else None
+
+        # Optionally recompute stale results in the background
+        self.refresh_interval = refresh_interval
+        if self.refresh_interval:
+            gevent.spawn(self._refresh_stale_results)
+
+        # Optionally serve the metrics in Prometheus text format
+        if metrics_port:
+            pywsgi.WSGIServer(('0.0.0.0', metrics_port), self.metrics.wsgi_app, log=None).start()
+            print('\t- Metrics endpoint: http://0.0.0.0:%d/metrics' % metrics_port)
+
     def version(self):
         """Return the version of the Workbench server"""
         return self.version
@@ -130,6 +263,10 @@ class WorkBench(object):
         if type_tag != 'lz4':
             self.add_tags(md5, type_tag)
 
+        # Kick off the ingest pipeline for this type_tag (in the background)
+        for worker_name in self.ingest_pipelines.get(type_tag, []):
+            self.job_queue.put(worker_name, md5, job_queue.LOW)
+
         return md5
 
     def get_sample(self, md5):
@@ -143,7 +280,10 @@ class WorkBench(object):
                 Workbench.DataNotFound if the sample is not found.
         """
         # First we try a sample, if we can't find one we try getting a sample_set.
-        sample = self.data_store.get_sample(md5)
+        with self.tracer.span('data_store.get_sample', md5=md5):
+            sample = self.data_store.get_sample(md5)
+            if sample:
+                self.tracer.tag(bytes=len(sample['raw_bytes']))
         if not sample:
             return {'sample_set': {'md5_list': self.get_sample_set(md5)}}
         return {'sample': sample}
@@ -201,8 +341,11 @@ class WorkBench(object):
         return self.store_sample(total_bytes, filename, type_tag)
 
     def remove_sample(self, md5):
-        """Remove the sample from the data store"""
+        """Remove the sample (or dataset) from the data store"""
         self.data_store.remove_sample(md5)
+        self.data_store.remove_dataset(md5)
+        if self.column_cache:
+            self.column_cache.remove(md5)
 
     @zerorpc.stream
     def stream_sample(self, md5, kwargs=None):
@@ -211,41 +354,302 @@ class WorkBench(object):
                 md5: the md5 of the sample
                 kwargs: a way of specifying subsets of samples (None for all)
                     max_rows: the maximum number of rows to return
+                    offset: skip this many rows first, negative for the tail (e.g. -20 for the last 20 rows).
+                            With max_rows this pages through a sample, log samples use a line index so
+                            a page anywhere in the log is a single ranged read. Dataset rows are numbered from
+                            the start of the dataset (the rows a rolling dataset has dropped are skipped)
+                    columns: the list of columns (fields) to return
+                    where: dictionary of column: condition, only the rows matching all the conditions are
+                           returned. A condition is a value (equals), a list (in) or a dictionary with any of
+                           'eq', 'in', 'min', 'max' (inclusive range) or 'contains' (see row_filter.RowFilter)
+                           Example: {'method': 'GET', 'ts': {'min': 1337107666.0}, 'uri': {'contains': '.exe'}}
+                    batch_size: yield lists of up to batch_size rows instead of a row at a time (a lot
+                                less per message overhead on big logs, see client_helper.flatten_batches)
+                    cursor: wrap each row (or batch) as {'cursor': token, 'data': row} (see stream_cursor)
+                    resume_from: a cursor token from an interrupted stream of the same request, the stream
+                                 continues right after it (implies cursor)
             Returns:
-                A generator that yields rows of the file/log
+                A generator that yields rows of the file/log (or lists of rows with batch_size)
         """
+        if kwargs and (kwargs.get('cursor') or kwargs.get('resume_from')):
+            return self._admitted_stream(self._sample_bytes(md5), self._resumable_stream_sample, md5, kwargs)
+        return self._admitted_stream(self._sample_bytes(md5), self._stream_sample, md5, kwargs)
+
+    def _resumable_stream_sample(self, md5, kwargs):
+        """ Internal: stream_sample with cursor tokens (picking up after the resume_from token). """
+        request = {key: value for key, value in kwargs.items() if key not in ('cursor', 'resume_from')}
+        position = 0
+        if kwargs.get('resume_from'):
+            position = stream_cursor.token_position(kwargs['resume_from'], 'stream_sample', [md5, request])
+
+        # Skip the rows already sent (with the line index and the column cache this doesn't reread them)
+        resumed = dict(request, offset=request.get('offset', 0) + position)
+        if request.get('max_rows') is not None:
+            resumed['max_rows'] = request['max_rows'] - position
+        if resumed.get('max_rows') == 0 or request.get('offset', 0) < 0 <= resumed['offset']:
+            return
+        for item in self._stream_sample(md5, resumed):
+            position += len(item) if request.get('batch_size') else 1
+            yield {'cursor': stream_cursor.make_token('stream_sample', [md5, request], position), 'data': item}
 
-        # Get the max_rows if specified
-        max_rows = kwargs.get('max_rows', None) if kwargs else None
+    def _stream_sample(self, md5, kwargs=None):
+        """ Internal: The generator behind stream_sample. """
 
-        # Grab the sample and it's raw bytes
-        sample = self.get_sample(md5)['sample']
-        raw_bytes = sample['raw_bytes']
+        # Get the max_rows, columns and where conditions if specified
+        kwargs = kwargs or {}
+        max_rows = kwargs.get('max_rows', None)
+        offset = kwargs.get('offset', 0)
+        rows_filter = row_filter.RowFilter(kwargs.get('columns'), kwargs.get('where'))
 
         # Figure out the type of file to be streamed
-        type_tag = sample['type_tag']
+        type_tag = self.data_store.sample_type_tag(md5)
+        if type_tag is None:
+            raise WorkBench.DataNotFound(md5 + ': Data/Sample not found...')
+
+        # Bro logs come from the column cache a chunk at a time (once a log is cached it isn't pulled
+        # or parsed again) and are filtered on the columns before they're turned into rows
+        if type_tag == 'bro' and self.column_cache:
+            chunks = self._bro_column_chunks(md5)
+            if rows_filter:
+                chunks = ((rows_filter.filter_columns(columns), field_types) for columns, field_types in chunks)
+            if offset > 0:
+                chunks = self._column_chunks_from(chunks, offset)
+            rows = itertools.chain.from_iterable(bro_log_reader.rows_from_columns(columns, field_types)
+                                                 for columns, field_types in chunks)
+            if offset < 0:
+                rows = iter(collections.deque(rows, maxlen=-offset))
+            return self._batch_rows(itertools.islice(rows, max_rows), kwargs.get('batch_size'))
+
+        # Bro logs and JSON are parsed as they stream out of the DataStore
         if type_tag == 'bro':
             bro_log = bro_log_reader.BroLogReader(convert_datetimes=False)
-            mem_file = StringIO(raw_bytes)
-            generator = bro_log.read_log(mem_file)
-            return generator
+            generator = bro_log.read_log(self._sample_lines(md5))
         elif type_tag == 'els_query':
-            els_log = json.loads(raw_bytes)
-            # Try to determine a couple of different types of ELS query results
-            if 'fields' in els_log['hits']['hits'][0]:
-                generator = (row['fields'] for row in els_log['hits']['hits'][:max_rows])
-            else:
-                generator = (row['_source'] for row in els_log['hits']['hits'][:max_rows])
-            return generator
-        elif type_tag == 'log':
-            generator = ({'row':row} for row in raw_bytes.split('\n')[:max_rows])
-            return generator
+            # ELS query results have their rows in either 'fields' or '_source'
+            hits = sample_stream.json_rows(self._sample_chunks(md5), path=['hits', 'hits'])
+            generator = (row['fields'] if 'fields' in row else row['_source'] for row in hits)
         elif type_tag == 'json':
-            generator = (row for row in json.loads(raw_bytes)[:max_rows])
-            return generator
+            generator = sample_stream.json_rows(self._sample_chunks(md5))
+        elif type_tag == 'dataset':
+            # Datasets (Bro logs as they're written, see append_log_lines) are read a batch at a time,
+            # without a filter a page of rows only reads the batches it's in
+            if not rows_filter:
+                rows = itertools.islice(self._dataset_rows(md5, offset), max_rows)
+                return self._batch_rows(rows, kwargs.get('batch_size'))
+            generator = self._dataset_rows(md5)
+        elif type_tag == 'log':
+            # Without a filter a page of rows is read straight out of the sample (using the line index)
+            index = None if rows_filter else self._line_index(md5)
+            if index:
+                start, end, _ = index.byte_range(offset, max_rows)
+                lines = sample_stream.lines(self.data_store.open_sample(md5, start=start, end=end))
+                return self._batch_rows(({'row': line.rstrip('\n')} for line in lines), kwargs.get('batch_size'))
+            generator = ({'row': line.rstrip('\n')} for line in self._sample_lines(md5))
         else:
             raise RuntimeError('Cannot stream file %s with type_tag:%s' % (md5, type_tag))
 
+        # Filter the rows (as they're parsed), skip to the offset (or keep the tail) and stop at max_rows
+        if rows_filter:
+            generator = rows_filter.rows(generator)
+        if offset < 0:
+            generator = iter(collections.deque(generator, maxlen=-offset))
+        elif offset:
+            generator = itertools.islice(generator, offset, None)
+        return self._batch_rows(itertools.islice(generator, max_rows), kwargs.get('batch_size'))
+
+    def _batch_rows(self, rows, batch_size=None):
+        """ Internal: Group a row generator into lists of batch_size rows (rows as they are without a batch_size). """
+        if not batch_size:
+            return rows
+        return iter(lambda: list(itertools.islice(rows, batch_size)), [])
+
+    def count_rows(self, md5):
+        """ The number of rows in a sample (what stream_sample would give back with no kwargs).
+            Args:
+                md5: the md5 of the sample
+            Returns:
+                The number of rows (log samples just look it up in their line index)
+        """
+        type_tag = self.data_store.sample_type_tag(md5)
+        if type_tag is None:
+            raise WorkBench.DataNotFound(md5 + ': Data/Sample not found...')
+        if type_tag == 'log':
+            num_rows = self.data_store.sample_num_rows(md5)
+            if num_rows is not None:
+                return num_rows
+            index = self._line_index(md5)
+            if index:
+                return index.num_rows()
+        if type_tag == 'dataset':
+            dataset = self.data_store.get_dataset_info(md5)
+            return dataset['num_rows'] - dataset['first_row']
+        if type_tag == 'bro' and self.column_cache:
+            cached = self.column_cache.get(md5)
+            self.metrics.cache_hit('columns', cached is not None)
+            if cached:
+                cached.close()
+                return cached.num_rows
+            return sum(_num_rows(columns) for columns, _ in self._bro_column_chunks(md5))
+        return sum(1 for _ in self._stream_sample(md5))
+
+    def append_log_lines(self, name, lines, source=None):
+        """ Append the new lines of a Bro log that's still being written to a rolling dataset
+            (see utils/tail_file.py). The lines are parsed into rows right away, the rows are
+            available to stream_sample (with the md5 returned) as soon as this returns.
+            Args:
+                name: the name of the dataset, e.g. 'conn' or 'sensor1.conn'
+                lines: the new (complete) lines of the log, a new log file starts with its header lines
+                source: where the lines were read up to (e.g. {'path': ..., 'inode': ..., 'offset': ...}),
+                        saved with the rows so a restarted tailer picks up after them (see get_dataset_info)
+            Returns:
+                The md5 of the dataset
+        """
+        header = list(itertools.takewhile(lambda line: line.startswith('#') and not line.startswith('#close'), lines))
+        lines = lines[len(header):]
+        if not any(line.startswith('#types') for line in header):
+            dataset = self.data_store.get_dataset_info(self.data_store.dataset_md5(name))
+            if not dataset:
+                raise RuntimeError('%s: The first lines appended to a dataset need the Bro log header' % name)
+            header = dataset['header']
+        bro_log = bro_log_reader.BroLogReader(convert_datetimes=False)
+        rows = list(bro_log.read_tail(header, lines))
+        fields = list(rows[0].keys()) if rows else [field for field in bro_log.field_types if field != 'resp_body_data']
+        rows = [[row[field] for field in fields] for row in rows]
+        self.metrics.incr('dataset_rows_appended', amount=len(rows))
+        return self.data_store.append_dataset_rows(name, header, fields, rows, source)
+
+    def get_dataset_info(self, name):
+        """ Get the info of a dataset (see append_log_lines).
+            Args:
+                name: the name of the dataset
+            Returns:
+                The dataset info: md5 (for stream_sample), num_rows (since the dataset was created,
+                the rolling dataset keeps rows first_row up to num_rows), fields and source, None if
+                there's no such dataset
+        """
+        dataset = self.data_store.get_dataset_info(self.data_store.dataset_md5(name))
+        if not dataset:
+            return None
+        del dataset['header']
+        return self.data_store.clean_for_serialization(dataset)
+
+    @zerorpc.stream
+    def stream_columns(self, md5, kwargs=None):
+        """ Stream a Bro log as chunks of typed columns (a lot less overhead than a row at a time).
+            Args:
+                md5: the md5 of the Bro log
+                kwargs: a way of specifying options (None for the defaults)
+                    chunk_size: the number of rows in each chunk (default 100000)
+            Returns:
+                A generator that yields column chunks: {'fields': [field names], 'types': {field: Bro type},
+                'columns': {field: {'dtype': NumPy dtype, 'data': raw bytes (a list for object columns)}}}
+        """
+        return self._admitted_stream(self._sample_bytes(md5), self._stream_columns, md5, kwargs)
+
+    def _stream_columns(self, md5, kwargs=None):
+        """ Internal: The generator behind stream_columns. """
+        chunk_size = kwargs.get('chunk_size', 100000) if kwargs else 100000
+        type_tag = self.data_store.sample_type_tag(md5)
+        if type_tag is None:
+            raise WorkBench.DataNotFound(md5 + ': Data/Sample not found...')
+        if type_tag != 'bro':
+            raise RuntimeError('Cannot stream columns of %s with type_tag:%s' % (md5, type_tag))
+
+        # From the column cache (regrouped into chunks of chunk_size) or parsed a chunk at a time
+        if self.column_cache:
+            for columns, field_types in self._rechunk_columns(self._bro_column_chunks(md5), chunk_size):
+                yield bro_log_reader.pack_columns(columns, field_types)
+            return
+        bro_log = bro_log_reader.BroLogReader()
+        for columns in bro_log.read_columns(self._sample_lines(md5), chunk_size):
+            yield bro_log_reader.pack_columns(columns, bro_log.field_types)
+
+    def _bro_column_chunks(self, md5):
+        """ Internal: The parsed (columns, field_types) chunks of a Bro log (from the column cache, on a miss
+            the log is parsed and put in the cache a chunk at a time as the chunks stream out). """
+        cached = self.column_cache.get(md5)
+        self.metrics.cache_hit('columns', cached is not None)
+        if cached:
+            return cached.chunks()
+        bro_log = bro_log_reader.BroLogReader()
+        chunks = ((columns, bro_log.field_types) for columns in bro_log.read_columns(self._sample_lines(md5)))
+        return self.column_cache.fill(md5, chunks)
+
+    def _column_chunks_from(self, chunks, offset):
+        """ Internal: The (columns, field_types) chunks from row offset on (earlier chunks are skipped whole). """
+        for columns, field_types in chunks:
+            num_rows = _num_rows(columns)
+            if offset >= num_rows:
+                offset -= num_rows
+                continue
+            if offset:
+                columns = {name: values[offset:] for name, values in columns.items()}
+                offset = 0
+            yield columns, field_types
+
+    def _rechunk_columns(self, chunks, chunk_size):
+        """ Internal: Regroup (columns, field_types) chunks into chunks of chunk_size rows. """
+        pending, num_pending = [], 0
+        for columns, field_types in chunks:
+            num_rows = _num_rows(columns)
+            start = 0
+            while start < num_rows:
+                end = min(start + chunk_size - num_pending, num_rows)
+                pending.append({name: values[start:end] for name, values in columns.items()})
+                num_pending += end - start
+                start = end
+                if num_pending == chunk_size:
+                    yield bro_log_reader.concat_columns(pending), field_types
+                    pending, num_pending = [], 0
+        if pending:
+            yield bro_log_reader.concat_columns(pending), field_types
+
+    def _dataset_rows(self, md5, offset=0):
+        """ Internal: The rows of a dataset from row offset on (negative counts back from the last row). """
+        if offset < 0:
+            offset = max(self.data_store.get_dataset_info(md5)['num_rows'] + offset, 0)
+        for batch in self.data_store.dataset_batches(md5, offset):
+            fields = batch['fields']
+            for values in batch['rows'][max(offset - batch['first_row'], 0):]:
+                yield dict(zip(fields, values))
+
+    def _line_index(self, md5):
+        """ Internal: The line index of a log sample (built and stored with the sample the first time,
+            None for gzip compressed samples since the offsets have to be into the stored bytes). """
+        index_file = self.data_store.open_line_index(md5)
+        if index_file is not None:
+            return line_index.LineIndex.from_file(index_file)
+
+        # Only one greenlet builds the index of a sample, the others wait for it (the DataStore
+        # keeps the first index stored when several processes build it at the same time)
+        if md5 in self.indexing:
+            self.indexing[md5].wait()
+            return self._line_index(md5)
+        self.indexing[md5] = gevent.event.Event()
+        try:
+            chunks = self.data_store.open_sample(md5)
+            if chunks is None:
+                raise WorkBench.DataNotFound(md5 + ': Data/Sample not found...')
+            first = next(chunks, b'')
+            if first[:2] == sample_stream.GZIP_MAGIC:
+                return None
+            index = line_index.LineIndex.build(itertools.chain([first], chunks))
+            self.data_store.store_line_index(md5, index.to_bytes(), index.num_rows())
+            return index
+        finally:
+            self.indexing.pop(md5).set()
+
+    def _sample_chunks(self, md5):
+        """ Internal: The bytes of a sample streamed out of the DataStore (gzip is decompressed on the fly). """
+        chunks = self.data_store.open_sample(md5)
+        if chunks is None:
+            raise WorkBench.DataNotFound(md5 + ': Data/Sample not found...')
+        return sample_stream.decompress(chunks)
+
+    def _sample_lines(self, md5):
+        """ Internal: The lines of a sample streamed out of the DataStore. """
+        return sample_stream.lines(self._sample_chunks(md5))
+
     def get_dataframe(self, md5, compress='lz4'):
         """Return a dataframe from the DataStore. This is just a convenience method
            that uses get_sample internally. 
@@ -434,13 +838,11 @@ class WorkBench(object):
             Returns:
                 Nothing
         """
+        self.job_queue.clear()
         self.data_store.clear_db()
-
-        # Have the plugin manager reload all the plugins
-        self.plugin_manager.load_all_plugins()
-
-        # Store information about commands and workbench
-        self._store_information()
+        if self.column_cache:
+            self.column_cache.clear()
+        self._reload()
 
     def clear_worker_output(self):
         """Drops all of the worker output collections
@@ -450,29 +852,36 @@ class WorkBench(object):
                 Nothing
         """
         self.data_store.clear_worker_output()
-
-        # Have the plugin manager reload all the plugins
-        self.plugin_manager.load_all_plugins()
-
-        # Store information about commands and workbench
-        self._store_information()
+        self._reload()
 
 
     #######################
     # Work Request Methods
     #######################
-    def work_request(self, worker_name, md5, subkeys=None):
+    def work_request(self, worker_name, md5, subkeys=None, trace=False):
         """ Make a work request for an existing stored sample.
             Args:
                 worker_name: 'strings', 'pe_features', whatever
                 md5: the md5 of the sample (or sample_set!)
                 subkeys: just get a subkey of the output: 'foo' or 'foo.bar' (None for all) 
+                trace: include a 'trace' key with the span tree of the request (default False)
             Returns:
                 The output of the worker.
         """
 
         # Pull the worker output
-        work_results = self._recursive_work_resolver(worker_name, md5)
+        self.in_flight += 1
+        try:
+            with self.admission.admit(self._sample_bytes(md5), self.request_context.is_nested()), \
+                 self.tracer.trace('work_request', force=trace, parent=self.request_context.parent_trace(),
+                                   worker=worker_name, md5=md5) as root:
+                work_results = self._recursive_work_resolver(worker_name, md5)
+        finally:
+            self.in_flight -= 1
+
+        # Warm the cache for the likely next request (analyst sessions, not the nested requests of workers)
+        if self.prefetch_max_queue and not self.request_context.is_nested():
+            self._prefetch(worker_name, md5)
 
         # Subkeys (Fixme this is super klutzy)
         if subkeys:
@@ -502,32 +911,56 @@ class WorkBench(object):
                 raise RuntimeError('Could not get one or more subkeys for: %s' % (work_results))
 
         # Clean it and ship it
-        return self.data_store.clean_for_serialization(work_results)
+        work_results = self.data_store.clean_for_serialization(work_results)
+        if trace and root:
+            work_results['trace'] = root.to_dict()
+        return work_results
 
     @zerorpc.stream
-    def set_work_request(self, worker_name, sample_set, subkeys=None):
+    def set_work_request(self, worker_name, sample_set, subkeys=None, kwargs=None):
         """ Make a work request for an existing stored sample (or sample_set).
             Args:
                 worker_name: 'strings', 'pe_features', whatever
                 sample_set: the md5 of a sample_set in the Workbench data store
                 subkeys: just get a subkey of the output: 'foo' or 'foo.bar' (None for all) 
+                kwargs: stream options (None for the defaults)
+                    cursor: wrap each output as {'cursor': token, 'data': output} (see stream_cursor)
+                    resume_from: a cursor token from an interrupted stream of the same request, the stream
+                                 continues with the next sample (implies cursor)
             Returns:
                 The output is a generator of the results of the worker output for the sample_set
         """
+        if kwargs and (kwargs.get('cursor') or kwargs.get('resume_from')):
+            return self._admitted_stream(0, self._resumable_set_work_request, worker_name, sample_set, subkeys, kwargs)
+        return self._admitted_stream(0, self._set_work_request, worker_name, sample_set, subkeys)
+
+    def _set_work_request(self, worker_name, sample_set, subkeys=None, start=0):
+        """ Internal: The generator behind set_work_request (starting at the start'th sample). """
 
         # Does worker support sample_set_input?
         if self.plugin_meta[worker_name]['sample_set_input']:
-            yield self.work_request(worker_name, sample_set, subkeys)
+            if not start:
+                yield self.work_request(worker_name, sample_set, subkeys)
  
         # Loop through all the md5s and return a generator with yield
         else:
             md5_list = self.get_sample_set(sample_set)
-            for md5 in md5_list:
+            for md5 in md5_list[start:]:
                 if subkeys:
                     yield self.work_request(worker_name, md5, subkeys)
                 else:
                     yield self.work_request(worker_name, md5)[worker_name]
 
+    def _resumable_set_work_request(self, worker_name, sample_set, subkeys, kwargs):
+        """ Internal: set_work_request with cursor tokens (picking up after the resume_from token). """
+        request = [worker_name, sample_set, subkeys]
+        position = 0
+        if kwargs.get('resume_from'):
+            position = stream_cursor.token_position(kwargs['resume_from'], 'set_work_request', request)
+        for output in self._set_work_request(worker_name, sample_set, subkeys, position):
+            position += 1
+            yield {'cursor': stream_cursor.make_token('set_work_request', request, position), 'data': output}
+
     def store_sample_set(self, md5_list):
         """ Store a sample set (which is just a list of md5s).
 
@@ -593,6 +1026,76 @@ class WorkBench(object):
         for md5 in self._get_work_results('sample_set', md5)['md5_list']:
             yield md5
 
+    def get_stats(self):
+        """ Gives you the server metrics.
+
+            Args:
+                None
+
+            Returns:
+                A dictionary with per-worker execution counts, errors and latencies,
+                cache hit ratios, data store reads, gauges (in-flight requests, etc.),
+                the learned worker costs and worker transitions (see prefetch)
+        """
+        stats = self.metrics.get_stats()
+        stats['costs'] = self.cost_model.summary()
+        stats['transitions'] = self.prefetcher.summary()
+        return stats
+
+    def queue_work_request(self, worker_name, md5, priority=job_queue.NORMAL):
+        """ Queue a work request to run in the background (cheapest work first).
+
+            Args:
+                worker_name: 'strings', 'pe_features', whatever
+                md5: the md5 of the sample (or sample_set!)
+                priority: lower runs first (0 high, 10 normal, 20 background/ingest)
+
+            Returns:
+                A dictionary with 'queued' (False if it's already queued or running)
+                and 'eta' (estimated seconds until it's done, then work_request hits the cache)
+        """
+        if worker_name not in self.plugin_meta:
+            raise RuntimeError('No worker named %s' % worker_name)
+        queued = self.job_queue.put(worker_name, md5, priority)
+        return {'queued': queued, 'eta': self.job_queue.eta(worker_name, md5)}
+
+    def explain_work_request(self, worker_name, md5):
+        """ Explain what a work_request (or set_work_request) would cost without running it.
+
+            Args:
+                worker_name: 'strings', 'pe_features', whatever
+                md5: the md5 of the sample (or sample_set!)
+
+            Returns:
+                A dictionary with the dependency DAG (for each worker: its dependencies and how
+                many of the results are fresh, stale or missing, how many executions the request
+                needs and their estimated seconds) plus the totals: 'estimated_seconds' (from the
+                learned worker costs) and 'estimated_bytes' (sample bytes the executions read)
+        """
+        if worker_name not in self.plugin_meta:
+            raise RuntimeError('No worker named %s' % worker_name)
+
+        # Sample sets fan out to their samples (unless the worker takes the whole set)
+        sample_set = self.is_sample_set(md5)
+        if sample_set and not self.plugin_meta[worker_name]['sample_set_input']:
+            md5_list = self.get_sample_set(md5)
+        else:
+            md5_list = [md5]
+        plan = self._plan(worker_name, md5_list)
+        plan.update({'worker': worker_name, 'md5': md5, 'sample_set': sample_set, 'samples': len(md5_list)})
+        return plan
+
+    def get_traces(self, limit=10):
+        """ Gives you the most recent traces (sampled or requested with trace=True).
+
+            Args:
+                limit: the maximum number of traces to return (None for all)
+
+            Returns:
+                A list of span trees, newest first
+        """
+        return self.tracer.get_traces(limit)
+
     def get_datastore_uri(self):
         """ Gives you the current datastore URI.
 
@@ -613,6 +1116,15 @@ class WorkBench(object):
         if not topic:
             topic = 'workbench'
 
+        # Help on all the commands/workers is expensive to build so we build it on demand
+        # and cache it (the worker help is rebuilt whenever a plugin is (re)loaded)
+        if topic in ['commands', 'workers']:
+            if topic not in self.help_cache:
+                help_text = self._help_commands() if topic == 'commands' else self._help_workers()
+                self.store_info({'help': help_text}, topic, type_tag='help')
+                self.help_cache[topic] = '%s%s%s' % (color.LightBlue, help_text, color.Normal)
+            return self.help_cache[topic]
+
         # It's possible to ask for help on something that doesn't exist
         # so we'll catch the exception and push back an object that
         # indicates we didn't find what they were asking for
@@ -709,14 +1221,12 @@ class WorkBench(object):
         """ Run the test for a specific worker """
 
         # First find the plugin
-        try:
-            plugin = self.plugin_meta[worker_name]
-        except KeyError:
+        if worker_name not in self.plugin_meta:
             return '%s worker not found.. misspelled?' % worker_name
 
         # Now try to run the test
         try:
-            return plugin['test']()
+            return self._plugin(worker_name)['test']()
         except (AttributeError, KeyError) as error:
             output = 'Failure for plugin: %s' % (worker_name)
             output += 'Error: %s' % error
@@ -729,63 +1239,164 @@ class WorkBench(object):
     def _store_information(self):
         """ Store infomation about Workbench and its commands """
         
+        # The help on commands and workers is built on demand (see help)
+        self.help_cache = {}
+
+        # Information on Workbench commands and signatures plus the help text
+        commands = [{'command': name, 'sig': str(funcsigs.signature(meth)), 'docstring': meth.__doc__}
+                    for name, meth in inspect.getmembers(self, predicate=inspect.isroutine) if not name.startswith('_')]
+        help_info = {'version': '<<< Workbench Server Version %s >>>' % self.version,
+                     'workbench': self._help_workbench(), 'basic': self._help_basic()}
+
+        # Only write the information when it has changed since the last time it was stored
+        info_hash = hashlib.md5(json.dumps([commands, help_info], sort_keys=True).encode('utf-8')).hexdigest()
+        stored_hash = self.data_store.get_work_results('info', 'info_hash')
+        if stored_hash and stored_hash.get('info_hash') == info_hash:
+            return
+
         print('<<< Generating Information Storage >>>')
 
         # Stores information on Workbench commands and signatures
-        for name, meth in inspect.getmembers(self, predicate=inspect.isroutine):
-            if not name.startswith('_'):
-                info = {'command': name, 'sig': str(funcsigs.signature(meth)), 'docstring': meth.__doc__}
-                self.store_info(info, name, type_tag='command')
+        for info in commands:
+            self.store_info(info, info['command'], type_tag='command')
 
         # Stores help text into the workbench information system
-        self.store_info({'help': '<<< Workbench Server Version %s >>>' % self.version}, 'version', type_tag='help')
-        self.store_info({'help': self._help_workbench()}, 'workbench', type_tag='help')
-        self.store_info({'help': self._help_basic()}, 'basic', type_tag='help')
-        self.store_info({'help': self._help_commands()}, 'commands', type_tag='help')
-        self.store_info({'help': self._help_workers()}, 'workers', type_tag='help')
+        for topic, help_text in help_info.items():
+            self.store_info({'help': help_text}, topic, type_tag='help')
+        self.store_info({'info_hash': info_hash}, 'info_hash', type_tag='other')
 
     def _new_plugin(self, plugin):
         """ Internal: This method handles the mechanics around new plugins. """
 
-        # First store the plugin info into our data store
-        self.store_info(plugin, plugin['name'], type_tag='worker')
+        # First store the plugin info into our data store (unless it's already there)
+        stored_info = self.data_store.get_work_results('info', plugin['name'])
+        if not stored_info or stored_info.get('source_hash') != plugin['source_hash']:
+            self.store_info(plugin, plugin['name'], type_tag='worker')
 
         # Place it into our active plugin list
         self.plugin_meta[plugin['name']] = plugin
 
-    def _store_work_results(self, results, collection, md5):
+        # Reset the chain hashes of this plugin and every plugin that depends on it (and worker help)
+        self._invalidate_work_chains(plugin['name'])
+        self.help_cache.pop('workers', None)
+
+    def _invalidate_work_chains(self, worker_name):
+        """ Internal: Drop the cached chain hash for this worker and all of its dependents. """
+        self.chain_hashes.pop(worker_name, None)
+        for name, plugin in list(self.plugin_meta.items()):
+            if worker_name in plugin['dependencies'] and name in self.chain_hashes:
+                self._invalidate_work_chains(name)
+
+    def _reload(self, publish=True):
+        """ Internal: Reload all the plugins and the stored information (after the database is cleared). """
+
+        # Have the plugin manager reload all the plugins
+        self.plugin_manager.load_all_plugins()
+
+        # Store information about commands and workbench
+        self._store_information()
+
+        # Tell the other Workbench processes (if any) to reload too
+        if publish and self.coordinator:
+            self.coordinator.publish('reload')
+
+    def _coordinator_message(self, message):
+        """ Internal: A message from another Workbench process. """
+        if message == 'reload':
+            self._reload(publish=False)
+
+    def _sample_bytes(self, md5):
+        """ Internal: The sample bytes a request pulls in (only looked up when there's a byte limit). """
+        if not self.admission.max_in_flight_bytes:
+            return 0
+        return self.data_store.sample_length(md5)
+
+    def _admitted_stream(self, num_bytes, generator_func, *args):
+        """ Internal: Run a stream generator under admission control (admitted on the first row). """
+        with self.admission.admit(num_bytes, self.request_context.is_nested()):
+            for item in generator_func(*args):
+                yield item
+
+    def _plugin(self, worker_name):
+        """ Internal: Get the plugin, importing it first if it was lazily loaded. """
+        plugin = self.plugin_meta[worker_name]
+        if not plugin['class']:
+            self.plugin_manager.load_plugin(plugin)
+        return plugin
+
+    def _store_work_results(self, results, collection, md5, version_hash=None):
         """ Internal: Stores the work results of a worker."""
-        self.data_store.store_work_results(results, collection, md5)
+        with self.tracer.span('data_store.store_work_results', collection=collection):
+            self.data_store.store_work_results(results, collection, md5, version_hash)
     def _get_work_results(self, collection, md5):
         """ Internal: Method for fetching work results."""
-        results = self.data_store.get_work_results(collection, md5)
+        with self.tracer.span('data_store.get_work_results', collection=collection):
+            results = self.data_store.get_work_results(collection, md5)
         if not results:
             raise WorkBench.DataNotFound(md5 + ': Data/Sample not found...')
         return {collection: results}
 
-    def _work_chain_mod_time(self, worker_name):
-        """ Internal: We compute a modification time of a work chain.
+    def _work_chain_hash(self, worker_name):
+        """ Internal: We compute a version hash of a work chain.
             Returns:
-                The newest modification time of any worker in the work chain. 
+                A hash of the source hashes of every worker in the work chain.
         """
 
         # Bottom out on sample, info or tags
         if worker_name=='sample' or worker_name=='info' or worker_name=='tags':
-            return datetime.datetime(1970, 1, 1)
-
-        my_mod_time = self._get_work_results('info', worker_name)['info']['mod_time']
-        dependencies = self.plugin_meta[worker_name]['dependencies']
-        if not dependencies:
-            return my_mod_time
-        else:
-            depend_mod_times = [my_mod_time]
-            for depend in dependencies:
-                depend_mod_times.append(self._work_chain_mod_time(depend))
-            return max(depend_mod_times)
+            return ''
+
+        # Chain hashes only change when a plugin is (re)loaded so cache them
+        if worker_name not in self.chain_hashes:
+            chain_hash = hashlib.md5(self.plugin_meta[worker_name]['source_hash'].encode('utf-8'))
+            for depend in self.plugin_meta[worker_name]['dependencies']:
+                if depend in self.plugin_meta or depend in ['sample', 'info', 'tags']:
+                    chain_hash.update(self._work_chain_hash(depend).encode('utf-8'))
+            self.chain_hashes[worker_name] = chain_hash.hexdigest()
+        return self.chain_hashes[worker_name]
+
+    def _refresh_stale_results(self):
+        """ Internal: Background task that slowly recomputes stale worker results
+            (of the workers that are loaded, the lazily added ones are left alone until they're used). """
+        while True:
+            gevent.sleep(self.refresh_interval)
+            for worker_name in [name for name, plugin in self.plugin_meta.items() if plugin['class']]:
+                version_hash = self._work_chain_hash(worker_name)
+                for md5 in self.data_store.stale_md5s(worker_name, version_hash):
+                    try:
+                        self._recursive_work_resolver(worker_name, md5)
+                    except Exception as error:
+                        print('Warning: Could not refresh %s for %s (%s)' % (worker_name, md5, error))
+
+                    # Give the interactive requests a chance to run
+                    gevent.sleep(0)
 
     def _recursive_work_resolver(self, worker_name, md5):
         """ Internal: Input dependencies are recursively backtracked, invoked and then
                passed down the pipeline until getting to the requested worker. """
+        with self.tracer.span('resolve:%s' % worker_name):
+            if worker_name not in self.plugin_meta:
+                return self._work_resolver(worker_name, md5)
+
+            # Only one greenlet resolves a worker for a sample, the others (e.g. an
+            # analyst request while an ingest job is running) wait and hit the cache
+            key = (worker_name, md5)
+            while key in self.resolving:
+                self.resolving[key].wait()
+            self.resolving[key] = gevent.event.Event()
+            try:
+                return self._work_resolver(worker_name, md5)
+            finally:
+                self.resolving.pop(key).set()
+
+    def _background_work(self, worker_name, md5):
+        """ Internal: Run a background job (see job_queue.JobQueue). """
+        if worker_name not in self.plugin_meta:
+            raise RuntimeError('No worker named %s' % worker_name)
+        self._recursive_work_resolver(worker_name, md5)
+
+    def _work_resolver(self, worker_name, md5):
+        """ Internal: Resolves a single worker, see _recursive_work_resolver. """
 
         # Looking for the sample?
         if worker_name == 'sample':
@@ -804,45 +1415,204 @@ class WorkBench(object):
             print('Alert: Request for non-existing or failed plugin: %s' % (worker_name))
             return {}
 
-        # If the results exist and the time_stamp is newer than the entire work_chain, I'm done
+        # If the results exist and were produced by the current work_chain, I'm done
         collection = self.plugin_meta[worker_name]['name']
+        work_chain_hash = self._work_chain_hash(worker_name)
         try:
             work_results = self._get_work_results(collection, md5)
-            work_chain_mod_time = self._work_chain_mod_time(worker_name)
-            if work_chain_mod_time < work_results[collection]['__time_stamp']:
+            if self._freshness(worker_name, work_results[collection]) == 'fresh':
+                self.metrics.cache_hit('results')
+                self.tracer.tag(cache='hit')
                 return work_results
             elif self.VERBOSE:
-                print('VERBOSE: %s work_chain is newer than data' % (worker_name))
+                print('VERBOSE: %s work_chain has changed since data was generated' % (worker_name))
         except WorkBench.DataNotFound:
             if self.VERBOSE:
                 print('Verbose: %s data not found generating' % (worker_name))
 
         # Okay either need to generate (or re-generate) the work results
+        self.metrics.cache_hit('results', hit=False)
+        self.tracer.tag(cache='miss')
+
+        # Don't retry a worker that recently failed on this sample (exponential backoff)
+        failure = self.data_store.get_failure(collection, md5, work_chain_hash, expired=True)
+        if failure and failure['retry_after'] > datetime.datetime.utcnow():
+            self.metrics.incr('cached_failures', worker=worker_name)
+            raise circuit_breaker.CachedFailure('%s failed on %s: %s (cached failure, retry after %s)' %
+                                                (worker_name, md5, failure['error'], failure['retry_after']))
+
+        # Don't run a worker that's failing too often
+        self.circuit_breaker.allow(worker_name)
+
+        # Optional dependencies that fail are passed to the worker as {} (and the output isn't stored)
         dependencies = self.plugin_meta[worker_name]['dependencies']
+        optional_dependencies = self.plugin_meta[worker_name]['optional_dependencies']
         dependant_results = {}
+        degraded = False
         for dependency in dependencies:
-            dependant_results.update(self._recursive_work_resolver(dependency, md5))
+            try:
+                dependant_results.update(self._recursive_work_resolver(dependency, md5))
+            except Exception as error:
+                if dependency not in optional_dependencies:
+                    raise
+                print('Warning: %s is running without %s (%s)' % (worker_name, dependency, error))
+                dependant_results[dependency] = {}
+                degraded = True
         if self.VERBOSE:
             print('Verbose: new work for plugin: %s' % (worker_name))
-        work_results = self.plugin_meta[worker_name]['class']().execute(dependant_results)
-
-        # Enforce dictionary output
-        if not isinstance(work_results, dict):
-            print('Critical: Plugin %s MUST produce a python dictionary!' % worker_name)
-            return None
+        self.metrics.incr('executions', worker=worker_name)
+        plugin = self._plugin(worker_name)
+        worker_deadline = plugin['deadline'] or self.default_deadline
+        num_bytes = self.data_store.sample_length(md5)
+        try:
+            with self.admission.bulkhead(worker_name), self.metrics.timer('latency', worker=worker_name), \
+                 self.tracer.span('execute:%s' % worker_name):
+                start, cpu_start = time.time(), self.cpu_clock.cpu_time()
+                work_results = deadline.execute(plugin['class'], dependant_results, worker_deadline, plugin['isolated'])
+                self._record_cost(worker_name, num_bytes, time.time() - start, self.cpu_clock.cpu_time() - cpu_start)
+
+            # Enforce dictionary output
+            if not isinstance(work_results, dict):
+                print('Critical: Plugin %s MUST produce a python dictionary!' % worker_name)
+                raise RuntimeError('Plugin %s MUST produce a python dictionary!' % worker_name)
+        except admission.Overloaded:
+            raise
+        except Exception as error:
+            if isinstance(error, deadline.WorkerTimeout):
+                self.metrics.incr('timeouts', worker=worker_name)
+            self.metrics.incr('errors', worker=worker_name)
+            self.circuit_breaker.record(worker_name, success=False)
+            self._store_failure(collection, md5, work_chain_hash, error, failure)
+            raise
+        self.circuit_breaker.record(worker_name, success=True)
+        if failure:
+            self.data_store.clear_failure(collection, md5)
+
+        # Degraded output (an optional dependency failed) isn't stored
+        if degraded:
+            return {collection: work_results}
 
         # Store the results and return
-        self._store_work_results(work_results, collection, md5)
+        self._store_work_results(work_results, collection, md5, work_chain_hash)
         return self._get_work_results(collection, md5)
 
+    def _freshness(self, worker_name, results):
+        """ Internal: Are the stored results of a worker 'fresh' (produced by the current work chain),
+            'stale' or 'missing' (results is None)? """
+        if results is None:
+            return 'missing'
+        return 'fresh' if results.get('__version_hash') == self._work_chain_hash(worker_name) else 'stale'
+
+    def _plan(self, worker_name, md5_list):
+        """ Internal: The dependency DAG of a worker with the freshness of the results and the
+            estimated cost of the executions needed to resolve it for each md5 (see explain_work_request). """
+
+        # The DAG (sample, info and tags are inputs not workers)
+        dag = {}
+        pending = [worker_name]
+        while pending:
+            name = pending.pop()
+            if name in dag or name in ['sample', 'info', 'tags']:
+                continue
+            if name not in self.plugin_meta:
+                dag[name] = {'dependencies': [], 'error': 'No worker named %s' % name}
+                continue
+            dag[name] = {'dependencies': self.plugin_meta[name]['dependencies'],
+                         'fresh': 0, 'stale': 0, 'missing': 0, 'executions': 0, 'estimated_seconds': 0.0}
+            pending += dag[name]['dependencies']
+
+        # Freshness of the stored results (one query per worker)
+        freshness = {}
+        for name, node in dag.items():
+            if 'error' in node:
+                continue
+            versions = self.data_store.result_versions(self.plugin_meta[name]['name'], md5_list)
+            freshness[name] = {md5: self._freshness(name, versions.get(md5)) for md5 in md5_list}
+            for state in freshness[name].values():
+                node[state] += 1
+
+        # Walk the DAG for each md5: a worker without fresh results executes (and so do its dependencies)
+        lengths = self.data_store.sample_lengths(md5_list)
+        total_bytes = 0
+        for md5 in md5_list:
+            visited = set()
+            reads_sample = False
+            pending = [worker_name]
+            while pending:
+                name = pending.pop()
+                if name in visited or name not in freshness or freshness[name][md5] == 'fresh':
+                    continue
+                visited.add(name)
+                dag[name]['executions'] += 1
+                dag[name]['estimated_seconds'] += self.cost_model.estimate(name, lengths.get(md5, 0))
+                reads_sample = reads_sample or 'sample' in dag[name]['dependencies']
+                pending += dag[name]['dependencies']
+            if reads_sample:
+                total_bytes += lengths.get(md5, 0)
+
+        return {'dag': dag, 'estimated_bytes': total_bytes,
+                'estimated_seconds': sum(node.get('estimated_seconds', 0.0) for node in dag.values())}
+
+    def _prefetch(self, worker_name, md5):
+        """ Internal: Learn from a work request and queue the likely next workers (when we're idle). """
+        type_tag = self.prefetcher.type_tag(md5) or self.data_store.sample_type_tag(md5)
+        if not type_tag:
+            return
+        for next_worker in self.prefetcher.record(type_tag, md5, worker_name):
+            if self.in_flight or self.job_queue.depth() >= self.prefetch_max_queue:
+                return
+            if next_worker in self.plugin_meta:
+                self.job_queue.put(next_worker, md5, job_queue.PREFETCH)
+
+    def _record_cost(self, worker_name, num_bytes, seconds, cpu_seconds):
+        """ Internal: Record the cost of an execution in the worker's cost profile (the changed
+            profiles are stored at most once a minute, not on every execution). """
+        self.cost_model.record(worker_name, num_bytes, seconds, cpu_seconds)
+        self.costs_changed.add(worker_name)
+        if time.time() - self.costs_stored > 60:
+            self._store_costs()
+
+    def _store_costs(self):
+        """ Internal: Store the cost profiles that changed since the last time. """
+        for worker_name in self.costs_changed:
+            self.data_store.store_cost_profile(worker_name, self.cost_model.profiles[worker_name].to_dict())
+        self.costs_changed.clear()
+        self.costs_stored = time.time()
+
+    def _estimate_job(self, worker_name, md5):
+        """ Internal: The (kind, estimated seconds) of a job (see job_queue.JobQueue). """
+        if worker_name not in self.plugin_meta:
+            return self.cost_model.kind(worker_name), self.cost_model.estimate(worker_name)
+
+        # Only the executions the job actually needs count (cached results are free)
+        isolated = self.plugin_meta[worker_name]['isolated']
+        return self.cost_model.kind(worker_name, isolated), self._plan(worker_name, [md5])['estimated_seconds']
+
+    def _store_failure(self, collection, md5, version_hash, error, previous_failure=None):
+        """ Internal: Store a worker failure, the retry_after doubles with each failure in a row. """
+        count = previous_failure.get('count', 1) + 1 if previous_failure else 1
+        retry_after = min(self.failure_retry_after * 2 ** (count - 1), self.failure_max_retry_after)
+        self.data_store.store_failure(collection, md5, version_hash, '%s: %s' % (type(error).__name__, error),
+                                      retry_after, count)
+
     def _find_element(self,d,k):
         if k in d: return d[k]
         submatch = [d[_k][k] for _k in d if k in d[_k]]
         return submatch[0] if submatch else None
 
 
-def run():
-    """ Run the workbench server """
+def _num_rows(columns):
+    """ Internal: The number of rows in a chunk of columns. """
+    return len(next(iter(columns.values()))) if columns else 0
+
+
+def run(database=None, port=4242):
+    """ Run the workbench server
+
+        Args:
+            database: override the database from config.ini (e.g. a throwaway database for benchmarks)
+            port: the port the server listens on
+    """
 
     # Load the configuration file relative to this script location
     config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.ini')
@@ -854,15 +1624,61 @@ def run():
 
     # Pull configuration settings
     datastore_uri = workbench_conf.get('workbench', 'datastore_uri')
-    database = workbench_conf.get('workbench', 'database')
+    database = database or workbench_conf.get('workbench', 'database')
     worker_cap = workbench_conf.getint('workbench', 'worker_cap')
     samples_cap = workbench_conf.getint('workbench', 'samples_cap')
+    refresh_interval = workbench_conf.getint('workbench', 'refresh_interval', fallback=0)
+    metrics_port = workbench_conf.getint('workbench', 'metrics_port', fallback=0)
+    trace_sample_rate = workbench_conf.getfloat('workbench', 'trace_sample_rate', fallback=0.0)
+    trace_buffer_size = workbench_conf.getint('workbench', 'trace_buffer_size', fallback=100)
+    default_deadline = workbench_conf.getint('workbench', 'default_deadline', fallback=0)
+    failure_retry_after = workbench_conf.getint('workbench', 'failure_retry_after', fallback=60)
+    failure_max_retry_after = workbench_conf.getint('workbench', 'failure_max_retry_after', fallback=86400)
+    prefetch_args = {'min_probability': workbench_conf.getfloat('workbench', 'prefetch_min_probability', fallback=0.3),
+                     'min_observations': workbench_conf.getint('workbench', 'prefetch_min_observations', fallback=5)}
+    prefetch_max_queue = workbench_conf.getint('workbench', 'prefetch_max_queue', fallback=0)
+    breaker_args = {'failure_rate': workbench_conf.getfloat('workbench', 'breaker_failure_rate', fallback=0.5),
+                    'min_executions': workbench_conf.getint('workbench', 'breaker_min_executions', fallback=10),
+                    'window': workbench_conf.getint('workbench', 'breaker_window', fallback=60),
+                    'reset_timeout': workbench_conf.getint('workbench', 'breaker_reset_timeout', fallback=30)}
+    job_args = {'slots': {'cpu': workbench_conf.getint('workbench', 'job_cpu_slots', fallback=1),
+                          'io': workbench_conf.getint('workbench', 'job_io_slots', fallback=2)},
+                'rate_limit': workbench_conf.getfloat('workbench', 'job_rate_limit', fallback=0)}
+    ingest_pipelines = {}
+    if workbench_conf.has_section('ingest'):
+        for type_tag, worker_list in workbench_conf.items('ingest'):
+            ingest_pipelines[type_tag] = [name.strip() for name in worker_list.split(',') if name.strip()]
+    admission_args = {'max_in_flight': workbench_conf.getint('workbench', 'max_in_flight', fallback=0),
+                      'max_in_flight_bytes': workbench_conf.getint('workbench', 'max_in_flight_mb', fallback=0)*1024*1024,
+                      'max_queue': workbench_conf.getint('workbench', 'max_queue', fallback=0),
+                      'queue_timeout': workbench_conf.getint('workbench', 'queue_timeout', fallback=30),
+                      'worker_concurrency': admission.parse_worker_concurrency(
+                          workbench_conf.get('workbench', 'worker_concurrency', fallback=''))}
+
+    server_processes = workbench_conf.getint('workbench', 'server_processes', fallback=1)
+    column_cache_mb = workbench_conf.getint('workbench', 'column_cache_mb', fallback=0)
+    column_cache_args = {'cache_dir': workbench_conf.get('workbench', 'column_cache_dir', fallback='') or None,
+                         'max_bytes': column_cache_mb*1024*1024} if column_cache_mb else None
+    dataset_cap = workbench_conf.getint('workbench', 'dataset_cap', fallback=0)
+    store_args = {'uri': datastore_uri, 'database': database, 'worker_cap':worker_cap, 'samples_cap':samples_cap,
+                  'dataset_cap': dataset_cap}
+    workbench_args = {'store_args': store_args, 'refresh_interval': refresh_interval, 'metrics_port': metrics_port,
+                      'trace_sample_rate': trace_sample_rate, 'trace_buffer_size': trace_buffer_size,
+                      'admission_args': admission_args, 'default_deadline': default_deadline,
+                      'failure_retry_after': failure_retry_after, 'failure_max_retry_after': failure_max_retry_after,
+                      'breaker_args': breaker_args, 'ingest_pipelines': ingest_pipelines, 'job_args': job_args,
+                      'prefetch_args': prefetch_args, 'prefetch_max_queue': prefetch_max_queue,
+                      'column_cache_args': column_cache_args}
+
+    # Multi-process: N Workbench processes behind a broker on the public port
+    if server_processes > 1:
+        _run_multiprocess(server_processes, port, workbench_args)
+        return
 
     # Spin up Workbench ZeroRPC
     try:
-        store_args = {'uri': datastore_uri, 'database': database, 'worker_cap':worker_cap, 'samples_cap':samples_cap}
-        workbench = zerorpc.Server(WorkBench(store_args=store_args), name='workbench', heartbeat=60)
-        workbench.bind('tcp://0.0.0.0:4242')
+        workbench = zerorpc.Server(WorkBench(**workbench_args), name='workbench', heartbeat=60)
+        workbench.bind('tcp://0.0.0.0:%d' % port)
         print('\nWorkbench is ready and feeling super duper!')
         gevent_signal(signal.SIGTERM, workbench.stop)
         gevent_signal(signal.SIGINT, workbench.stop)
@@ -874,6 +1690,72 @@ def run():
         print('\nInfo: Could not start Workbench server (no worries, probably already running...)\n')
 
 
+def _run_process(endpoint, workbench_args):
+    """ Internal: Run one Workbench process behind the broker """
+    workbench = zerorpc.Server(WorkBench(**workbench_args), name='workbench', heartbeat=60)
+    workbench.bind(endpoint)
+    gevent_signal(signal.SIGTERM, workbench.stop)
+    gevent_signal(signal.SIGINT, workbench.stop)
+    workbench.run()
+
+
+def _run_multiprocess(server_processes, port, workbench_args):
+    """ Internal: Run N Workbench processes (sharing the DataStore) behind a broker
+
+        Args:
+            server_processes: the number of Workbench processes
+            port: the public port (the broker listens here)
+            workbench_args: the WorkBench arguments for each process
+    """
+
+    # The processes listen on local ipc endpoints
+    ipc_dir = tempfile.mkdtemp(prefix='workbench_')
+    endpoint = lambda name: 'ipc://%s/%s.ipc' % (ipc_dir, name)
+    backends = [endpoint('workbench_%d' % index) for index in range(server_processes)]
+    coordination = (endpoint('publish'), endpoint('subscribe'))
+
+    # Only the first process refreshes stale results, each process serves its own metrics (metrics_port + index),
+    # a worker callback can land on any process so they share the request secret
+    processes = []
+    request_secret = binascii.hexlify(os.urandom(16)).decode('ascii')
+    for index, backend in enumerate(backends):
+        process_args = dict(workbench_args, coordination=coordination, request_secret=request_secret)
+        if index:
+            process_args['refresh_interval'] = 0
+            if process_args['metrics_port']:
+                process_args['metrics_port'] += index
+        processes.append(multiprocessing.Process(target=_run_process, args=(backend, process_args)))
+    for process in processes:
+        process.start()
+
+    # The broker (and its zmq context) is only made after the processes are forked,
+    # forking a process that has a zmq context isn't safe (the sockets and I/O threads aren't fork safe)
+    try:
+        front = broker.Broker('tcp://0.0.0.0:%d' % port, backends, coordination)
+    except zmq.error.ZMQError:
+        print('\nInfo: Could not start Workbench server (no worries, probably already running...)\n')
+        for process in processes:
+            process.terminate()
+            process.join()
+        shutil.rmtree(ipc_dir)
+        return
+    print('\nWorkbench is ready and feeling super duper! (%d processes)' % server_processes)
+
+    # Run the broker until we're told to stop
+    job = gevent.spawn(front.run)
+    gevent_signal(signal.SIGTERM, job.kill, block=False)
+    gevent_signal(signal.SIGINT, job.kill, block=False)
+    try:
+        job.join()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        front.close()
+        shutil.rmtree(ipc_dir)
+    print('\nWorkbench Server Shutting Down... and dreaming of sheep...')
+
+
 # Test that just calls main
 def test():
     run()
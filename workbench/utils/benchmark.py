@@ -0,0 +1,268 @@
+''' Reproducible end-to-end throughput benchmark over the bundled workbench/data corpus.
+
+    Spins up a Workbench server against a throwaway database, then N client
+    processes replay a configurable mix of operations and report throughput
+    and p50/p95/p99 latencies as JSON (diff the output between commits).
+
+    Example:
+        $ python benchmark.py --clients 4 --requests 200 --mix default --output bench.json
+
+    Note: Workers that call back into Workbench (pcap_bro, view_pcap_deep, ...)
+          connect to 127.0.0.1:4242 so the benchmark server uses that port,
+          make sure no other Workbench server is running.
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import datetime
+import subprocess
+import multiprocessing
+import zerorpc
+
+# Directories under workbench/data and their type_tags
+CORPUS_DIRS = {'pe/bad': 'exe', 'pe/good': 'exe', 'pdf/bad': 'pdf', 'pdf/good': 'pdf',
+               'pcap': 'pcap', 'bro': 'bro', 'log': 'log', 'json': 'json', 'swf': 'swf', 'zip': 'zip'}
+
+# The operation mixes (operation: weight)
+MIXES = {'default': {'ingest': 1, 'view_cold': 1, 'view_warm': 6, 'set_work_request': 1, 'stream_sample': 1},
+         'ingest': {'ingest': 1},
+         'view_cold': {'view_cold': 1},
+         'view_warm': {'view_warm': 1},
+         'set_work_request': {'set_work_request': 1},
+         'stream_sample': {'stream_sample': 1},
+         'stream_sample_batched': {'stream_sample_batched': 1}}
+
+# Type_tags that view works on without external services (bro, rekall) for the cold/warm views
+VIEW_TYPES = ['exe', 'pdf', 'swf', 'zip']
+
+
+def load_corpus(data_dir):
+    ''' Load the corpus: a list of (filename, type_tag, raw_bytes) '''
+    corpus = []
+    for sub_dir, type_tag in sorted(CORPUS_DIRS.items()):
+        path = os.path.join(data_dir, sub_dir)
+        if not os.path.isdir(path):
+            continue
+        for filename in sorted(os.listdir(path)):
+            if '.DS_Store' in filename:
+                continue
+            with open(os.path.join(path, filename), 'rb') as sample_file:
+                corpus.append((filename, type_tag, sample_file.read()))
+    return corpus
+
+
+def connect(server, port):
+    ''' Open a connection to the workbench server '''
+    workbench = zerorpc.Client(timeout=300, heartbeat=60)
+    workbench.connect('tcp://%s:%d' % (server, port))
+    return workbench
+
+
+class Benchmark(object):
+    ''' Replays a mix of operations against a workbench server '''
+
+    def __init__(self, workbench, corpus, seed=0):
+        ''' Initialization '''
+        self.workbench = workbench
+        self.corpus = corpus
+        self.random = random.Random(seed)
+        self.view_md5s = []
+        self.bro_md5s = []
+        self.set_md5 = None
+
+    def setup(self):
+        ''' Ingest the corpus, build the sample set and warm the view cache '''
+        md5s = []
+        for filename, type_tag, raw_bytes in self.corpus:
+            md5 = self.workbench.store_sample(raw_bytes, filename, type_tag)
+            md5s.append(md5)
+            if type_tag in VIEW_TYPES:
+                self.view_md5s.append(md5)
+            elif type_tag == 'bro':
+                self.bro_md5s.append(md5)
+        self.set_md5 = self.workbench.store_sample_set(md5s)
+        for md5 in self.view_md5s:
+            self.workbench.work_request('view', md5)
+
+    def ingest(self):
+        ''' Store a sample from the corpus '''
+        filename, type_tag, raw_bytes = self.random.choice(self.corpus)
+        self.workbench.store_sample(raw_bytes, filename, type_tag)
+
+    def view_cold(self):
+        ''' View a sample that Workbench has never seen (corpus bytes plus a random overlay) '''
+        candidates = [item for item in self.corpus if item[1] in VIEW_TYPES]
+        filename, type_tag, raw_bytes = self.random.choice(candidates)
+        md5 = self.workbench.store_sample(raw_bytes + os.urandom(16), filename, type_tag)
+        self.workbench.work_request('view', md5)
+
+    def view_warm(self):
+        ''' View a sample whose view is already cached '''
+        self.workbench.work_request('view', self.random.choice(self.view_md5s))
+
+    def set_work_request(self):
+        ''' Meta for the whole corpus sample set '''
+        list(self.workbench.set_work_request('meta', self.set_md5))
+
+    def stream_sample(self):
+        ''' Stream all the rows of a Bro log '''
+        list(self.workbench.stream_sample(self.random.choice(self.bro_md5s)))
+
+    def stream_sample_batched(self):
+        ''' Stream all the rows of a Bro log in batches of 1000 rows '''
+        list(self.workbench.stream_sample(self.random.choice(self.bro_md5s), {'batch_size': 1000}))
+
+    def replay(self, mix, num_requests):
+        ''' Replay the mix of operations, returns a list of (operation, latency, success) '''
+        operations = [op for op, weight in sorted(mix.items()) for _ in range(weight)]
+        timings = []
+        for _ in range(num_requests):
+            op = self.random.choice(operations)
+            start = time.time()
+            try:
+                getattr(self, op)()
+                success = True
+            except Exception as error:
+                print('Benchmark %s failed: %s' % (op, error))
+                success = False
+            timings.append((op, time.time() - start, success))
+        return timings
+
+
+def client_process(args, corpus, client_id, queue):
+    ''' A benchmark client: warmup then replay the mix, results go onto the queue '''
+    workbench = connect(args.server, args.port)
+    bench = Benchmark(workbench, corpus, seed=args.seed + client_id)
+    bench.setup()
+    bench.replay(MIXES[args.mix], args.warmup)
+    start = time.time()
+    timings = bench.replay(MIXES[args.mix], args.requests)
+    queue.put({'client': client_id, 'start': start, 'end': time.time(), 'timings': timings})
+    workbench.close()
+
+
+def percentile(sorted_values, pct):
+    ''' Nearest rank percentile of an already sorted list '''
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+def summarize(timings, elapsed):
+    ''' Throughput, error count and latency percentiles for a list of timings '''
+    latencies = sorted(latency for _, latency, success in timings if success)
+    return {'count': len(timings),
+            'errors': len([success for _, _, success in timings if not success]),
+            'throughput': len(timings) / elapsed if elapsed else None,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99)}
+
+
+def git_commit():
+    ''' The git commit we're benchmarking (None if not in a git repo) '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_for_server(server, port, timeout=120):
+    ''' Wait until the workbench server answers '''
+    start = time.time()
+    while time.time() - start < timeout:
+        workbench = zerorpc.Client(timeout=5, heartbeat=None)
+        workbench.connect('tcp://%s:%d' % (server, port))
+        try:
+            workbench._zerorpc_ping()
+            return
+        except (zerorpc.TimeoutExpired, zerorpc.LostRemote):
+            time.sleep(1)
+        finally:
+            workbench.close()
+    raise RuntimeError('Workbench server did not come up within %d seconds' % timeout)
+
+
+def run(argv=None):
+    ''' Run the benchmark and report the results as JSON '''
+    parser = argparse.ArgumentParser(description='Workbench throughput benchmark')
+    parser.add_argument('-c', '--clients', type=int, default=4, help='number of concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, default=100, help='requests per client')
+    parser.add_argument('-w', '--warmup', type=int, default=10, help='warmup requests per client (not measured)')
+    parser.add_argument('-m', '--mix', choices=sorted(MIXES.keys()), default='default', help='operation mix')
+    parser.add_argument('-s', '--server', type=str, default='127.0.0.1', help='location of workbench server')
+    parser.add_argument('-p', '--port', type=int, default=4242, help='port used by workbench server')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (for reproducible replays)')
+    parser.add_argument('--database', type=str, default=None, help='throwaway database (default: benchmark_<pid>)')
+    parser.add_argument('--no-server', action='store_true', help='use an already running server')
+    parser.add_argument('-o', '--output', type=str, default=None, help='write the JSON report here (default: stdout)')
+    args = parser.parse_args(argv)
+
+    # Load the corpus
+    data_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../data')
+    corpus = load_corpus(data_dir)
+
+    # Spin up a server against a throwaway database
+    server = None
+    if not args.no_server:
+        import workbench.server.workbench_server as workbench_server
+        database = args.database or 'benchmark_%d' % os.getpid()
+        server = multiprocessing.Process(target=workbench_server.run, kwargs={'database': database, 'port': args.port})
+        server.start()
+    wait_for_server(args.server, args.port)
+
+    try:
+        # Spin up the clients and collect their timings
+        queue = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client_process, args=(args, corpus, client_id, queue))
+                   for client_id in range(args.clients)]
+        for client in clients:
+            client.start()
+        results = [queue.get() for _ in clients]
+        for client in clients:
+            client.join()
+
+        # Throughput is measured over the window where all the clients are replaying
+        elapsed = max(result['end'] for result in results) - min(result['start'] for result in results)
+        timings = [timing for result in results for timing in result['timings']]
+        report = {'commit': git_commit(),
+                  'time': datetime.datetime.utcnow().isoformat() + 'Z',
+                  'config': {'clients': args.clients, 'requests': args.requests, 'warmup': args.warmup,
+                             'mix': args.mix, 'seed': args.seed, 'corpus_files': len(corpus)},
+                  'elapsed': elapsed,
+                  'total': summarize(timings, elapsed),
+                  'operations': {op: summarize([timing for timing in timings if timing[0] == op], elapsed)
+                                 for op in sorted(set(timing[0] for timing in timings))}}
+
+    finally:
+        # Throw the database away and shut down the server
+        if server:
+            workbench = connect(args.server, args.port)
+            workbench.clear_db()
+            workbench.close()
+            server.terminate()
+
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output)
+    else:
+        print(output)
+    return report
+
+
+def test():
+    ''' benchmark test '''
+    report = run(['--clients', '2', '--requests', '5', '--warmup', '1'])
+    assert report['total']['count'] == 10
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -1,41 +1,266 @@
+''' Follow growing log files, and ingest growing Bro logs into Workbench.
 
-import pygtail
-import contextlib
-import os, time
-import tempfile
-import shutil
+    LogTail reads the complete lines appended to a log since the last read.
+    It keeps the offset and the inode of the log so a log that's rotated
+    (Bro moves conn.log away and starts a new one) is read to the end
+    before the new log is read from the start. Instead of sleeping and
+    polling, changes are picked up by the Workbench DirWatcher (inotify
+    when inotify_simple is installed, polling the directory otherwise).
 
-@contextlib.contextmanager
-def make_temp_directory():
-    temp_dir = tempfile.mkdtemp()
-    try:
-        yield temp_dir
-    finally:
-        shutil.rmtree(temp_dir)
+    Run as a script it follows the Bro logs in a sensor directory and
+    appends their new rows to a rolling Workbench dataset per log (see the
+    append_log_lines command). The log offsets are saved with the rows, so
+    a restarted tailer picks up right where it stopped:
+
+        $ python tail_file.py /usr/local/bro/logs/current --prefix sensor1
+
+    The rows can be queried while the logs are being written:
+
+        conn_md5 = workbench.get_dataset_info('sensor1.conn')['md5']
+        workbench.stream_sample(conn_md5, {'offset': -100})
+'''
+import zerorpc
+import os, sys
+import argparse
+import gevent.event
+from workbench.server import dir_watcher
+
+
+class LogWatcher(object):
+    ''' Watches the logs in a directory and collects the paths of the logs that change '''
+
+    def __init__(self, log_dir, suffix='.log'):
+        ''' Initialization '''
+        self.changes = set()
+        self.changed = gevent.event.Event()
+
+        # Now setup dynamic monitoring of the log directory (created, modified or moved/rotated)
+        self.watcher = dir_watcher.DirWatcher(log_dir, debounce=0.1, suffix=suffix)
+        self.watcher.register_callbacks(self._on_change, self._on_change, self._on_change)
+        self.watcher.start_monitoring()
+
+    def _on_change(self, paths):
+        ''' DirWatcher callback '''
+        self.changes.update(paths)
+        self.changed.set()
+
+    def wait(self, timeout=None):
+        ''' Wait for changes, returns the set of changed paths (empty if the timeout passed first) '''
+        self.changed.wait(timeout)
+        self.changed.clear()
+        paths, self.changes = self.changes, set()
+        return paths
+
+
+class LogTail(object):
+    ''' The lines appended to a log since the last read (follows the log through rotation) '''
+
+    def __init__(self, filename, inode=None, offset=0):
+        ''' Initialization: filename of the log and where it was read up to (a saved inode and offset) '''
+        self.filename = filename
+        self.inode = inode
+        self.offset = offset
+        self.handle = None
+
+    def read_lines(self, max_bytes=1024*1024):
+        ''' The complete lines (without their newlines) appended since the last read, up to max_bytes
+            at a time. A partial last line waits for the next read and a rotated (or truncated) log is
+            read to the end before the new log is read from the start. '''
+        if not self.handle and not self._open():
+            return []
+        lines = self._read(max_bytes)
+        if not lines and self._replaced():
+            self.close()
+            self.inode, self.offset = None, 0
+            return self.read_lines(max_bytes)
+        return lines
+
+    def close(self):
+        ''' Close the log '''
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+    def _open(self):
+        ''' Open the log at the saved offset (the start if it's a different log now) '''
+        try:
+            self.handle = open(self.filename, 'rb')
+        except IOError:
+            return False
+        stat = os.fstat(self.handle.fileno())
+        if self.inode is not None and stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.offset = 0
+        self.inode = stat.st_ino
+        self.handle.seek(self.offset)
+        return True
+
+    def _read(self, max_bytes):
+        ''' Read the complete lines after the offset '''
+        data = self.handle.read(max_bytes)
+        end = data.rfind(b'\n') + 1
+        while not end:
+            # A line longer than max_bytes (or a partial line)
+            more = self.handle.read(max_bytes)
+            if not more:
+                break
+            data += more
+            end = data.rfind(b'\n') + 1
+        self.offset += end
+        self.handle.seek(self.offset)
+        return data[:end].decode('utf-8', 'replace').split('\n')[:-1]
+
+    def _replaced(self):
+        ''' Has the log been rotated (a new file with the same name) or truncated? '''
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return stat.st_ino != self.inode or stat.st_size < self.offset
 
-@contextlib.contextmanager
-def make_temp_file():
-    with tempfile.NamedTemporaryFile(delete=False) as f:
-        name = f.name
-    try:
-        yield name
-    finally:
-        os.unlink(name)
 
 def tail_file(filename):
-    ''' Tail a file using pygtail. Note: this could probably be improved '''
-    with make_temp_file() as offset_file:
+    ''' Follow a file: a generator of its lines (forever, as they're appended) '''
+    tail = LogTail(filename)
+    watcher = LogWatcher(os.path.dirname(os.path.abspath(filename)), suffix=os.path.basename(filename))
+    while True:
+        lines = tail.read_lines()
+        for line in lines:
+            yield line
+        if not lines:
+            watcher.wait(timeout=60)
+
+
+class BroTailIngest(object):
+    ''' Follows the Bro logs in a directory and appends their new rows to Workbench datasets '''
+
+    def __init__(self, workbench, log_dir, prefix=None, max_bytes=1024*1024):
+        ''' Initialization '''
+        self.workbench = workbench
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.tails = {}
+
+    def dataset_name(self, filename):
+        ''' The dataset for a log: conn.log goes to 'conn' (or 'prefix.conn') '''
+        name = os.path.basename(filename)[:-len('.log')]
+        return self.prefix + '.' + name if self.prefix else name
+
+    def ingest(self, filename):
+        ''' Append the new lines of a log to its dataset, returns the number of lines sent '''
+        name = self.dataset_name(filename)
+        tail = self.tails.get(filename)
+        if not tail:
+            dataset = self.workbench.get_dataset_info(name)
+            source = dataset['source'] if dataset and dataset['source'] else {}
+            tail = self.tails[filename] = LogTail(filename, source.get('inode'), source.get('offset', 0))
+        sent = 0
+        while True:
+            lines = tail.read_lines(self.max_bytes)
+            if not lines:
+                return sent
+            source = {'path': filename, 'inode': tail.inode, 'offset': tail.offset}
+            self.workbench.append_log_lines(name, lines, source)
+            sent += len(lines)
+
+    def run(self, timeout=60):
+        ''' Ingest the logs whenever the directory changes (also every timeout seconds, in case an event is missed) '''
+        watcher = LogWatcher(self.log_dir)
         while True:
-            for line in pygtail.Pygtail(filename, offset_file=offset_file):
-                yield line
-            time.sleep(1.0)    
-    
+            for child in sorted(os.listdir(self.log_dir)):
+                if child.endswith('.log'):
+                    sent = self.ingest(os.path.join(self.log_dir, child))
+                    if sent:
+                        print('%s: %d lines' % (self.dataset_name(child), sent))
+            watcher.wait(timeout)
 
-# Unit test: Test out the functionality on the syslog file
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log_dir', type=str, help='directory of the Bro logs (e.g. /usr/local/bro/logs/current)')
+    parser.add_argument('--prefix', type=str, default=None, help='dataset name prefix (e.g. the sensor name)')
+    parser.add_argument('-p', '--port', type=int, default=4242, help='port used by workbench server')
+    parser.add_argument('-s', '--server', type=str, default='tcp://127.0.0.1', help='location of workbench server')
+    args = parser.parse_args()
+
+    # Print out informative message
+    print('Tailing the Bro logs in %s into Workbench. Use ^C to stop this script...' % args.log_dir)
+
+    # Spin up workbench client
+    workbench = zerorpc.Client(timeout=300, heartbeat=60)
+    workbench.connect(args.server+':'+str(args.port))
+
+    # Follow the logs
+    try:
+        BroTailIngest(workbench, args.log_dir, args.prefix).run()
+    except KeyboardInterrupt:
+        print('Exiting...')
+        sys.exit()
+
+
+# Unit test: Follow a log as it's appended to, rotated and truncated
 def test():
-    
-    for line in tail_file('/var/log/system.log'):
-        print(line)
+    ''' tail_file test '''
+    import tempfile
+    import shutil
+    import gevent
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(temp_dir, 'conn.log')
+        with open(filename, 'wb') as log:
+            log.write(b'one\ntwo\nthr')
+        tail = LogTail(filename)
+        assert tail.read_lines() == ['one', 'two'] and tail.read_lines() == []
+
+        # The rest of a line, then pick up from a saved offset
+        with open(filename, 'ab') as log:
+            log.write(b'ee\nfour\n')
+        assert tail.read_lines() == ['three', 'four']
+        assert LogTail(filename, tail.inode, 8).read_lines() == ['three', 'four']
+
+        # Rotation: the rest of the old log first, then the new log from the start
+        with open(filename, 'ab') as log:
+            log.write(b'five\n')
+        os.rename(filename, filename + '.1')
+        with open(filename, 'wb') as log:
+            log.write(b'new one\n')
+        assert tail.read_lines() == ['five'] and tail.read_lines() == ['new one']
+
+        # Truncated in place, then a line longer than max_bytes
+        with open(filename, 'wb') as log:
+            log.write(b'x\n')
+        assert tail.read_lines() == ['x']
+        with open(filename, 'ab') as log:
+            log.write(b'y' * 100 + b'\n')
+        assert tail.read_lines(max_bytes=16) == ['y' * 100]
+        tail.close()
+
+        # The watcher wakes up for the logs that change (not for other files)
+        watcher = LogWatcher(temp_dir)
+        gevent.sleep(0.2)
+        with open(os.path.join(temp_dir, 'notes.txt'), 'w') as other:
+            other.write('not a log')
+        assert watcher.wait(timeout=1.5) == set()
+        with open(filename, 'ab') as log:
+            log.write(b'z\n')
+        assert watcher.wait(timeout=5) == set([filename])
+
+        # A log that's written all the time (never quiet) still wakes the watcher up (every max_wait)
+        def keep_writing(seconds):
+            for _ in range(int(seconds / 0.05)):
+                with open(filename, 'ab') as log:
+                    log.write(b'busy\n')
+                gevent.sleep(0.05)
+        writer = gevent.spawn(keep_writing, 3.5)
+        gevent.sleep(0.5)
+        watcher.wait(timeout=0)
+        assert watcher.wait(timeout=2.5) == set([filename]) and not writer.dead
+        writer.join()
+        gevent.killall(watcher.watcher.jobs)
+        watcher.watcher.jobs = []
+    finally:
+        shutil.rmtree(temp_dir)
 
 if __name__ == "__main__":
-    test()
+    main()
@@ -1,8 +1,11 @@
 
 ''' JSON Meta worker '''
+import codecs
 import json
 import pprint
 
+CHUNK_SIZE = 256*1024
+
 class JSONMetaData(object):
     ''' This worker computes meta-data for json files. '''
     dependencies = ['sample', 'meta']
@@ -13,19 +16,115 @@ class JSONMetaData(object):
 
     def execute(self, input_data):
         raw_bytes = input_data['sample']['raw_bytes']
+        if not isinstance(raw_bytes, bytes):
+            raw_bytes = raw_bytes.encode('utf-8')
+
+        # Take a peek at the JSON data: count the top level items in a single pass, feeding the
+        # sample to the decoder a chunk at a time and decoding one item at a time
+        view = memoryview(raw_bytes)
+        text = _JSONChunks(view[pos:pos+CHUNK_SIZE] for pos in range(0, len(view), CHUNK_SIZE))
+        container = text.peek()
+        if container not in ('[', '{'):
+            raise ValueError('Expecting a JSON list or dict, got %r' % bytes(view[:20]))
+        count = self._count_items(text)
 
-        # Take a peek at the JSON data
-        data = json.loads(raw_bytes)
-        self.meta['container'] = 'list' if isinstance(data, list) else 'dict'
-        if self.meta['container'] == 'list':
-            self.meta['list_length'] = len(data)
+        # More values after the first one? That's JSON lines (one value per line)
+        if text.peek():
+            num_values = 1
+            while text.peek():
+                text.value()
+                num_values += 1
+            self.meta['container'] = 'lines'
+            self.meta['list_length'] = num_values
+        elif container == '[':
+            self.meta['container'] = 'list'
+            self.meta['list_length'] = count
         else:
-            self.meta['num_keys'] = len(list(data.keys()))
+            self.meta['container'] = 'dict'
+            self.meta['num_keys'] = count
 
         # Pull in meta data info as well
         self.meta.update(input_data['meta'])
         return self.meta
 
+    def _count_items(self, text):
+        ''' Count the items of the list (or the keys of the dict) that starts at the next character '''
+        close = ']' if text.peek() == '[' else '}'
+        text.expect(text.peek())
+        if text.peek() == close:
+            text.expect(close)
+            return 0
+        count = 0
+        while True:
+            if close == '}':
+                text.value()
+                text.expect(':')
+            text.value()
+            count += 1
+            if text.peek() == close:
+                text.expect(close)
+                return count
+            text.expect(',')
+
+
+class _JSONChunks(object):
+    ''' Incremental JSON decoding over a stream of byte chunks (only the text not yet decoded is kept) '''
+
+    def __init__(self, chunks):
+        ''' Initialization '''
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.decoder = json.JSONDecoder()
+        self.text = ''
+        self.pos = 0
+        self.done = False
+
+    def peek(self):
+        ''' The next non-whitespace character ('' at the end of the stream) '''
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.text) or not self._more():
+                return self.text[self.pos:self.pos+1]
+
+    def expect(self, char):
+        ''' Skip past the next non-whitespace character (which has to be char) '''
+        if self.peek() != char:
+            raise ValueError('Expecting %r in the JSON data, got %r' % (char, self.peek()))
+        self.pos += 1
+
+    def value(self):
+        ''' Decode the next JSON value (reading more chunks until it's complete) '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+                # A number (or literal) at the end of the text might continue in the next chunk
+                if end < len(self.text) or not self._more():
+                    self.pos = end
+                    return value
+            except ValueError:
+                # Incomplete: at least double the text before trying again (a big value isn't decoded once per chunk)
+                if not self._more(len(self.text) - self.pos):
+                    raise
+
+    def _more(self, min_chars=0):
+        ''' Read chunks (at least min_chars more text), dropping the text we're done with, False at the end '''
+        if self.done:
+            return False
+        parts = [self.text[self.pos:]]
+        num_chars = 0
+        while True:
+            chunk = next(self.chunks, None)
+            self.done = chunk is None
+            parts.append(self.text_decoder.decode(chunk if chunk is not None else b'', self.done))
+            num_chars += len(parts[-1])
+            if self.done or num_chars >= min_chars:
+                break
+        self.text = ''.join(parts)
+        self.pos = 0
+        return True
+
 
 # Unit test: Create the class, the proper input and run the execute() method for a test
 def test():
@@ -12,6 +12,8 @@ from .rekall_adapter.rekall_adapter import RekallAdapter
 class MemoryImageDllList(object):
     ''' This worker computes dlllist for memory image files. '''
     dependencies = ['sample']
+    deadline = 600
+    isolated = True
 
     def __init__(self):
         ''' Initialization '''
@@ -15,6 +15,8 @@ from .rekall_adapter.rekall_adapter import RekallAdapter
 class MemoryImageMeta(object):
     ''' This worker computes meta-data for memory image files. '''
     dependencies = ['sample']
+    deadline = 600
+    isolated = True
 
     def __init__(self):
         ''' Initialization '''
@@ -17,6 +17,7 @@ from .rekall_adapter.rekall_adapter import RekallAdapter
 class MemoryImageProcDump(object):
     ''' This worker dumps process pe files from memory image files. '''
     dependencies = ['sample']
+    deadline = 600
 
     def __init__(self):
         ''' Initialization '''
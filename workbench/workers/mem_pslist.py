@@ -13,6 +13,8 @@ from .rekall_adapter.rekall_adapter import RekallAdapter
 class MemoryImagePSList(object):
     ''' This worker computes pslist-data for memory image files. '''
     dependencies = ['sample']
+    deadline = 600
+    isolated = True
 
     def __init__(self):
         ''' Initialization '''
@@ -18,6 +18,7 @@ class PcapBro(object):
     ''' This worker runs Bro scripts on a pcap file '''
     dependencies = ['sample']
     sample_set_input = True
+    deadline = 600
 
     def __init__(self):
         self.workbench = zerorpc.Client(timeout=300, heartbeat=60)
@@ -116,7 +117,14 @@ class PcapBro(object):
             sp = gevent.subprocess.Popen(exec_args, stdout=gevent.subprocess.PIPE, stderr=gevent.subprocess.PIPE)
         except OSError:
             raise RuntimeError('Could not run bro executable (either not installed or not in path): %s' % (exec_args))
-        out, err = sp.communicate()
+
+        # Kill Bro if the worker runs past its deadline (or is killed)
+        try:
+            out, err = sp.communicate()
+        except (gevent.Timeout, gevent.GreenletExit):
+            sp.kill()
+            sp.wait()
+            raise
         if out:
             print('standard output of subprocess: %s' % out)
         if err:
@@ -102,8 +102,8 @@ class PcapGraph(object):
         print('Entering http_log_graph...(%d rows)' % len(http_log))
         for row in http_log:
 
-            # Skip '-' hosts
-            if (row['id.orig_h'] == '-'):
+            # Skip unset hosts
+            if not row['id.orig_h']:
                 continue
 
             # Add the originating host
@@ -130,8 +130,8 @@ class PcapGraph(object):
         print('Entering dns_log_graph...(%d rows)' % len(dns_log))
         for row in dns_log:
             
-            # Skip '-' hosts
-            if (row['id.orig_h'] == '-'):
+            # Skip unset hosts
+            if not row['id.orig_h']:
                 continue
 
             # Add the originating host
@@ -144,7 +144,7 @@ class PcapGraph(object):
             self.add_rel(row['id.orig_h'], row['query'], 'dns_query')
 
             # Add the DNS answers as hosts and add the relationships
-            for answer in row['answers'].split(','):
+            for answer in row['answers'] or []:
                 self.add_node(answer, answer, ['host'])
                 self.add_rel(row['query'], answer, row['qtype_name'])
 
@@ -162,8 +162,8 @@ class PcapGraph(object):
         # Okay now make the weird node for each pair
         for pair in weird_pairs:
 
-            # Skip '-' hosts
-            if (pair[0] == '-'):
+            # Skip unset hosts
+            if not pair[0] or not pair[1]:
                 continue
 
             # Add the originating host
@@ -190,9 +190,9 @@ class PcapGraph(object):
             if row['mime_type'] not in self.exclude_mime_types:
 
                 # Check for weird conditions
-                if (row['total_bytes'] == '-'):
+                if row['total_bytes'] is None:
                     continue
-                if ('-' in row['md5']):
+                if not row['md5']:
                     continue
 
                 # Check for missing bytes
@@ -210,11 +210,10 @@ class PcapGraph(object):
                 # Add the file node
                 self.add_node(row['md5'], name, labels)
 
-                # Add the tx_host
-                self.add_node(row['tx_hosts'], row['tx_hosts'], ['host'])
-
-                # Add the file->tx_host relationship
-                self.add_rel(row['tx_hosts'], row['md5'], 'file')
+                # Add the tx_hosts and the file->tx_host relationships
+                for tx_host in row['tx_hosts'] or []:
+                    self.add_node(tx_host, tx_host, ['host'])
+                    self.add_rel(tx_host, row['md5'], 'file')
 
     def __del__(self):
         ''' Class Cleanup '''
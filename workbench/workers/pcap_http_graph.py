@@ -70,8 +70,8 @@ class PcapHTTPGraph(object):
         print('Entering http_log_graph...')
         for row in list(stream):
 
-            # Skip '-' hosts
-            if (row['id.orig_h'] == '-'):
+            # Skip unset hosts
+            if not row['id.orig_h']:
                 continue
 
             # Add the originating host
@@ -97,8 +97,8 @@ class PcapHTTPGraph(object):
         # Okay now make the weird node for each pair
         for pair in weird_pairs:
 
-            # Skip '-' hosts
-            if (pair[0] == '-'):
+            # Skip unset hosts
+            if not pair[0] or not pair[1]:
                 continue
 
             # Add the originating host
@@ -125,9 +125,9 @@ class PcapHTTPGraph(object):
             if row['mime_type'] not in self.exclude_mime_types:
 
                 # Check for weird conditions
-                if (row['total_bytes'] == '-'):
+                if row['total_bytes'] is None:
                     continue
-                if ('-' in row['md5']):
+                if not row['md5']:
                     continue
 
                 # Check for missing bytes and small file
@@ -147,11 +147,10 @@ class PcapHTTPGraph(object):
                 # Add the file node
                 self.add_node(row['md5'], name, labels)
 
-                # Add the tx_host
-                self.add_node(row['tx_hosts'], row['tx_hosts'], ['host'])
-
-                # Add the file->tx_host relationship
-                self.add_rel(row['tx_hosts'], row['md5'], 'file')
+                # Add the tx_hosts and the file->tx_host relationships
+                for tx_host in row['tx_hosts'] or []:
+                    self.add_node(tx_host, tx_host, ['host'])
+                    self.add_rel(tx_host, row['md5'], 'file')
 
     def __del__(self):
         ''' Class Cleanup '''
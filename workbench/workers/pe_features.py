@@ -10,6 +10,8 @@ class PEFileWorker(object):
         features out of a PE file using the python pefile module.
     '''
     dependencies = ['sample', 'tags']
+    deadline = 60
+    isolated = True
 
     def __init__(self, verbose=False):
         ''' Init method '''
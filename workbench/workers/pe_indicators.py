@@ -37,6 +37,8 @@ class PEIndicators(object):
         included as part of the checks that happen when 'execute' is called.
     '''
     dependencies = ['sample']
+    deadline = 60
+    isolated = True
 
     def __init__(self):
         ''' Init method of the Indicators class. '''
@@ -24,6 +24,8 @@ PEID_SIGS = get_peid_db()
 class PEIDWorker(object):
     ''' This worker looks up pe_id signatures for a PE file. '''
     dependencies = ['sample']
+    deadline = 60
+    isolated = True
 
     def __init__(self):
         self.peid_sigs = PEID_SIGS
@@ -6,6 +6,9 @@ class ViewPE(object):
     ''' Generates a high level summary view for PE files that incorporates a large set of workers '''
     dependencies = ['meta', 'strings', 'pe_peid', 'pe_indicators', 'pe_classifier', 'yara_sigs']
 
+    # When these fail (or are failing too often) we still produce a view without them
+    optional_dependencies = ['pe_peid', 'pe_classifier', 'yara_sigs']
+
     def execute(self, input_data):
         ''' Execute the ViewPE worker '''
 
@@ -15,9 +18,11 @@ class ViewPE(object):
 
         view = {}
         view['indicators'] = list(set([item['category'] for item in input_data['pe_indicators']['indicator_list']]))
-        view['peid_matches'] = input_data['pe_peid']['match_list']
-        view['yara_sigs'] = list(input_data['yara_sigs']['matches'].keys())
-        view['classification'] = input_data['pe_classifier']['classification']
+
+        # Optional dependencies are {} when they failed
+        view['peid_matches'] = input_data['pe_peid'].get('match_list', 'plugin_failed')
+        view['yara_sigs'] = list(input_data['yara_sigs']['matches'].keys()) if input_data['yara_sigs'] else 'plugin_failed'
+        view['classification'] = input_data['pe_classifier'].get('classification', 'plugin_failed')
         view['disass'] = self.safe_get(input_data, ['pe_disass', 'decode'])[:15]
         view.update(input_data['meta'])
 
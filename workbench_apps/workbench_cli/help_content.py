@@ -65,7 +65,9 @@ class WorkbenchShellHelp(object):
         help += '\n\t%s> http_df = pd.DataFrame(http_log)' % (color.LightBlue)
         help += '\n\t%s> http_df.head()' % (color.LightBlue)
         help += '\n\t%s> http_df.groupby([\'host\',\'id.resp_h\',\'resp_mime_types\'])[[\'response_body_len\']].sum()' % (color.LightBlue)
-        help += '\n\t%s> http_df.describe() %s' % (color.LightBlue, color.Normal)
+        help += '\n\t%s> http_df.describe()' % (color.LightBlue)
+        help += '\n\n%sBig logs: pull the http_log straight into a (typed) dataframe:'  % (color.Green)
+        help += '\n\t%s> http_df = pull_bro_df(http_log_md5) %s' % (color.LightBlue, color.Normal)
         return help
 
     def help_dataframe_memory(self):
@@ -15,6 +15,7 @@ from traitlets.config import Config
 
 try:
     import pandas as pd
+    import numpy as np
 except ImportError:
     print('\n%sNotice: pandas not found...' % color.Yellow)
     print('\t%sWe recommend installing pandas: %s$ pip install pandas%s' % (color.LightBlue, color.Red, color.Normal))
@@ -190,6 +191,41 @@ class WorkbenchShell(object):
         except zerorpc.exceptions.RemoteError as e:
             return repr_to_str_decorator.r_to_s(self._data_not_found)(e)
 
+    def pull_bro_df(self, md5, chunk_size=100000):
+        """Pull a Bro log into a dataframe (using the column chunks of stream_columns)
+            Args:
+                md5: the md5 of the Bro log
+                chunk_size: the number of rows the server sends at a time
+            Returns:
+                The dataframe (times are datetime64, counts int64, addresses categoricals)
+        """
+        frames, bro_types = [], {}
+        try:
+            for chunk in self.workbench.stream_columns(md5, {'chunk_size': chunk_size}):
+                frames.append(self._unpack_columns(chunk))
+                bro_types = chunk['types']
+        except zerorpc.exceptions.RemoteError as e:
+            return repr_to_str_decorator.r_to_s(self._data_not_found)(e)
+        if not frames:
+            return pd.DataFrame()
+        _df = pd.concat(frames, ignore_index=True)
+        for column, bro_type in bro_types.items():
+            if bro_type in ('addr', 'enum'):
+                _df[column] = _df[column].astype('category')
+        return _df
+
+    def _unpack_columns(self, chunk):
+        """Internal: Turn a column chunk from stream_columns into a dataframe"""
+        columns = {}
+        for name in chunk['fields']:
+            column = chunk['columns'][name]
+            if column['dtype'] == 'object':
+                columns[name] = np.empty(len(column['data']), dtype=object)
+                columns[name][:] = column['data']
+            else:
+                columns[name] = np.frombuffer(column['data'], dtype=column['dtype'])
+        return pd.DataFrame(columns, columns=chunk['fields'])
+
     def vectorize(self, df, column_name):
         """Vectorize a column in the dataframe"""
         vec_df = df[column_name].str.join(sep='-').str.get_dummies(sep='-')
@@ -349,7 +385,9 @@ class WorkbenchShell(object):
             'help': self._help,
             'load_sample': self.load_sample,
             'pull_df': self.pull_df,
+            'pull_bro_df': self.pull_bro_df,
             'flatten': self.flatten,
+            'flatten_batches': client_helper.flatten_batches,
             'vectorize': self.vectorize,
             'top_corr': self.top_corr,
             'tags': self.tags,